@@ -0,0 +1,137 @@
+import sys
+import numpy
+import pytest
+import loopy as lp
+import pyopencl as cl
+import pyopencl.array  # noqa: F401
+import numloopy as nplp
+from loopy.version import LOOPY_USE_LANGUAGE_VERSION_2018_2  # noqa: F401
+
+from graphs import GRAPHS
+
+from pyopencl.tools import pytest_generate_tests_for_pyopencl \
+        as pytest_generate_tests
+
+
+__doc__ = """
+Benchmarks of the phases turning a graph into results, run with
+`pytest-benchmark <https://pytest-benchmark.readthedocs.io>`_::
+
+    python -m pytest benchmarks/bench_pipeline.py
+
+The phases are benchmarked separately: building the stack, finalizing it
+with :meth:`numloopy.Stack.end_computation_stack`, generating the code with
+loopy, and executing the kernel, along with :mod:`numpy` computing the same
+results. The benchmarks are grouped by phase, and the executions by graph,
+so that the kernel and :mod:`numpy` are compared side by side.
+Any OpenCL implementation works, e.g. pocl on CPUs, selected as for the
+tests through ``PYOPENCL_TEST``.
+"""
+
+
+__all__ = [
+        "pytest_generate_tests",
+        "cl"  # 'cl.create_some_context'
+        ]
+
+
+# problem sizes, large enough for the executions to dominate the overheads
+SIZES = {
+        "axpy": 2**20,
+        "broadcast": 128,
+        "matmul": 128,
+        "reshape": 2**20,
+        "quadrant_splitting": 2**14,
+        "wide_tree": 2**12,
+        "deep_chain": 2**16,
+        }
+
+
+def build_stack(name):
+    np = nplp.begin_computation_stack()
+    inputs, outputs = GRAPHS[name](SIZES[name]).build(np)
+
+    return np, inputs, outputs
+
+
+@pytest.fixture
+def no_loopy_caching():
+    # otherwise only the first round would generate the code
+    lp.set_caching_enabled(False)
+    yield
+    lp.set_caching_enabled(True)
+
+
+@pytest.mark.parametrize("name", sorted(GRAPHS))
+def test_build(benchmark, name):
+    benchmark.group = "build"
+    benchmark(build_stack, name)
+
+
+@pytest.mark.parametrize("name", sorted(GRAPHS))
+def test_end_computation_stack(benchmark, name):
+    benchmark.group = "end_computation_stack"
+
+    def setup():
+        # a fresh stack per round, as a stack reuses its last finalization
+        np, inputs, outputs = build_stack(name)
+        return (np, outputs), {}
+
+    def finalize(np, outputs):
+        return np.end_computation_stack(outputs, cache=False)
+
+    benchmark.pedantic(finalize, setup=setup, rounds=10)
+
+
+@pytest.mark.parametrize("transform", [False, "auto"])
+@pytest.mark.parametrize("name", sorted(GRAPHS))
+def test_codegen(benchmark, no_loopy_caching, name, transform):
+    benchmark.group = "codegen"
+    np, inputs, outputs = build_stack(name)
+    knl = np.end_computation_stack(outputs, cache=False,
+            transform=transform)
+    if transform is False:
+        # the types of the arrays materialized by the stack
+        knl = lp.infer_unknown_types(knl, expect_completion=True)
+
+    benchmark(lp.generate_code_v2, knl)
+
+
+@pytest.mark.parametrize("transform", [False, "auto"])
+@pytest.mark.parametrize("name", sorted(GRAPHS))
+def test_execute(benchmark, ctx_factory, name, transform):
+    benchmark.group = "execute-" + name
+    queue = cl.CommandQueue(ctx_factory())
+
+    np, inputs, outputs = build_stack(name)
+    knl = np.compile(inputs=inputs, outputs=outputs, transform=transform)
+
+    graph = GRAPHS[name](SIZES[name])
+    inputs = graph.make_inputs()
+    args = [cl.array.to_device(queue, ary) for ary in inputs]
+
+    # generates the code and builds the program
+    evt, results = knl(queue, *args)
+    for result, expected in zip(results, graph.numpy_func(*inputs)):
+        assert numpy.allclose(result.get(), expected)
+
+    def execute():
+        evt, results = knl(queue, *args)
+        evt.wait()
+
+    benchmark(execute)
+
+
+@pytest.mark.parametrize("name", sorted(GRAPHS))
+def test_execute_numpy(benchmark, name):
+    benchmark.group = "execute-" + name
+    graph = GRAPHS[name](SIZES[name])
+    benchmark(graph.numpy_func, *graph.make_inputs())
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        exec(sys.argv[1])
+    else:
+        from pytest import main
+        main([__file__])
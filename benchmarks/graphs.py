@@ -0,0 +1,189 @@
+import numpy
+
+
+__doc__ = """
+The graphs benchmarked by :mod:`bench_pipeline`. Every graph is a function
+of a problem size ``n`` returning a :class:`Graph`.
+
+.. autoclass:: Graph
+"""
+
+
+class Graph(object):
+    """
+    .. attribute:: build
+
+        A callable registering the graph on the stack passed to it and
+        returning a tuple ``inputs, outputs`` of the variables bound to the
+        inputs and of the evaluated variables.
+
+    .. attribute:: make_inputs
+
+        A callable returning a :class:`list` of :class:`numpy.ndarray` for
+        the inputs of the graph.
+
+    .. attribute:: numpy_func
+
+        A callable computing the outputs with :mod:`numpy` from the arrays
+        returned by :attr:`make_inputs`.
+    """
+    def __init__(self, build, make_inputs, numpy_func):
+        self.build = build
+        self.make_inputs = make_inputs
+        self.numpy_func = numpy_func
+
+
+def axpy(n):
+    def build(np):
+        a = np.ones(n)
+        b = np.arange(n)
+        return (), (a, 2*a + 3*b)
+
+    def numpy_func():
+        a = numpy.ones(n)
+        b = numpy.arange(n)
+        return a, 2*a + 3*b
+
+    return Graph(build, list, numpy_func)
+
+
+def broadcast(n):
+    def build(np):
+        A = np.arange(n*n).reshape((n, n))
+        x = np.arange(n)
+        return (), (np.sum(A * x, axis=1), )
+
+    def numpy_func():
+        A = numpy.arange(n*n).reshape((n, n))
+        x = numpy.arange(n)
+        return numpy.sum(A * x, axis=1),
+
+    return Graph(build, list, numpy_func)
+
+
+def matmul(n):
+    def build(np):
+        A = np.argument((n, n))
+        B = np.argument((n, n))
+        return (A, B), (A @ B, )
+
+    def make_inputs():
+        return [numpy.random.rand(n, n), numpy.random.rand(n, n)]
+
+    def numpy_func(A, B):
+        return A @ B,
+
+    return Graph(build, make_inputs, numpy_func)
+
+
+def reshape(n):
+    def build(np):
+        a = np.arange(2*n)
+        return (), (a.reshape((2, n), order='F') + 1, )
+
+    def numpy_func():
+        a = numpy.arange(2*n)
+        return a.reshape((2, n), order='F') + 1,
+
+    return Graph(build, list, numpy_func)
+
+
+def quadrant_splitting(n):
+    def split(np, x, x_new):
+        midpoint = np.sum(x, axis=0)/x.shape[0]
+
+        is_left = x[:, 0] < midpoint[0]
+        is_lower = x[:, 1] < midpoint[1]
+
+        is_ll = is_lower*is_left
+        is_ul = (1-is_lower)*is_left
+        is_lr = is_lower*(1-is_left)
+        is_ur = (1-is_lower)*(1-is_left)
+
+        num_ll = np.sum(is_ll)
+        num_ul = np.sum(is_ul)
+        num_lr = np.sum(is_lr)
+
+        idx_ll = np.cumsum(is_ll)*(is_ll)
+        idx_ul = (np.cumsum(is_ul) + num_ll)*(is_ul)
+        idx_lr = (np.cumsum(is_lr) + num_ll + num_ul)*(is_lr)
+        idx_ur = (np.cumsum(is_ur) + num_ll + num_ul + num_lr)*(is_ur)
+
+        indices = idx_ll + idx_ul + idx_lr + idx_ur - 1
+        x_new[indices, :] = x
+
+        return x_new
+
+    def build(np):
+        x = np.argument((n, 2))
+        x_new = split(np, x, np.argument((n, 2)))
+        return (x, ), (x_new, )
+
+    def make_inputs():
+        return [numpy.random.randn(n, 2)]
+
+    def numpy_func(x):
+        return split(numpy, x, numpy.empty_like(x)),
+
+    return Graph(build, make_inputs, numpy_func)
+
+
+def wide_tree(n, n_leaves=128):
+    """
+    A synthetic graph summing ``n_leaves`` arguments pairwise, i.e. a graph
+    of about ``2*n_leaves`` operations of depth ``log2(n_leaves)``.
+    """
+    def build(np):
+        leaves = [np.argument(n) for _ in range(n_leaves)]
+        level = leaves
+        while len(level) > 1:
+            level = [(level[i] + level[i+1])*0.5 for i in range(0,
+                len(level), 2)]
+        return tuple(leaves), tuple(level)
+
+    def make_inputs():
+        return [numpy.random.rand(n) for _ in range(n_leaves)]
+
+    def numpy_func(*leaves):
+        level = list(leaves)
+        while len(level) > 1:
+            level = [(level[i] + level[i+1])*0.5 for i in range(0,
+                len(level), 2)]
+        return tuple(level)
+
+    return Graph(build, make_inputs, numpy_func)
+
+
+def deep_chain(n, depth=20):
+    """
+    A synthetic graph of ``depth`` dependent element-wise operations
+    followed by a reduction.
+    """
+    def build(np):
+        x = np.argument(n)
+        y = x
+        for i in range(depth):
+            y = y*1.0001 + i
+        return (x, ), (y, np.sum(y))
+
+    def make_inputs():
+        return [numpy.random.rand(n)]
+
+    def numpy_func(x):
+        y = x
+        for i in range(depth):
+            y = y*1.0001 + i
+        return y, numpy.sum(y)
+
+    return Graph(build, make_inputs, numpy_func)
+
+
+GRAPHS = {
+        "axpy": axpy,
+        "broadcast": broadcast,
+        "matmul": matmul,
+        "reshape": reshape,
+        "quadrant_splitting": quadrant_splitting,
+        "wide_tree": wide_tree,
+        "deep_chain": deep_chain,
+        }
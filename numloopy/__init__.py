@@ -3,6 +3,12 @@ from __future__ import absolute_import, division
 
 from numloopy.stack import begin_computation_stack, Stack
 from numloopy.array import ArraySymbol
+from numloopy.cache import KernelCache
+from numloopy.compiled import CompiledKernel, CompiledProgram
+from numloopy.stats import BuildStats, collect_stats
+from numloopy.transform import (fuse_reductions, realize_scans,
+        tile_contractions, tile_transposes, autoparallelize, demote_internal_arrays,
+        split_kernel)
 
 __all__ = [
         'begin_computation_stack',
@@ -10,4 +16,20 @@ __all__ = [
         'Stack',
 
         'ArraySymbol',
+
+        'KernelCache',
+
+        'CompiledKernel',
+        'CompiledProgram',
+
+        'BuildStats',
+        'collect_stats',
+
+        'fuse_reductions',
+        'realize_scans',
+        'tile_contractions',
+        'tile_transposes',
+        'autoparallelize',
+        'demote_internal_arrays',
+        'split_kernel',
         ]
@@ -1,16 +1,89 @@
 import loopy as lp
 import numpy as np
-from numbers import Number
-import islpy as isl
-from pymbolic.primitives import Variable, Call, Subscript
+from numbers import Number, Integral
+from pymbolic.primitives import Variable, Subscript, Quotient
 from pymbolic import parse
-from loopy.isl_helpers import make_slab, simplify_via_aff
+from loopy.isl_helpers import simplify_via_aff
+from loopy.symbolic import get_dependencies
+from numloopy.symbolic import normalize_shape, make_box_domain
+from numloopy.dtypes import BOOL_DTYPE, get_numpy_dtype, get_result_dtype
 
 __doc__ = """
 .. autoclass:: ArraySymbol
 """
 
 
+def _normalize_axis(axis, ndim):
+    """
+    Returns the axis ``axis`` of an array of ``ndim`` axes counted from the
+    first axis.
+    """
+    if not -ndim <= axis < ndim:
+        raise ValueError("axis {} is out of bounds for an array of dimension"
+                " {}".format(axis, ndim))
+    return axis % ndim
+
+
+def _normalize_index(idx, axis_len):
+    """
+    Returns the integer index ``idx`` into an axis of length ``axis_len``
+    counted from the start of the axis.
+    """
+    if isinstance(axis_len, int) and not -axis_len <= idx < axis_len:
+        raise IndexError("index {} is out of bounds for an axis of length {}"
+                .format(idx, axis_len))
+    if idx < 0:
+        return axis_len + idx
+    return idx
+
+
+def _get_slice_range(slc, axis_len):
+    """
+    Returns a tuple ``start, step, length`` of the elements of an axis of
+    length ``axis_len`` selected by the slice ``slc``, such that the element
+    ``i`` of the slice is the element ``start + step*i`` of the axis.
+    """
+    if isinstance(axis_len, int):
+        start, stop, step = slc.indices(axis_len)
+        return start, step, len(range(start, stop, step))
+
+    # the slice cannot be clipped to the symbolic length, and is assumed to
+    # be within the axis
+    step = 1 if slc.step is None else slc.step
+    if step not in (1, -1):
+        raise NotImplementedError("slicing an axis of symbolic length with"
+                " a step other than 1 or -1")
+
+    def _from_start(bound):
+        if bound < 0:
+            return axis_len + bound
+        return bound
+
+    if step == 1:
+        start = 0 if slc.start is None else _from_start(slc.start)
+        stop = axis_len if slc.stop is None else _from_start(slc.stop)
+        length = stop - start
+    else:
+        start = axis_len - 1 if slc.start is None else _from_start(slc.start)
+        stop = -1 if slc.stop is None else _from_start(slc.stop)
+        length = start - stop
+
+    # simplified, so that the lengths of the slices compare equal
+    return simplify_via_aff(start), step, simplify_via_aff(length)
+
+
+def _get_range_assumptions(lower, upper, axis_len):
+    """
+    Returns the expressions in the parameters of the symbolic length
+    ``axis_len`` which are non-negative if the indices from ``lower`` to
+    ``upper`` (excluded) are within the axis, see
+    :attr:`numloopy.Stack.assumptions`.
+    """
+    exprs = (simplify_via_aff(expr) for expr in (upper - lower, lower,
+        axis_len - upper))
+    return set(expr for expr in exprs if get_dependencies(expr))
+
+
 class ArraySymbol(lp.ArrayArg):
     """
     User facing view of a substitution registered on a stack.
@@ -21,7 +94,8 @@ class ArraySymbol(lp.ArrayArg):
 
     .. attribute shape::
 
-        An instance of :class:`tuple` of ints.
+        An instance of :class:`tuple` of axis lengths, each an instance of
+        :class:`int` or a symbolic length (see :meth:`Stack.argument`).
 
     .. attribute dim_tags::
 
@@ -34,12 +108,18 @@ class ArraySymbol(lp.ArrayArg):
         data access pattern.
 
     .. automethod:: __init__
+    .. automethod:: _call
     .. automethod:: _arithmetic_op
     .. automethod:: reshape
+    .. automethod:: transpose
+    .. autoattribute:: T
+    .. automethod:: swapaxes
+    .. automethod:: moveaxis
     .. automethod:: __add__
     .. automethod:: __sub__
     .. automethod:: __mul__
     .. automethod:: __truediv__
+    .. automethod:: __matmul__
     .. automethod:: __lt__
     .. automethod:: __gt__
     .. automethod:: __setitem__
@@ -67,62 +147,94 @@ class ArraySymbol(lp.ArrayArg):
 
         super(ArraySymbol, self).__init__(*args, **kwargs)
 
+    def _call(self, indices):
+        """
+        Returns an invocation of the substitution of the array at
+        ``indices``. The substitutions of the arrays of shape ``(1,)``
+        reduced along all the axes of an array take no arguments, and are
+        invoked without ``indices``.
+        """
+        if not self.stack.get_substitution(self.name).arguments:
+            return Variable(self.name)()
+        return Variable(self.name)(*indices)
+
     def _arithmetic_op(self, other, op):
         """
         Registers a substitution rule that performs ``(self) op (other)``
-        element-wise for the arrays. :mod:`numpy` broadcasting rules are
-        followed while performing these operations.
+        element-wise for the arrays. :mod:`numpy` broadcasting and type
+        promotion rules are followed while performing these operations, see
+        :func:`numloopy.dtypes.get_result_dtype`. Comparisons result in
+        arrays of :data:`numloopy.dtypes.BOOL_DTYPE`.
 
         :return: An instance of :class:`ArraySymbol` corresponding to the
             registered substitution for the element-wise operation.
         """
         assert op in ['+', '-', '*', '/', '<', '<=', '>', '>=']
-        assert self.stack == other.stack
+
+        common_dtype = get_result_dtype(self, other)
+        if op == '/' and common_dtype.kind not in "fc":
+            common_dtype = np.dtype(np.float64)
+
+        def _cast(expr, operand):
+            # the operands are converted to the floating type of the result,
+            # as numpy does, e.g. the product of int32 and float32 arrays is
+            # computed in float64 rather than in float32 as in C. The
+            # conversion is an exact division by one, as the substitutions
+            # expanded by loopy cannot contain a loopy.symbolic.TypeCast, and
+            # the products with one are flattened away by pymbolic.
+            if (get_numpy_dtype(operand) == common_dtype
+                    or common_dtype.kind not in "fc"):
+                return expr
+            return Quotient(expr, common_dtype.type(1))
 
         def _apply_op(var1, var2):
+            if isinstance(var2, Number):
+                # a constant of the type of the result, so that loopy infers
+                # the type of the expression as numpy does
+                var2 = common_dtype.type(var2)
             if op == '+':
-                return var1+var2, self.dtype
+                return var1+var2, common_dtype
             if op == '-':
-                return var1-var2, self.dtype
+                return var1-var2, common_dtype
             if op == '*':
-                return var1*var2, self.dtype
+                return var1*var2, common_dtype
             if op == '/':
-                return var1/var2, self.dtype
+                return var1/var2, common_dtype
             if op == '<':
-                return var1.lt(var2), np.int
+                return var1.lt(var2), BOOL_DTYPE
             if op == '<=':
-                return var1.le(var2), np.int
+                return var1.le(var2), BOOL_DTYPE
             if op == '>':
-                return var1.gt(var2), np.int
+                return var1.gt(var2), BOOL_DTYPE
             if op == '>=':
-                return var1.ge(var2), np.int
+                return var1.ge(var2), BOOL_DTYPE
             raise RuntimeError()
 
         if isinstance(other, Number):
             inames = tuple(
                    self.stack.name_generator(based_on='i') for _ in
                    self.shape)
-            rhs, dtype = _apply_op(Call(function=Variable(self.name),
-                    parameters=tuple(Variable(iname) for iname in inames)),
-                    other)
-            subst_name = self.stack.name_generator(based_on='subst')
-            self.stack.register_substitution(lp.SubstitutionRule(subst_name,
-                    inames, rhs))
+            rhs, dtype = _apply_op(_cast(self._call(tuple(Variable(iname) for
+                iname in inames)), self), other)
+            subst_name = self.stack.register_substitution(
+                    lp.SubstitutionRule(
+                        self.stack.name_generator(based_on='subst'),
+                        inames, rhs), self.shape, dtype=dtype)
             return self.copy(name=subst_name,
                 dtype=dtype)
         elif isinstance(other, ArraySymbol):
+            assert self.stack == other.stack
             if self.shape == other.shape:
                 inames = tuple(
                        self.stack.name_generator(based_on='i') for _ in
                        self.shape)
-                rhs, dtype = _apply_op(
-                        Variable(self.name)(*tuple(Variable(iname) for iname in
-                            inames)),
-                        Variable(other.name)(*tuple(Variable(iname) for iname
-                            in inames)))
-                subst_name = self.stack.name_generator(based_on='subst')
-                self.stack.register_substitution(lp.SubstitutionRule(subst_name,
-                        inames, rhs))
+                indices = tuple(Variable(iname) for iname in inames)
+                rhs, dtype = _apply_op(_cast(self._call(indices), self),
+                        _cast(other._call(indices), other))
+                subst_name = self.stack.register_substitution(
+                        lp.SubstitutionRule(
+                            self.stack.name_generator(based_on='subst'),
+                            inames, rhs), self.shape, dtype=dtype)
                 return self.copy(name=subst_name, dtype=dtype)
             else:
                 left = self
@@ -171,7 +283,8 @@ class ArraySymbol(lp.ArrayArg):
                     rule = lp.SubstitutionRule(subst_name,
                             inames,
                             Variable(left.name)(*indices))
-                    self.stack.register_substitution(rule)
+                    subst_name = self.stack.register_substitution(rule,
+                            new_shape, dtype=get_numpy_dtype(left))
                     new_left = left.copy(name=subst_name,
                             shape=new_shape, dim_tags=None, order=left.order)
                 else:
@@ -194,7 +307,8 @@ class ArraySymbol(lp.ArrayArg):
                     rule = lp.SubstitutionRule(subst_name,
                             inames,
                             Variable(right.name)(*indices))
-                    self.stack.register_substitution(rule)
+                    subst_name = self.stack.register_substitution(rule,
+                            new_shape, dtype=get_numpy_dtype(right))
                     new_right = right.copy(name=subst_name,
                             shape=new_shape, dim_tags=None, order=right.order)
                 else:
@@ -252,6 +366,16 @@ class ArraySymbol(lp.ArrayArg):
         """
         return self._arithmetic_op(other, '/')
 
+    def __matmul__(self, other):
+        """
+        Registers a computation for ``self@other``. Calls
+        :meth:`numloopy.Stack.matmul` in the backend.
+
+        :arg other: An instance of :class:`numloopy.ArraySymbol`.
+        """
+        assert self.stack == other.stack
+        return self.stack.matmul(self, other)
+
     def __lt__(self, other):
         """
         Registers a computation for ``self<other``. Calls
@@ -302,14 +426,7 @@ class ArraySymbol(lp.ArrayArg):
                 .join(inames))), expression=parse('{}({})'.format(self.name, ', '
                     .join(inames))))
             self.stack.register_implicit_assignment(insn)
-
-            space = isl.Space.create_from_names(isl.DEFAULT_CONTEXT, inames)
-            domain = isl.BasicSet.universe(space)
-
-            for iname_name, axis_length in zip(inames, self.shape):
-                domain &= make_slab(space, iname_name, 0, axis_length)
-
-            self.stack.domains.append(domain)
+            self.stack.domains.append(make_box_domain(inames, self.shape))
 
         # now handling the second assignment
 
@@ -318,13 +435,7 @@ class ArraySymbol(lp.ArrayArg):
                     *tuple((self.stack.name_generator(based_on="i"), axis_len) for
                     idx, axis_len in zip(index, self.shape)
                     if isinstance(idx, slice) or isinstance(idx, ArraySymbol)))
-            space = isl.Space.create_from_names(isl.DEFAULT_CONTEXT, inames)
-            domain = isl.BasicSet.universe(space)
-
-            for iname_name, axis_length in zip(inames, iname_lens):
-                domain &= make_slab(space, iname_name, 0, axis_length)
-
-            self.stack.domains.append(domain)
+            self.stack.domains.append(make_box_domain(inames, iname_lens))
         except ValueError:
             inames = ()
             iname_lens = ()
@@ -361,28 +472,118 @@ class ArraySymbol(lp.ArrayArg):
             rule = lp.SubstitutionRule(subst_name, inames,
                     expression=Subscript(Variable(arg_name),
                         tuple(Variable(iname) for iname in inames)))
-            self.stack.register_substitution(rule)
+            subst_name = self.stack.register_substitution(rule, self.shape,
+                    dtype=get_numpy_dtype(self))
             self.stack.data.append(self.copy(name=arg_name))
 
             self.stack.substs_to_arrays[subst_name] = arg_name
             self.name = subst_name
 
+    def transpose(self, *axes):
+        """
+        Registers a substitution rule viewing the array with its axes
+        permuted. Mimics :meth:`numpy.ndarray.transpose`: the axis ``i`` of
+        the view is the axis ``axes[i]`` of the array, and the axes are
+        reversed if ``axes`` are not given. No element is copied.
+
+        :arg axes: The permutation of the axes, either as integers or as a
+            single :class:`tuple`.
+        """
+        ndim = len(self.shape)
+        if len(axes) == 1 and isinstance(axes[0], (tuple, list)):
+            axes, = axes
+        if not axes:
+            axes = tuple(range(ndim))[::-1]
+        axes = tuple(_normalize_axis(axis, ndim) for axis in axes)
+        if sorted(axes) != list(range(ndim)):
+            raise ValueError("axes don't match array")
+
+        if axes == tuple(range(ndim)):
+            return self
+
+        inames = tuple(self.stack.name_generator(based_on="i") for _ in axes)
+        # the view's axis i is indexed by inames[i], i.e. the array's axis
+        # axes[i] is
+        indices = [None]*ndim
+        for iname, axis in zip(inames, axes):
+            indices[axis] = Variable(iname)
+        shape = tuple(self.shape[axis] for axis in axes)
+
+        rule = lp.SubstitutionRule(self.stack.name_generator(based_on="subst"),
+                inames, self._call(tuple(indices)))
+        subst_name = self.stack.register_substitution(rule, shape,
+                dtype=get_numpy_dtype(self))
+
+        return ArraySymbol(stack=self.stack, name=subst_name, shape=shape,
+                dtype=self.dtype)
+
+    @property
+    def T(self):  # noqa: N802
+        """
+        The view of the array with its axes reversed, see :meth:`transpose`.
+        """
+        return self.transpose()
+
+    def swapaxes(self, axis1, axis2):
+        """
+        Registers a substitution rule viewing the array with the axes
+        ``axis1`` and ``axis2`` interchanged. Mimics
+        :meth:`numpy.ndarray.swapaxes`.
+        """
+        ndim = len(self.shape)
+        axes = list(range(ndim))
+        axis1, axis2 = _normalize_axis(axis1, ndim), _normalize_axis(axis2,
+                ndim)
+        axes[axis1], axes[axis2] = axes[axis2], axes[axis1]
+
+        return self.transpose(tuple(axes))
+
+    def moveaxis(self, source, destination):
+        """
+        Registers a substitution rule viewing the array with the axes
+        ``source`` moved to the positions ``destination``, the other axes
+        remaining in their order. Mimics :func:`numpy.moveaxis`.
+
+        :arg source: An instance of :class:`int`, or a sequence of them.
+        :arg destination: An instance of :class:`int`, or a sequence of them
+            of the length of ``source``.
+        """
+        ndim = len(self.shape)
+        if isinstance(source, Integral):
+            source = (source, )
+        if isinstance(destination, Integral):
+            destination = (destination, )
+        source = [_normalize_axis(axis, ndim) for axis in source]
+        destination = [_normalize_axis(axis, ndim) for axis in destination]
+        if len(source) != len(destination):
+            raise ValueError("source and destination must have the same "
+                    "number of elements")
+
+        axes = [axis for axis in range(ndim) if axis not in source]
+        for dest, src in sorted(zip(destination, source)):
+            axes.insert(dest, src)
+
+        return self.transpose(tuple(axes))
+
     def reshape(self, new_shape, order='C'):
         """
         Registers a substitution rule to reshape array with the shape
         ``new_shape``. Mimics :func:`numpy.ndarray.reshape`.
 
-        :arg new_shape: An instance of :class:`tuple` of :class:`int`.
+        :arg new_shape: An instance of :class:`tuple` of axis lengths, see
+            :meth:`Stack.argument`. Only the slowest varying axes of the
+            array and of the reshaped array may have symbolic lengths, so that
+            the strides are constant.
         :arg order: Either 'C' or 'F'
         """
+        new_shape = normalize_shape(new_shape)
         # need an error here complain if there is a shape mismatch
         # how to do this:
         # look at how loopy sets its dim tags, from shape and order.
-        subst_name = self.stack.name_generator(based_on='subst')
         inames = tuple(self.stack.name_generator(based_on="i") for _ in new_shape)
         new_arg = self.copy(
                 stack=self.stack,
-                name=subst_name,
+                name=self.stack.name_generator(based_on='subst'),
                 shape=new_shape,
                 dim_tags=None,
                 order=order)
@@ -390,6 +591,10 @@ class ArraySymbol(lp.ArrayArg):
         linearized_idx = sum(Variable(iname)*dim_tag.stride for iname, dim_tag in
                 zip(inames, new_arg.dim_tags))
         strides = tuple(dim_tag.stride for dim_tag in self.dim_tags)
+        if not all(isinstance(stride, int) for stride in strides + tuple(
+                dim_tag.stride for dim_tag in new_arg.dim_tags)):
+            raise NotImplementedError("reshaping along an axis with a"
+                    " symbolic stride")
         if self.dim_tags[0].stride == 1:
             pass
         elif self.dim_tags[-1].stride == 1:
@@ -406,52 +611,81 @@ class ArraySymbol(lp.ArrayArg):
         # should we assert that the linearized index is 0?
 
         rule = lp.SubstitutionRule(
-                subst_name,
+                new_arg.name,
                 inames,
                 expression=Variable(self.name)(*tuple(indices)))
 
-        self.stack.register_substitution(rule)
+        subst_name = self.stack.register_substitution(rule, new_shape,
+                dtype=get_numpy_dtype(self))
 
-        return ArraySymbol(stack=self.stack, name=subst_name, shape=new_shape)
+        return ArraySymbol(stack=self.stack, name=subst_name, shape=new_shape,
+                dtype=self.dtype)
 
     def __getitem__(self, index):
         """
-        Registers a substitution rule pointing to the indices through `index`.
-
-        :arg index: An instance of :class:`tuple` of int, slices or
-            :class:`ArraySymbol`.
+        Registers a substitution rule viewing the elements of the array
+        selected by ``index``, following the basic indexing of
+        :mod:`numpy`. No element is copied, as the substitution maps the
+        indices of the view to the indices of the array.
+
+        :arg index: An instance of :class:`int`, :class:`slice`,
+            :data:`Ellipsis`, *None* (a new axis of length 1), or a
+            :class:`tuple` of them. Negative integers and the bounds of the
+            slices count from the end of the axis. The axes of symbolic
+            lengths can only be sliced with steps 1 or -1, and the kernels
+            assume that their indices are within the axes, see
+            :attr:`numloopy.Stack.assumptions`.
         """
-        if isinstance(index, Number):
+        if not isinstance(index, tuple):
             index = (index, )
-        assert isinstance(index, tuple)
 
-        right_inames = []
+        n_indexed = len([idx for idx in index if idx is not None and idx is
+            not Ellipsis])
+        if n_indexed > len(self.shape):
+            raise IndexError("too many indices for array")
+        n_ellipses = len([idx for idx in index if idx is Ellipsis])
+        if n_ellipses > 1:
+            raise IndexError("an index can only have a single ellipsis")
+        full_slices = (slice(None), )*(len(self.shape) - n_indexed)
+        if n_ellipses:
+            i_ellipsis = [i for i, idx in enumerate(index) if idx is
+                    Ellipsis][0]
+            index = index[:i_ellipsis] + full_slices + index[i_ellipsis+1:]
+        else:
+            index = index + full_slices
+
+        right_indices = []
         left_inames = []
         shape = []
-        for axis_len, idx in zip(self.shape, index):
-            if isinstance(idx, int):
-                right_inames.append(idx)
+        axis_lens = iter(self.shape)
+        for idx in index:
+            if idx is None:
+                left_inames.append(self.stack.name_generator(based_on='i'))
+                shape.append(1)
+            elif isinstance(idx, Integral):
+                axis_len = next(axis_lens)
+                idx = _normalize_index(idx, axis_len)
+                if not isinstance(axis_len, int):
+                    self.stack.assumptions.update(_get_range_assumptions(idx,
+                        idx + 1, axis_len))
+                right_indices.append(idx)
             elif isinstance(idx, slice):
-                # right now only support complete slices
-                # future plan is to make it diverse by adding it more support
-                # its easy, anyone intereseted can do it, with a small change
-                # to make_slab, or wait for kernel_callables_v3 to go through
-                # into master
-                assert idx.start is None
-                assert idx.stop is None
-                assert idx.step is None
+                axis_len = next(axis_lens)
+                start, step, length = _get_slice_range(idx, axis_len)
+                if not isinstance(axis_len, int):
+                    if step == 1:
+                        lower, upper = start, start + length
+                    else:
+                        lower, upper = start - length + 1, start + 1
+                    self.stack.assumptions.update(_get_range_assumptions(
+                        lower, upper, axis_len))
                 iname = self.stack.name_generator(based_on='i')
-                right_inames.append(Variable(iname))
+                right_indices.append(start + step*Variable(iname))
                 left_inames.append(iname)
-                shape.append(axis_len)
+                shape.append(length)
             else:
-                raise TypeError('can be subscripted only with slices or '
-                        'integers')
-
-        rhs = Call(Variable(self.name), tuple(right_inames))
-        subst_name = self.stack.name_generator(based_on='subst')
-        self.stack.register_substitution(lp.SubstitutionRule(subst_name,
-                    tuple(left_inames), rhs))
+                raise TypeError('can be subscripted only with integers, '
+                        'slices, Ellipsis or None')
 
         def _one_if_empty(t):
             if t:
@@ -459,8 +693,15 @@ class ArraySymbol(lp.ArrayArg):
             else:
                 return (1, )
 
+        shape = _one_if_empty(tuple(shape))
+
+        rhs = self._call(tuple(right_indices))
+        subst_name = self.stack.register_substitution(lp.SubstitutionRule(
+                    self.stack.name_generator(based_on='subst'),
+                    tuple(left_inames), rhs), shape, dtype=get_numpy_dtype(self))
+
         return ArraySymbol(stack=self.stack, name=subst_name, dtype=self.dtype,
-                shape=_one_if_empty(tuple(shape)))
+                shape=shape)
 
     __rmul__ = __mul__
     __radd__ = __add__
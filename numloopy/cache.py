@@ -0,0 +1,331 @@
+import os
+import re
+import hashlib
+import threading
+from collections import OrderedDict
+from pytools import Record
+from numloopy.symbolic import VariableRenamer, rename_domain
+
+
+__doc__ = """
+.. currentmodule:: numloopy
+
+.. autoclass:: KernelCache
+
+.. autofunction:: get_structural_key
+
+.. data:: DEFAULT_KERNEL_CACHE
+
+    The instance of :class:`KernelCache` used by
+    :meth:`Stack.end_computation_stack` unless told otherwise. If the
+    environment variable ``NUMLOOPY_KERNEL_CACHE_DIR`` is set, its on-disk
+    tier is enabled and stored in that directory.
+"""
+
+
+_GENERATED_SUFFIX_RE = re.compile(r"_[0-9]+$")
+
+
+def get_structural_key(stack, evaluate):
+    """
+    Returns a canonical hash of the computations registered on ``stack`` that
+    are needed to evaluate ``evaluate``.
+
+    The names generated by :attr:`Stack.name_generator` (inames, substitution
+    and array names) are replaced by canonical names in the order in which
+    they are first encountered, so that two stacks which registered the same
+    computations have the same key irrespective of the names they generated.
+
+    :arg stack: An instance of :class:`numloopy.Stack`.
+    :arg evaluate: The variables to be evaluated, as passed to
+        :meth:`Stack.end_computation_stack`.
+
+    :return: A tuple ``key, canonical_names``, where ``key`` is an instance of
+        :class:`str` and ``canonical_names`` is a mapping from the names
+        generated by the stack to their canonical names.
+    """
+    generated_names = stack.name_generator.existing_names
+    canonical_names = {}
+
+    def canonicalize(name):
+        if name not in generated_names:
+            return name
+        try:
+            return canonical_names[name]
+        except KeyError:
+            canonical_name = "_nlp_%d" % len(canonical_names)
+            canonical_names[name] = canonical_name
+            return canonical_name
+
+    renamer = VariableRenamer(canonicalize)
+    lines = []
+
+    for rule in stack.registered_substitutions:
+        lines.append("rule %s(%s) := %s %s %s" % (
+            canonicalize(rule.name),
+            ", ".join(canonicalize(arg) for arg in rule.arguments),
+            renamer(rule.expression),
+            stack.substs_to_shapes.get(rule.name),
+            stack.substs_to_dtypes.get(rule.name)))
+
+    for idx in sorted(stack.implicit_assignments):
+        for insn in stack.implicit_assignments[idx]:
+            lines.append("insn@%d %s = %s" % (idx,
+                renamer(insn.assignee), renamer(insn.expression)))
+
+    for domain in stack.domains:
+        lines.append("domain %s" % rename_domain(domain, canonicalize))
+
+    for arg in stack.data:
+        lines.append("data %s %s %s %s" % (canonicalize(arg.name),
+            arg.shape, arg.dtype, arg.dim_tags))
+
+    lines.append("assumptions %s" % sorted(str(expr) for expr in
+        stack.assumptions))
+
+    lines.append("substs_to_arrays %s" % sorted(
+        (canonicalize(subst_name), canonicalize(arg_name)) for subst_name,
+        arg_name in stack.substs_to_arrays.items()))
+
+    for arg in evaluate:
+        lines.append("evaluate %s %s %s" % (canonicalize(arg.name),
+            arg.shape, arg.dtype))
+
+    key = hashlib.sha256("\n".join(lines).encode("utf-8")).hexdigest()
+
+    return key, canonical_names
+
+
+def _rename_kernel(knl, renames):
+    """
+    Returns a copy of ``knl``, a kernel as generated by
+    :meth:`Stack.end_computation_stack`, with the variables renamed according
+    to the mapping ``renames``.
+    """
+    def rename(name):
+        return renames.get(name, name)
+
+    renamer = VariableRenamer(rename)
+
+    return knl.copy(
+            domains=[rename_domain(domain, rename) for domain in knl.domains],
+            instructions=[
+                insn.with_transformed_expressions(renamer).copy(
+                    within_inames=frozenset(rename(iname) for iname in
+                        insn.within_inames))
+                for insn in knl.instructions],
+            args=[arg.copy(name=rename(arg.name)) for arg in knl.args],
+            temporary_variables=dict(
+                (rename(name), tv.copy(name=rename(name))) for name, tv in
+                knl.temporary_variables.items()),
+            substitutions=dict(
+                (rename(name), rule.copy(
+                    name=rename(name),
+                    arguments=tuple(rename(arg) for arg in rule.arguments),
+                    expression=renamer(rule.expression)))
+                for name, rule in knl.substitutions.items()))
+
+
+class KernelCacheEntry(Record):
+    """
+    A kernel stored in a :class:`KernelCache`.
+
+    .. attribute:: kernel
+
+        An instance of :class:`loopy.LoopKernel`.
+
+    .. attribute:: tf_data
+
+        The transformation data of :attr:`kernel`.
+
+    .. attribute:: output_names
+
+        The names of the arrays of :attr:`kernel` holding the evaluated
+        variables.
+
+    .. attribute:: names
+
+        A mapping from the canonical names to the names with which
+        :attr:`kernel` was generated.
+
+    .. attribute:: finalization_names
+
+        An instance of :class:`frozenset` of the names generated while
+        finalizing the stack to :attr:`kernel`.
+
+    .. automethod:: instantiate
+    """
+    def __init__(self, kernel, tf_data, output_names, names,
+            finalization_names):
+        super(KernelCacheEntry, self).__init__(
+                kernel=kernel,
+                tf_data=tf_data,
+                output_names=output_names,
+                names=names,
+                finalization_names=finalization_names)
+
+    def instantiate(self, canonical_names, name_generator):
+        """
+        Returns the tuple ``knl, tf_data, output_names`` of the cached
+        kernel, renamed to the names used by the stack being finalized.
+
+        :arg canonical_names: A mapping from the names of the stack being
+            finalized to their canonical names, as returned by
+            :func:`get_structural_key`.
+        :arg name_generator: The name generator of the stack being finalized,
+            which records the names used by the returned kernel.
+        """
+        renames = {}
+
+        for name, canonical_name in canonical_names.items():
+            old_name = self.names[canonical_name]
+            if old_name != name:
+                renames[old_name] = name
+
+        # the names generated during finalization are retained, unless they
+        # conflict with the names of the stack being finalized
+        for old_name in sorted(self.finalization_names):
+            if old_name in canonical_names:
+                renames[old_name] = name_generator(
+                        based_on=_GENERATED_SUFFIX_RE.sub("", old_name))
+            elif not name_generator.is_name_conflicting(old_name):
+                name_generator.add_name(old_name)
+
+        if not renames:
+            return self.kernel, self.tf_data, self.output_names
+
+        tf_data = dict(
+                (renames.get(name, name), tuple(renames.get(iname, iname) for
+                    iname in inames))
+                for name, inames in self.tf_data.items())
+
+        output_names = tuple(renames.get(name, name) for name in
+                self.output_names)
+
+        return _rename_kernel(self.kernel, renames), tf_data, output_names
+
+
+class KernelCache(object):
+    """
+    A cache of the kernels generated by :meth:`Stack.end_computation_stack`,
+    keyed by :func:`get_structural_key`. The cache has an in-memory tier,
+    which holds the :attr:`max_size` most recently used kernels, and an
+    optional on-disk tier, which survives process restarts. The cache may
+    be shared by stacks finalized from different threads, as its accesses
+    are serialized by a lock.
+
+    .. attribute:: max_size
+
+        The maximum number of kernels held in memory.
+
+    .. attribute:: persistent_dict
+
+        An instance of :class:`pytools.persistent_dict.PersistentDict` for the
+        on-disk tier, or *None* if the cache is only in-memory.
+
+    .. attribute:: hits
+
+        Number of lookups which were served by the cache.
+
+    .. attribute:: misses
+
+        Number of lookups which were not served by the cache.
+
+    .. automethod:: __init__
+    .. automethod:: __getitem__
+    .. automethod:: __setitem__
+    .. automethod:: clear
+    """
+    def __init__(self, max_size=128, persistent=False, container_dir=None):
+        """
+        :arg max_size: The maximum number of kernels held in memory.
+        :arg persistent: If *True*, the kernels are also stored on disk.
+        :arg container_dir: The directory in which the on-disk tier is
+            stored. Defaults to the cache directory of
+            :mod:`pytools.persistent_dict`.
+        """
+        self.max_size = max_size
+        self._lru = OrderedDict()
+        self._lock = threading.RLock()
+
+        if persistent:
+            from pytools.persistent_dict import PersistentDict
+            from loopy.version import DATA_MODEL_VERSION
+            from numloopy.version import VERSION_TEXT
+            self.persistent_dict = PersistentDict(
+                    "numloopy-kernel-cache-v2-%s-%s" % (
+                        VERSION_TEXT, DATA_MODEL_VERSION),
+                    container_dir=container_dir)
+        else:
+            self.persistent_dict = None
+
+        self.hits = 0
+        self.misses = 0
+
+    def __getitem__(self, key):
+        """
+        :return: The instance of :class:`KernelCacheEntry` stored for
+            ``key``.
+        :raises KeyError: if no kernel is cached for ``key``.
+        """
+        with self._lock:
+            try:
+                entry = self._lru[key]
+            except KeyError:
+                pass
+            else:
+                self._lru.move_to_end(key)
+                self.hits += 1
+                return entry
+
+            if self.persistent_dict is not None:
+                from pytools.persistent_dict import NoSuchEntryError
+                try:
+                    entry = self.persistent_dict.fetch(key)
+                except NoSuchEntryError:
+                    pass
+                else:
+                    self._store_in_memory(key, entry)
+                    self.hits += 1
+                    return entry
+
+            self.misses += 1
+            raise KeyError(key)
+
+    def __setitem__(self, key, entry):
+        """
+        Stores the instance of :class:`KernelCacheEntry` ``entry`` for ``key``.
+        """
+        with self._lock:
+            self._store_in_memory(key, entry)
+
+            if self.persistent_dict is not None:
+                self.persistent_dict.store(key, entry)
+
+    def _store_in_memory(self, key, entry):
+        self._lru[key] = entry
+        self._lru.move_to_end(key)
+
+        while len(self._lru) > self.max_size:
+            self._lru.popitem(last=False)
+
+    def clear(self):
+        """
+        Removes all the kernels from the cache, including the ones stored on
+        disk.
+        """
+        with self._lock:
+            self._lru.clear()
+
+            if self.persistent_dict is not None:
+                self.persistent_dict.clear()
+
+
+def _make_default_kernel_cache():
+    container_dir = os.environ.get("NUMLOOPY_KERNEL_CACHE_DIR")
+
+    return KernelCache(persistent=container_dir is not None,
+            container_dir=container_dir)
+
+
+DEFAULT_KERNEL_CACHE = _make_default_kernel_cache()
@@ -0,0 +1,271 @@
+import loopy as lp
+from numloopy.stats import timed
+
+
+__doc__ = """
+.. currentmodule:: numloopy
+
+.. autoclass:: CompiledKernel
+.. autoclass:: CompiledProgram
+"""
+
+
+class CompiledKernel(object):
+    """
+    A kernel returned by :meth:`Stack.compile`, which is called with its
+    inputs as positional arguments.
+
+    The types of the kernel are inferred and its invoker is generated once
+    per :class:`pyopencl.Context`, so that a call only binds the arguments and
+    enqueues the kernel. As the arguments are not checked, the arrays passed
+    must have the shapes and types of the arguments of the stack. The
+    parameters of the symbolic axis lengths are inferred from the shapes of
+    the inputs, and can otherwise be passed as keyword arguments.
+
+    The arrays which are not passed by the caller (the outputs without an
+    ``out`` buffer and the intermediate arrays of the stack) are allocated
+    by :attr:`allocator`, by default a :class:`pyopencl.tools.MemoryPool` per
+    context, so that their memory is reused across calls once the arrays are
+    released.
+
+    .. attribute:: kernel
+
+        An instance of :class:`loopy.LoopKernel`.
+
+    .. attribute:: input_names
+
+        The names of the kernel arguments bound to the positional arguments.
+
+    .. attribute:: output_names
+
+        The names of the kernel arguments returned as outputs.
+
+    .. attribute:: allocator
+
+        A callable passed a byte count and returning a
+        :class:`pyopencl.Buffer`, or *None* to allocate from a memory pool
+        of the context of the queue.
+
+    .. automethod:: __call__
+    """
+    def __init__(self, kernel, input_names, output_names, allocator=None):
+        kernel = lp.infer_unknown_types(kernel, expect_completion=True)
+        self.kernel = lp.set_options(kernel, return_dict=True,
+                skip_arg_checks=True)
+        self.input_names = input_names
+        self.output_names = output_names
+        self.allocator = allocator
+        self._parameter_names = frozenset(arg.name for arg in kernel.args if
+                isinstance(arg, lp.ValueArg))
+        self._context_to_kernel_info = {}
+        self._context_to_memory_pool = {}
+
+    def _get_kernel_info(self, context):
+        try:
+            return self._context_to_kernel_info[context]
+        except KeyError:
+            from loopy.target.pyopencl_execution import PyOpenCLKernelExecutor
+            with timed("codegen"):
+                kernel_info = PyOpenCLKernelExecutor(context,
+                        self.kernel).kernel_info()
+            self._context_to_kernel_info[context] = kernel_info
+            return kernel_info
+
+    def _get_memory_pool(self, queue):
+        try:
+            return self._context_to_memory_pool[queue.context]
+        except KeyError:
+            from pyopencl.tools import MemoryPool, ImmediateAllocator
+            memory_pool = MemoryPool(ImmediateAllocator(queue))
+            self._context_to_memory_pool[queue.context] = memory_pool
+            return memory_pool
+
+    def __call__(self, queue, *args, **kwargs):
+        """
+        Enqueues the kernel on ``queue`` for the inputs ``args``. The values
+        of the parameters of the symbolic axis lengths which cannot be
+        inferred from the inputs are passed as keyword arguments.
+
+        :arg out: An instance of :class:`tuple` with an entry for every
+            output, either a :class:`pyopencl.array.Array` into which the
+            output is written or *None* to allocate it.
+        :arg allocator: Overrides :attr:`allocator` for this call.
+        :arg wait_for: An instance of :class:`list` of
+            :class:`pyopencl.Event` to wait for.
+        :arg out_host: If *True*, the outputs are returned as
+            :class:`numpy.ndarray`. Defaults to *True* only if the inputs are
+            :class:`numpy.ndarray`.
+
+        :return: A tuple ``evt, outputs``, where ``outputs`` is a
+            :class:`tuple` of the arrays of the outputs.
+        """
+        out = kwargs.pop("out", None)
+        allocator = kwargs.pop("allocator", self.allocator)
+        wait_for = kwargs.pop("wait_for", None)
+        out_host = kwargs.pop("out_host", None)
+        parameters = dict((name, kwargs.pop(name)) for name in list(kwargs)
+                if name in self._parameter_names)
+        if kwargs:
+            raise TypeError("unexpected keyword arguments: {}".format(
+                ", ".join(kwargs)))
+
+        if len(args) != len(self.input_names):
+            raise TypeError("expected {} inputs, got {}".format(
+                len(self.input_names), len(args)))
+
+        arrays = dict(zip(self.input_names, args))
+        arrays.update(parameters)
+
+        if out is not None:
+            if len(out) != len(self.output_names):
+                raise TypeError("expected {} out buffers, got {}".format(
+                    len(self.output_names), len(out)))
+            for name, ary in zip(self.output_names, out):
+                if ary is None:
+                    continue
+                if name in arrays:
+                    raise ValueError("output '{}' is an input of the kernel"
+                            " and cannot be passed as an out buffer".format(
+                                name))
+                arrays[name] = ary
+
+        if allocator is None:
+            allocator = self._get_memory_pool(queue)
+
+        kernel_info = self._get_kernel_info(queue.context)
+        evt, out_dict = kernel_info.invoker(kernel_info.cl_kernels, queue,
+                allocator, wait_for, out_host, **arrays)
+
+        # the inputs which are not written are returned as passed
+        arrays.update(out_dict)
+
+        return evt, tuple(arrays[name] for name in self.output_names)
+
+
+class CompiledProgram(object):
+    """
+    A sequence of kernels returned by :meth:`Stack.compile` if the
+    computation is split by :func:`split_kernel`, which is called as a
+    :class:`CompiledKernel`.
+
+    The kernels are enqueued one after the other, each with its own launch
+    configuration. The inputs passed as :class:`numpy.ndarray` are copied to
+    the device once, and the arrays written by a kernel stay on the device
+    for the kernels reading them, the outputs being copied to the host only
+    after the last kernel.
+
+    .. attribute:: kernels
+
+        An instance of :class:`list` of :class:`CompiledKernel`, each of
+        which is passed the arrays it reads as inputs and returns the arrays
+        it writes as outputs.
+
+    .. attribute:: input_names
+
+        The names of the arrays bound to the positional arguments.
+
+    .. attribute:: output_names
+
+        The names of the arrays returned as outputs.
+
+    .. attribute:: allocator
+
+        See :attr:`CompiledKernel.allocator`.
+
+    .. automethod:: __call__
+    """
+    def __init__(self, kernels, input_names, output_names, allocator=None):
+        self.input_names = input_names
+        self.output_names = output_names
+        self.allocator = allocator
+        self.kernels = []
+
+        # the arrays passed to a kernel are the ones available before it,
+        # i.e. the inputs and the arrays written by the previous kernels
+        available_names = set(input_names)
+        for kernel in kernels:
+            kernel = lp.infer_unknown_types(kernel, expect_completion=True)
+            array_names = [arg.name for arg in kernel.args if not
+                    isinstance(arg, lp.ValueArg)]
+            written_names = kernel.get_written_variables()
+            self.kernels.append(CompiledKernel(kernel,
+                tuple(name for name in array_names if name in
+                    available_names),
+                tuple(name for name in array_names if name in written_names),
+                allocator=allocator))
+            available_names.update(written_names)
+
+        self._parameter_names = frozenset().union(*(
+            compiled_kernel._parameter_names for compiled_kernel in
+            self.kernels))
+        self._context_to_memory_pool = {}
+
+    _get_memory_pool = CompiledKernel._get_memory_pool
+
+    def __call__(self, queue, *args, **kwargs):
+        """
+        Enqueues the kernels on ``queue`` for the inputs ``args``. The
+        arguments are as in :meth:`CompiledKernel.__call__`.
+
+        :return: A tuple ``evt, outputs``, where ``evt`` is the event of the
+            last kernel and ``outputs`` is a :class:`tuple` of the arrays of
+            the outputs.
+        """
+        import numpy as np
+        import pyopencl.array as cla
+
+        out = kwargs.pop("out", None)
+        allocator = kwargs.pop("allocator", self.allocator)
+        wait_for = kwargs.pop("wait_for", None)
+        out_host = kwargs.pop("out_host", None)
+        parameters = dict((name, kwargs.pop(name)) for name in list(kwargs)
+                if name in self._parameter_names)
+        if kwargs:
+            raise TypeError("unexpected keyword arguments: {}".format(
+                ", ".join(kwargs)))
+
+        if len(args) != len(self.input_names):
+            raise TypeError("expected {} inputs, got {}".format(
+                len(self.input_names), len(args)))
+
+        if allocator is None:
+            allocator = self._get_memory_pool(queue)
+
+        if out_host is None:
+            out_host = any(isinstance(ary, np.ndarray) for ary in args)
+        arrays = dict((name, cla.to_device(queue, ary, allocator=allocator)
+            if isinstance(ary, np.ndarray) else ary) for name, ary in
+            zip(self.input_names, args))
+
+        if out is not None:
+            if len(out) != len(self.output_names):
+                raise TypeError("expected {} out buffers, got {}".format(
+                    len(self.output_names), len(out)))
+            for name, ary in zip(self.output_names, out):
+                if ary is None:
+                    continue
+                if name in arrays:
+                    raise ValueError("output '{}' is an input of the kernel"
+                            " and cannot be passed as an out buffer".format(
+                                name))
+                arrays[name] = ary
+
+        evt = None
+        for kernel in self.kernels:
+            # the out buffers are passed to the first kernel writing them
+            kernel_out = tuple(None if name in kernel.input_names else
+                    arrays.get(name) for name in kernel.output_names)
+            evt, outputs = kernel(queue,
+                    *(arrays[name] for name in kernel.input_names),
+                    out=kernel_out, allocator=allocator, wait_for=wait_for,
+                    out_host=False,
+                    **dict((name, value) for name, value in parameters.items()
+                        if name in kernel._parameter_names))
+            arrays.update(zip(kernel.output_names, outputs))
+            wait_for = [evt]
+
+        outputs = tuple(arrays[name] for name in self.output_names)
+        if out_host:
+            outputs = tuple(ary.get(queue) for ary in outputs)
+
+        return evt, outputs
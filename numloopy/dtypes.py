@@ -0,0 +1,118 @@
+import numpy as np
+from numbers import Number
+
+
+__doc__ = """
+.. currentmodule:: numloopy.dtypes
+
+The types of the arrays follow the type promotion of :mod:`numpy`, so that
+arrays of narrow types stay narrow, except that booleans are stored as
+:data:`BOOL_DTYPE`, as OpenCL has no boolean arrays. The sums accumulate in
+the type of their result, so that summing narrow integers does not
+overflow.
+
+.. data:: BOOL_DTYPE
+
+    The type of the results of comparisons and of :class:`numpy.bool_`
+    arrays.
+
+.. autofunction:: normalize_dtype
+.. autofunction:: get_numpy_dtype
+.. autofunction:: get_result_dtype
+.. autofunction:: get_sum_dtype
+.. autofunction:: get_extremum_dtype
+.. autofunction:: get_mean_dtype
+"""
+
+
+BOOL_DTYPE = np.dtype(np.int8)
+
+
+def normalize_dtype(dtype):
+    """
+    Returns ``dtype`` as an instance of :class:`numpy.dtype`, with booleans
+    replaced by :data:`BOOL_DTYPE`.
+    """
+    dtype = np.dtype(dtype)
+    if dtype == np.bool_:
+        return BOOL_DTYPE
+    return dtype
+
+
+def get_numpy_dtype(operand):
+    """
+    Returns the :class:`numpy.dtype` of ``operand``, an instance of
+    :class:`numloopy.ArraySymbol` or a number.
+    """
+    if isinstance(operand, (Number, np.generic)):
+        return np.dtype(type(operand))
+    return operand.dtype.numpy_dtype
+
+
+_KIND_ORDER = {"b": 0, "u": 1, "i": 1, "f": 2, "c": 3}
+
+
+def get_result_dtype(*operands):
+    """
+    Returns the type of an element-wise operation on ``operands``,
+    instances of :class:`numloopy.ArraySymbol` or numbers, as promoted by
+    :mod:`numpy`.
+
+    Python numbers do not widen the type of the arrays, unless they are of a
+    higher kind, i.e. ``x*2.0`` is of the type of ``x`` if ``x`` is an array
+    of floats, and of :class:`numpy.float64` if it is an array of integers.
+    """
+    array_dtypes = [get_numpy_dtype(operand) for operand in operands if not
+            isinstance(operand, Number)]
+    scalar_dtypes = [get_numpy_dtype(operand) for operand in operands if
+            isinstance(operand, Number)]
+
+    if not array_dtypes:
+        return normalize_dtype(np.result_type(*scalar_dtypes))
+
+    dtype = np.result_type(*array_dtypes)
+    for scalar_dtype in scalar_dtypes:
+        if _KIND_ORDER[scalar_dtype.kind] > _KIND_ORDER[dtype.kind]:
+            dtype = np.result_type(dtype, scalar_dtype)
+
+    return normalize_dtype(dtype)
+
+
+def get_sum_dtype(dtype):
+    """
+    Returns the type in which :mod:`numpy` sums the elements of an array of
+    type ``dtype``, i.e. integers narrower than the platform integer are
+    summed as platform integers.
+    """
+    dtype = np.dtype(dtype)
+    if dtype.kind in "bi" and dtype.itemsize < np.dtype(np.int_).itemsize:
+        return np.dtype(np.int_)
+    if dtype.kind == "u" and dtype.itemsize < np.dtype(np.uint).itemsize:
+        return np.dtype(np.uint)
+    return dtype
+
+
+def get_extremum_dtype(dtype):
+    """
+    Returns the type in which the maximum or the minimum of the elements of
+    an array of type ``dtype`` is found, as loopy only finds the extrema of
+    32- and 64-bit integers and of floats.
+    """
+    dtype = np.dtype(dtype)
+    if dtype.kind in "biu" and dtype.itemsize < 4:
+        return np.dtype(np.int32)
+    if dtype.kind == "u" and dtype.itemsize == 4:
+        return np.dtype(np.int64)
+    return dtype
+
+
+def get_mean_dtype(dtype):
+    """
+    Returns the type of the mean of the elements of an array of type
+    ``dtype``, i.e. :class:`numpy.float64` for integers, as in
+    :func:`numpy.mean`.
+    """
+    dtype = np.dtype(dtype)
+    if dtype.kind in "biu":
+        return np.dtype(np.float64)
+    return dtype
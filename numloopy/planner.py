@@ -0,0 +1,182 @@
+import islpy as isl
+import numpy as np
+from loopy.isl_helpers import static_max_of_pw_aff, static_min_of_pw_aff
+from loopy.symbolic import WalkMapper, get_dependencies
+from loopy.diagnostic import StaticValueFindingError
+from numloopy.symbolic import SubstitutionCallCounter
+from numloopy.stats import timed
+
+
+__doc__ = """
+.. currentmodule:: numloopy.planner
+
+.. autofunction:: get_iname_extents
+.. autofunction:: plan_materialization
+
+.. data:: MEMORY_ACCESS_COST
+
+    The cost of storing or loading an element of an array, relative to an
+    operation of an expression.
+
+.. data:: PARAMETER_ESTIMATE
+
+    The value assumed for the parameters of the symbolic axis lengths while
+    estimating the costs.
+"""
+
+
+MEMORY_ACCESS_COST = 4
+PARAMETER_ESTIMATE = 1024
+
+
+def _estimate_size(shape):
+    from pymbolic import evaluate
+    from collections import defaultdict
+    context = defaultdict(lambda: PARAMETER_ESTIMATE)
+
+    return int(np.prod([evaluate(axis_len, context) for axis_len in shape]))
+
+
+def get_iname_extents(domains):
+    """
+    Returns a mapping from the inames of ``domains`` to the number of values
+    they take, the parameters of the domains being fixed to
+    :data:`PARAMETER_ESTIMATE`. Inames whose extent is not a constant are
+    left out.
+
+    :arg domains: An instance of :class:`list` of :class:`islpy.BasicSet`.
+    """
+    extents = {}
+
+    for domain in domains:
+        for i in range(domain.dim(isl.dim_type.param)):
+            domain = domain.fix_val(isl.dim_type.param, i, PARAMETER_ESTIMATE)
+        for i, iname in enumerate(domain.get_var_names(isl.dim_type.set)):
+            try:
+                upper = static_max_of_pw_aff(domain.dim_max(i),
+                        constants_only=True)
+                lower = static_min_of_pw_aff(domain.dim_min(i),
+                        constants_only=True)
+            except StaticValueFindingError:
+                # the extent is not a constant
+                continue
+            extents[iname] = int(upper.get_constant_val().to_python()
+                    - lower.get_constant_val().to_python()) + 1
+
+    return extents
+
+
+class _ReductionFinder(WalkMapper):
+    def __init__(self):
+        self.found = False
+
+    def map_reduction(self, expr, *args):
+        self.found = True
+
+
+def _has_reduction(expr):
+    finder = _ReductionFinder()
+    finder(expr)
+    return finder.found
+
+
+@timed("plan")
+def plan_materialization(stack, evaluate):
+    """
+    Returns the names of the substitutions of ``stack`` which should be
+    computed into arrays, rather than being inlined at every use, while
+    evaluating ``evaluate``.
+
+    Every substitution is assigned a cost, the number of operations for a
+    single evaluation with its callees inlined, and the number of times it
+    is invoked when inlined, counting the iterations of the reductions
+    enclosing its calls. Walking from the last registered substitution to
+    the first, a substitution is materialized if computing each of its
+    elements once, storing them and loading them at every invocation costs
+    less than the inlined invocations (see :data:`MEMORY_ACCESS_COST`). A
+    substitution containing a reduction is also materialized if it would be
+    inlined at more than one site, as loopy cannot schedule a reduction iname
+    which appears in more than one reduction.
+
+    :arg stack: An instance of :class:`numloopy.Stack`.
+    :arg evaluate: The variables to be evaluated, which are materialized
+        anyway.
+
+    :return: A :class:`frozenset` of the names of the substitutions to be
+        materialized, other than the ones of ``evaluate``.
+    """
+    rules = stack.registered_substitutions
+    subst_names = frozenset(rule.name for rule in rules)
+    iname_extents = get_iname_extents(stack.domains)
+    call_counter = SubstitutionCallCounter(subst_names, iname_extents)
+    site_counter = SubstitutionCallCounter(subst_names, {})
+
+    calls = {}
+    sites = {}
+    costs = {}
+    for rule in rules:
+        calls[rule.name] = call_counter(rule.expression)
+        sites[rule.name] = site_counter(rule.expression)
+        if rule.name in stack.substs_to_arrays:
+            costs[rule.name] = 1
+        else:
+            costs[rule.name] = 1 + sum(count*costs[name] for name, count in
+                    calls[rule.name].items())
+
+    invocations = dict((rule.name, 0) for rule in rules)
+    expansions = dict((rule.name, 0) for rule in rules)
+
+    def add_calls(counts, multiplier, to):
+        for name, count in counts.items():
+            to[name] += multiplier*count
+
+    for arg in evaluate:
+        invocations[arg.name] += _estimate_size(arg.shape)
+        expansions[arg.name] += 1
+
+    for insns in stack.implicit_assignments.values():
+        for insn in insns:
+            iterations = 1
+            for iname in get_dependencies(insn.assignee):
+                iterations *= iname_extents.get(iname, 1)
+            # the indices of a scatter invoke substitutions too
+            for expr in [insn.assignee, insn.expression]:
+                add_calls(call_counter(expr), iterations, invocations)
+                add_calls(site_counter(expr), 1, expansions)
+
+    evaluated_names = frozenset(arg.name for arg in evaluate)
+    materialized = set()
+
+    for rule in rules[::-1]:
+        if rule.name in stack.substs_to_arrays:
+            continue
+
+        shape = stack.substs_to_shapes[rule.name]
+        size = _estimate_size(shape)
+        n_invocations = invocations[rule.name]
+
+        if rule.name in evaluated_names:
+            is_stored = True
+        elif n_invocations == 0 or not (
+                len(rule.arguments) == len(shape)
+                or (not rule.arguments and shape == (1, ))):
+            is_stored = False
+        else:
+            cost = costs[rule.name]
+            is_stored = (
+                    (size*(cost + MEMORY_ACCESS_COST)
+                        + n_invocations*MEMORY_ACCESS_COST
+                        < n_invocations*cost)
+                    or (expansions[rule.name] > 1
+                        and _has_reduction(rule.expression)))
+            if is_stored:
+                materialized.add(rule.name)
+
+        if is_stored:
+            add_calls(calls[rule.name], size, invocations)
+            add_calls(sites[rule.name], 1, expansions)
+        else:
+            add_calls(calls[rule.name], n_invocations, invocations)
+            add_calls(sites[rule.name], expansions[rule.name], expansions)
+
+    return frozenset(materialized)
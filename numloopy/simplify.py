@@ -0,0 +1,464 @@
+import islpy as isl
+import numpy as np
+from numbers import Number, Integral
+from loopy.isl_helpers import simplify_via_aff
+from loopy.symbolic import (IdentityMapper, WalkMapper,
+        SubstitutionRuleExpander)
+from pymbolic.mapper.substitutor import substitute
+from pymbolic.primitives import (Variable, Subscript, Call, Sum, Product,
+        Quotient, FloorDiv, Remainder)
+from pytools import UniqueNameGenerator
+from numloopy.symbolic import VariableRenamer, UsedNameGetter, rename_domain
+from numloopy.stats import timed
+
+
+__doc__ = """
+.. currentmodule:: numloopy.simplify
+
+.. autofunction:: simplify_substitutions
+.. autofunction:: eliminate_dead_code
+.. autofunction:: fuse_loop_nests
+.. autofunction:: add_dependencies
+"""
+
+
+def _is_constant(expr):
+    return isinstance(expr, (Number, np.generic))
+
+
+def _get_constant_dtype(expr):
+    """
+    Returns the type loopy infers for the constant ``expr``.
+    """
+    if isinstance(expr, np.generic):
+        return expr.dtype
+    if isinstance(expr, Integral):
+        if np.iinfo(np.int32).min <= expr <= np.iinfo(np.int32).max:
+            return np.dtype(np.int32)
+        return np.dtype(np.int64)
+    return np.dtype(type(expr))
+
+
+def _is_index_expression(expr):
+    """
+    Returns *True* if ``expr`` is an integer expression of variables only,
+    such as the indices of the views of :class:`numloopy.ArraySymbol`.
+    """
+    if isinstance(expr, Integral) or isinstance(expr, Variable):
+        return True
+    if isinstance(expr, (Sum, Product)):
+        return all(_is_index_expression(child) for child in expr.children)
+    if isinstance(expr, (FloorDiv, Remainder)):
+        return (_is_index_expression(expr.numerator)
+                and _is_index_expression(expr.denominator))
+    return False
+
+
+def _count_operations(expr):
+    if isinstance(expr, (Sum, Product)):
+        return len(expr.children) - 1 + sum(_count_operations(child) for
+                child in expr.children)
+    if isinstance(expr, (FloorDiv, Remainder)):
+        return 1 + _count_operations(expr.numerator) + _count_operations(
+                expr.denominator)
+    return 0
+
+
+def _simplify_index(expr):
+    """
+    Returns the index expression ``expr`` simplified as an affine expression,
+    if it is one and if the simplified expression has no more operations.
+    """
+    if not _is_index_expression(expr) or isinstance(expr, (Integral,
+            Variable)):
+        return expr
+
+    try:
+        simplified = simplify_via_aff(expr)
+    except isl.Error:
+        return expr
+
+    if _count_operations(simplified) <= _count_operations(expr):
+        return simplified
+    return expr
+
+
+class _Simplifier(IdentityMapper):
+    """
+    Mapper simplifying the expression of a substitution rule, see
+    :func:`simplify_substitutions`.
+
+    .. attribute:: get_inlined_rule
+
+        A callable returning the simplified substitution rule to be inlined
+        for a name, or *None* if the name is not of such a rule.
+
+    .. attribute:: rule_names
+
+        The names of all the substitution rules.
+
+    .. attribute:: dtypes
+
+        A mapping from the names of the substitution rules and of the arrays
+        to their types.
+    """
+    def __init__(self, get_inlined_rule, rule_names, dtypes):
+        self.get_inlined_rule = get_inlined_rule
+        self.rule_names = rule_names
+        self.dtypes = dtypes
+
+    def get_dtype(self, expr):
+        """
+        Returns the type of ``expr``, or *None* if it is not known.
+        """
+        if _is_constant(expr):
+            return _get_constant_dtype(expr)
+        if isinstance(expr, Variable):
+            # the inames and the parameters of the axis lengths
+            return self.dtypes.get(expr.name, np.dtype(np.int32))
+        if isinstance(expr, Subscript):
+            return self.dtypes.get(expr.aggregate.name)
+        if isinstance(expr, Call):
+            return self.dtypes.get(expr.function.name)
+        if isinstance(expr, (Sum, Product)):
+            return self._get_common_dtype(expr.children)
+        return None
+
+    def _get_common_dtype(self, exprs):
+        dtypes = [self.get_dtype(expr) for expr in exprs]
+        if not dtypes or any(dtype is None for dtype in dtypes):
+            return None
+        return np.result_type(*dtypes)
+
+    def _fold(self, expr, children, identity, operation):
+        """
+        Returns the sum or the product ``expr`` of the simplified
+        ``children``, with its constants folded if all its children are
+        constants, and with the constants equal to ``identity`` left out if
+        they do not widen the type of the other children.
+        """
+        if all(_is_constant(child) for child in children):
+            dtype = np.result_type(*[_get_constant_dtype(child) for child in
+                children])
+            result = children[0]
+            for child in children[1:]:
+                result = operation(result, child)
+            if all(isinstance(child, np.generic) for child in children):
+                return dtype.type(result)
+            return result
+
+        others = tuple(child for child in children if not (
+            _is_constant(child) and child == identity))
+        if len(others) < len(children):
+            dtype = self._get_common_dtype(others)
+            if dtype is None or dtype != self._get_common_dtype(children):
+                others = children
+
+        if len(others) == 1:
+            return others[0]
+        return type(expr)(others)
+
+    def map_sum(self, expr):
+        return self._fold(expr, tuple(self.rec(child) for child in
+            expr.children), 0, lambda x, y: x + y)
+
+    def map_product(self, expr):
+        return self._fold(expr, tuple(self.rec(child) for child in
+            expr.children), 1, lambda x, y: x * y)
+
+    def map_quotient(self, expr):
+        numerator = self.rec(expr.numerator)
+        denominator = self.rec(expr.denominator)
+        if (isinstance(numerator, np.floating)
+                and isinstance(denominator, np.floating)
+                and numerator.dtype == denominator.dtype):
+            return numerator.dtype.type(numerator / denominator)
+        return Quotient(numerator, denominator)
+
+    def map_subscript(self, expr):
+        return Subscript(expr.aggregate, tuple(_simplify_index(self.rec(index))
+            for index in expr.index_tuple))
+
+    def map_call(self, expr):
+        parameters = tuple(self.rec(par) for par in expr.parameters)
+        if expr.function.name not in self.rule_names:
+            return Call(expr.function, parameters)
+
+        parameters = tuple(_simplify_index(par) for par in parameters)
+        rule = self.get_inlined_rule(expr.function.name)
+        if rule is None:
+            return Call(expr.function, parameters)
+
+        # the indices of the inlined rule are composed with the parameters
+        return self.rec(substitute(rule.expression,
+            dict(zip(rule.arguments, parameters))))
+
+
+def _is_inlined(expr, rule_names):
+    """
+    Returns *True* if a substitution rule with the simplified expression
+    ``expr`` is inlined into its callers, i.e. if it is a constant or an
+    index map, such as the substitutions of :func:`numloopy.Stack.ones`,
+    :meth:`numloopy.ArraySymbol.reshape` and of the broadcasts.
+    """
+    if _is_constant(expr) or isinstance(expr, Variable):
+        return True
+    if isinstance(expr, Subscript):
+        return (isinstance(expr.aggregate, Variable)
+                and all(_is_index_expression(index) for index in
+                    expr.index_tuple))
+    if isinstance(expr, Call):
+        return (expr.function.name in rule_names
+                and all(_is_index_expression(par) for par in
+                    expr.parameters))
+    return False
+
+
+@timed("simplify")
+def simplify_substitutions(substitutions, dtypes):
+    """
+    Returns a copy of ``substitutions`` with the expressions of the rules
+    simplified:
+
+    * The rules which are constants, such as the ones of
+      :func:`numloopy.Stack.ones`, or index maps, such as the ones of
+      :meth:`numloopy.ArraySymbol.reshape`, of the views and of the
+      broadcasts, are inlined into their callers, so that a chain of views
+      collapses into a single index map and the constants reach the
+      operations on them.
+    * The sums and products of constants are folded.
+    * The zeros of the sums and the ones of the products are left out,
+      unless they widen the type of the other operands.
+    * The affine indices are simplified, e.g. ``(i + 1) - 1`` to ``i``.
+
+    The rules are kept, as the statements and the transformations refer to
+    them by name.
+
+    :arg substitutions: A mapping from the names of the rules to the
+        instances of :class:`loopy.SubstitutionRule`.
+    :arg dtypes: A mapping from the names of the rules and of the arrays to
+        their :class:`numpy.dtype`, so that the constants are only left out
+        if they do not change the types of the expressions.
+    """
+    rule_names = frozenset(substitutions)
+    simplified = {}
+
+    def get_simplified_rule(name):
+        if name not in simplified:
+            rule = substitutions[name]
+            simplified[name] = rule.copy(expression=simplifier(
+                rule.expression))
+        return simplified[name]
+
+    def get_inlined_rule(name):
+        rule = get_simplified_rule(name)
+        if _is_inlined(rule.expression, rule_names):
+            return rule
+        return None
+
+    simplifier = _Simplifier(get_inlined_rule, rule_names, dtypes)
+
+    return dict((name, get_simplified_rule(name)) for name in substitutions)
+
+
+@timed("simplify")
+def eliminate_dead_code(statements, domains, data, substitutions, roots):
+    """
+    Returns a tuple ``statements, domains, data, substitutions`` of the
+    parts of a kernel which contribute to the arrays of ``roots``, in their
+    original order. A statement is kept if it writes an array of ``roots``
+    or an array read by a statement which is kept, the substitutions being
+    expanded, so that the statements computing the intermediate arrays of
+    unused variables (e.g. the scans of :meth:`numloopy.Stack.cumsum` and
+    the scatters of :meth:`numloopy.ArraySymbol.__setitem__`) are dropped
+    along with their domains and arrays.
+
+    :arg statements: An instance of :class:`list` of
+        :class:`loopy.Assignment`.
+    :arg domains: An instance of :class:`list` of :class:`islpy.BasicSet`.
+        A domain is kept if one of its inames is used by the statements
+        kept.
+    :arg data: An instance of :class:`list` of the arrays of the kernel.
+    :arg substitutions: A mapping from the names of the rules to the
+        instances of :class:`loopy.SubstitutionRule`.
+    :arg roots: The names of the arrays visible to the caller, i.e. the
+        outputs and the arguments, which are kept anyway.
+    """
+    get_used_names = UsedNameGetter(substitutions)
+    live_names = set(roots)
+    live_statements = set()
+    # the names of the substitutions are collected once, as the live names
+    # only grow
+    expanded_rules = set()
+
+    changed = True
+    while changed:
+        changed = False
+        # the statements are visited from the last, as they read the arrays
+        # written before them
+        for i in range(len(statements)-1, -1, -1):
+            insn = statements[i]
+            if (i in live_statements
+                    or not live_names.intersection(insn.assignee_var_names())):
+                continue
+            live_statements.add(i)
+            changed = True
+            live_names.update(get_used_names(insn.assignee, expanded_rules)
+                    | get_used_names(insn.expression, expanded_rules))
+
+    return ([insn for i, insn in enumerate(statements) if i in
+                live_statements],
+            [domain for domain in domains if live_names & frozenset(
+                domain.get_var_names(isl.dim_type.set))],
+            [arg for arg in data if arg.name in live_names],
+            dict((name, rule) for name, rule in substitutions.items() if name
+                in live_names))
+
+
+class _SubscriptCollector(WalkMapper):
+    """
+    Mapper collecting the subscripts of the arrays of :attr:`names` in an
+    expression into :attr:`subscripts`.
+    """
+    def __init__(self, names):
+        self.names = names
+        self.subscripts = []
+
+    def map_subscript(self, expr):
+        if expr.aggregate.name in self.names:
+            self.subscripts.append(expr)
+        self.rec(expr.index)
+
+
+def _get_positional_domain(domain, inames):
+    positions = dict((iname, "_dim_%d" % i) for i, iname in enumerate(inames))
+    return rename_domain(domain, lambda iname: positions.get(iname, iname))
+
+
+@timed("simplify")
+def fuse_loop_nests(statements, domains, substitutions, loop_inames):
+    """
+    Returns a tuple ``statements, domains, renames`` with the loop nests of
+    the statements materializing the substitutions merged, so that loopy
+    computes them in a single loop nest. The loop nest of a statement is
+    merged into the one of the preceding statement if their domains are
+    identical up to the names of the inames, and if the statement reads the
+    arrays computed in that loop nest only at the element it computes, so
+    that the fused loop computes every element before it is read. The
+    merged statements share the inames of the earliest statement, and the
+    domains of the others are dropped.
+
+    The statements of the scans, of the scatters and the ones tagged for
+    tiling (see :data:`numloopy.transform.CONTRACTION_INSN_TAG` and
+    :data:`numloopy.transform.TRANSPOSE_INSN_TAG`) are left as they are.
+
+    :arg statements: An instance of :class:`list` of
+        :class:`loopy.Assignment`.
+    :arg domains: An instance of :class:`list` of :class:`islpy.BasicSet`.
+    :arg substitutions: A mapping from the names of the rules to the
+        instances of :class:`loopy.SubstitutionRule`.
+    :arg loop_inames: A mapping from the names of the substitutions
+        materialized by ``statements`` to the inames of their loop nests,
+        as in the transformation data of
+        :meth:`numloopy.Stack.end_computation_stack`.
+
+    :return: ``renames`` maps the inames of the merged loop nests to the
+        inames they share.
+    """
+    inames_to_domains = dict((tuple(domain.get_var_names(isl.dim_type.set)),
+        domain) for domain in domains)
+    expander = SubstitutionRuleExpander(substitutions)
+
+    # the open loop nest, as the inames, the positional domain and the names
+    # of the arrays computed in it: only consecutive statements share a loop
+    # nest, as a statement between two of them might read the array of the
+    # first and be read by the second
+    loop_nest = None
+    renames = {}
+
+    for insn in statements:
+        inames = None
+        if not insn.tags and isinstance(insn.expression, Call):
+            inames = loop_inames.get(insn.expression.function.name)
+        if (not inames or tuple(getattr(idx, "name", None) for idx in
+                insn.assignee.index_tuple) != inames
+                or inames not in inames_to_domains):
+            loop_nest = None
+            continue
+
+        domain = _get_positional_domain(inames_to_domains[inames], inames)
+
+        if loop_nest is not None:
+            nest_inames, nest_domain, array_names = loop_nest
+            collector = _SubscriptCollector(array_names)
+            collector(expander(insn.expression))
+            indices = tuple(Variable(iname) for iname in inames)
+            if (domain.get_space() == nest_domain.get_space()
+                    and domain.is_equal(nest_domain)
+                    and all(subscript.index_tuple == indices for subscript
+                        in collector.subscripts)):
+                renames.update(zip(inames, nest_inames))
+                array_names.add(insn.assignee.aggregate.name)
+                continue
+
+        loop_nest = (inames, domain, set([insn.assignee.aggregate.name]))
+
+    if not renames:
+        return statements, domains, renames
+
+    renamer = VariableRenamer(lambda name: renames.get(name, name))
+    return ([insn.with_transformed_expressions(renamer) for insn in
+                statements],
+            [domain for domain in domains if frozenset(renames).isdisjoint(
+                domain.get_var_names(isl.dim_type.set))],
+            renames)
+
+
+@timed("simplify")
+def add_dependencies(statements, substitutions):
+    """
+    Returns a copy of ``statements`` with their identifiers and the
+    dependencies between them, from the arrays they read and write, the
+    substitutions being expanded. A statement depends on the last statement
+    before it writing an array it reads or writes, and on the statements
+    reading an array it writes since that array was last written, so that
+    the statements computing independent arrays are left unordered.
+
+    :arg statements: An instance of :class:`list` of
+        :class:`loopy.Assignment`, in the order of the computation.
+    :arg substitutions: A mapping from the names of the rules to the
+        instances of :class:`loopy.SubstitutionRule`.
+    """
+    get_used_names = UsedNameGetter(substitutions)
+    insn_id_gen = UniqueNameGenerator(set(insn.id for insn in statements if
+        insn.id is not None))
+
+    last_writers = {}
+    # the statements reading an array since it was last written
+    readers = {}
+    result = []
+
+    for insn in statements:
+        insn_id = insn.id if insn.id is not None else insn_id_gen("insn")
+        read_names = get_used_names(insn.expression)
+        if isinstance(insn.assignee, Subscript):
+            read_names |= get_used_names(insn.assignee.index)
+        written_names = insn.assignee_var_names()
+
+        depends_on = set(insn.depends_on)
+        for name in read_names.union(written_names):
+            if name in last_writers:
+                depends_on.add(last_writers[name])
+        for name in written_names:
+            depends_on.update(readers.get(name, ()))
+        depends_on.discard(insn_id)
+
+        for name in read_names:
+            readers.setdefault(name, set()).add(insn_id)
+        for name in written_names:
+            last_writers[name] = insn_id
+            readers[name] = set()
+
+        result.append(insn.copy(id=insn_id, depends_on=frozenset(depends_on)))
+
+    return result
@@ -1,13 +1,27 @@
 import loopy as lp
 import numpy as np
 import islpy as isl
-from loopy.symbolic import IdentityMapper
+from numbers import Integral
+from loopy.symbolic import IdentityMapper, get_dependencies
+from loopy.types import to_loopy_type
 from numloopy.array import ArraySymbol
-from pytools import UniqueNameGenerator, Record, memoize_method
+from numloopy.symbolic import (get_substitution_key, normalize_shape,
+        get_shape_parameters, make_box_domain)
+from numloopy.planner import plan_materialization
+from numloopy.simplify import (simplify_substitutions, eliminate_dead_code,
+        fuse_loop_nests, add_dependencies)
+from numloopy.stats import timed, count
+from numloopy.dtypes import (BOOL_DTYPE, normalize_dtype, get_result_dtype,
+        get_sum_dtype, get_extremum_dtype, get_mean_dtype)
+from numloopy.transform import (SCAN_INSN_TAG, CONTRACTION_INSN_TAG,
+        TRANSPOSE_INSN_TAG, fuse_reductions, realize_scans, tile_transposes,
+        autoparallelize, demote_internal_arrays, split_kernel)
+from pytools import UniqueNameGenerator, Record, product
 from pymbolic import parse
-from pymbolic.primitives import Variable, Subscript
-from loopy.isl_helpers import make_slab
-from numbers import Number
+from pymbolic.primitives import (Variable, Subscript, If, Comparison,
+        Product, Call)
+from collections import OrderedDict
+from string import ascii_lowercase, ascii_uppercase
 
 
 __doc__ = """
@@ -40,6 +54,67 @@ def fill_array(shape, value, name_generator):
     return subst_name, rule, name_generator
 
 
+def _one_if_empty(shape):
+    if shape:
+        return shape
+    return (1, )
+
+
+def _normalize_axis(axis, ndim):
+    """
+    Returns the axes ``axis`` of a reduction over an array of ``ndim`` axes
+    as a sorted :class:`tuple` of non-negative integers. *None* or an empty
+    tuple stand for all the axes.
+    """
+    if isinstance(axis, Integral):
+        axis = (axis, )
+    if not axis:
+        return tuple(range(ndim))
+
+    for i in axis:
+        if not -ndim <= i < ndim:
+            raise ValueError("axis {} is out of bounds for an array of "
+                    "dimension {}".format(i, ndim))
+
+    return tuple(sorted(set(i % ndim for i in axis)))
+
+
+def _as_kernel_argument(arg):
+    """
+    Returns a :class:`loopy.GlobalArg` for the array ``arg`` in
+    :attr:`Stack.data`. Instances of :class:`numloopy.ArraySymbol` are
+    converted so that the kernel does not hold references to the stack.
+    """
+    if isinstance(arg, ArraySymbol):
+        return lp.GlobalArg(arg.name, dtype=arg.dtype, shape=arg.shape,
+                dim_tags=arg.dim_tags)
+
+    return arg
+
+
+def _is_contraction(rule):
+    """
+    Returns *True* if the substitution rule ``rule`` sums a product of arrays,
+    as registered by :meth:`Stack.einsum`.
+    """
+    return (isinstance(rule.expression, lp.Reduction)
+            and isinstance(rule.expression.expr, Product))
+
+
+def _is_transpose(rule):
+    """
+    Returns *True* if the substitution rule ``rule`` views an array with its
+    axes permuted, as registered by :meth:`ArraySymbol.transpose`.
+    """
+    expr = rule.expression
+    if not (isinstance(expr, Call) and all(isinstance(param, Variable) for
+            param in expr.parameters)):
+        return False
+    names = tuple(param.name for param in expr.parameters)
+    return (sorted(names) == sorted(rule.arguments)
+            and names != tuple(rule.arguments))
+
+
 class SubstToArrayExapander(IdentityMapper):
     """
     Mapper to change the substitution calls in :attr:`subst_to_args` to array
@@ -66,9 +141,55 @@ class SubstToArrayExapander(IdentityMapper):
         return super(SubstToArrayExapander, self).map_call(expr)
 
 
+class FinalizationStep(Record):
+    """
+    The conversion of a substitution of a :class:`Stack` into the parts of
+    the kernel generated by :meth:`Stack.end_computation_stack`.
+
+    .. attribute:: key
+
+        Describes the arrays into which the substitution is materialized, so
+        that the step is reused only if the substitution is materialized
+        alike.
+
+    .. attribute:: statements
+
+        An instance of :class:`list` of the instructions of the implicit
+        assignments registered before the substitution, followed by the ones
+        materializing the substitution.
+
+    .. attribute:: domains
+
+        The domains of the inames of the materializing instructions.
+
+    .. attribute:: data
+
+        The arrays into which the substitution is materialized.
+
+    .. attribute:: array_names
+
+        The names of the arrays of :attr:`data`, in order.
+
+    .. attribute:: tf_data
+
+        The transformation data of the materializing instructions.
+
+    .. attribute:: substitution
+
+        The substitution rule, with the materialized substitutions it invokes
+        replaced by their arrays.
+
+    .. attribute:: generated_names
+
+        An instance of :class:`frozenset` of the names generated by the
+        stack for the step.
+    """
+
+
 class Stack(Record):
     """
-    Records the information about the computation stack.
+    Records the information about the computation stack. The containers
+    not passed are created empty for every instance.
 
     .. attribute domains::
 
@@ -102,6 +223,49 @@ class Stack(Record):
         A mapping from from substitution names to arrays that are equivalently
         used.
 
+    .. attribute substs_to_shapes::
+
+        A mapping from substitution names to the shapes of the arrays they
+        represent.
+
+    .. attribute substs_to_dtypes::
+
+        A mapping from substitution names to the types of the arrays they
+        represent, as instances of :class:`numpy.dtype`, or *None* if loopy
+        infers the type.
+
+    .. attribute arguments::
+
+        An instance of :class:`list` of the names of the arrays created by
+        :meth:`argument`, in the order of their creation.
+
+    .. attribute names_to_substs::
+
+        A mapping from the names of the substitutions in
+        :attr:`registered_substitutions` to the substitution rules, for
+        looking up the substitutions in constant time.
+
+    .. attribute finalization_steps::
+
+        An instance of :class:`list` of the
+        :class:`numloopy.stack.FinalizationStep` of the latest finalization
+        of the stack, one per registered substitution.
+
+    .. attribute keys_to_substs::
+
+        A mapping from the structural keys (see
+        :func:`numloopy.symbolic.get_substitution_key`) of the substitutions
+        registered since the last implicit assignment to their names. Used
+        for hash-consing the substitutions.
+
+    .. attribute assumptions::
+
+        An instance of :class:`set` of the expressions in the parameters of
+        the symbolic axis lengths which the kernels assume to be
+        non-negative, e.g. ``n - 2`` for the view ``v[-2:]`` of an array
+        ``v`` of length ``n``, so that the indices of the views are within
+        their axes.
+
     .. automethod:: __init__
     .. automethod:: register_substitution
     .. automethod:: register_implicit_assignment
@@ -110,15 +274,62 @@ class Stack(Record):
     .. automethod:: ones
     .. automethod:: arange
     .. automethod:: sum
+    .. automethod:: prod
+    .. automethod:: max
+    .. automethod:: min
+    .. automethod:: mean
+    .. automethod:: argmax
+    .. automethod:: argmin
+    .. automethod:: any
+    .. automethod:: all
     .. automethod:: cumsum
+    .. automethod:: einsum
+    .. automethod:: dot
+    .. automethod:: matmul
+    .. automethod:: transpose
+    .. automethod:: swapaxes
+    .. automethod:: moveaxis
     .. automethod:: argument
     .. automethod:: end_computation_stack
+    .. automethod:: compile
 
     """
-    def __init__(self, domains=[], registered_substitutions=[],
-            implicit_assignments={},
-            data=[], substs_to_arrays={},
-            name_generator=UniqueNameGenerator()):
+    def __init__(self, domains=None, registered_substitutions=None,
+            implicit_assignments=None,
+            data=None, substs_to_arrays=None,
+            name_generator=None, substs_to_shapes=None, substs_to_dtypes=None,
+            arguments=None, keys_to_substs=None, names_to_substs=None,
+            finalization_steps=None, assumptions=None):
+
+        # every stack gets containers of its own, so that stacks share no
+        # state and can be built concurrently
+        if domains is None:
+            domains = []
+        if registered_substitutions is None:
+            registered_substitutions = []
+        if implicit_assignments is None:
+            implicit_assignments = {}
+        if data is None:
+            data = []
+        if substs_to_arrays is None:
+            substs_to_arrays = {}
+        if name_generator is None:
+            name_generator = UniqueNameGenerator()
+        if substs_to_shapes is None:
+            substs_to_shapes = {}
+        if substs_to_dtypes is None:
+            substs_to_dtypes = {}
+        if arguments is None:
+            arguments = []
+        if keys_to_substs is None:
+            keys_to_substs = {}
+        if names_to_substs is None:
+            names_to_substs = dict((rule.name, rule) for rule in
+                    registered_substitutions)
+        if finalization_steps is None:
+            finalization_steps = []
+        if assumptions is None:
+            assumptions = set()
 
         super(Stack, self).__init__(
                 domains=domains,
@@ -126,18 +337,56 @@ class Stack(Record):
                 substs_to_arrays=substs_to_arrays,
                 implicit_assignments=implicit_assignments,
                 data=data,
-                name_generator=name_generator)
-
-    def register_substitution(self, rule):
+                name_generator=name_generator,
+                substs_to_shapes=substs_to_shapes,
+                substs_to_dtypes=substs_to_dtypes,
+                arguments=arguments,
+                keys_to_substs=keys_to_substs,
+                names_to_substs=names_to_substs,
+                finalization_steps=finalization_steps,
+                assumptions=assumptions)
+
+    @timed("register")
+    def register_substitution(self, rule, shape, domain=None, dtype=None):
         """
-        Registers a substitution rule on the top of the stack.
+        Registers a substitution rule on the top of the stack. If a
+        structurally identical substitution rule was already registered, the
+        stack is left unchanged and the name of the existing substitution is
+        returned.
 
         :arg rule: An instance of :class:`loopy.SubstitutionRule`.
+        :arg shape: An instance of :class:`tuple` denoting the shape of the
+            array represented by ``rule``.
+        :arg domain: An instance of :class:`islpy.BasicSet` of the inames
+            local to ``rule`` (e.g. the inames of its reductions), which is
+            added to :attr:`domains` along with the rule.
+        :arg dtype: The type of the array represented by ``rule``, or *None*
+            if it is to be inferred by loopy.
+
+        :return: The name of the substitution computing ``rule``.
         """
         assert isinstance(rule, lp.SubstitutionRule)
 
+        if dtype is not None:
+            dtype = normalize_dtype(dtype)
+
+        key = get_substitution_key(rule, shape, domain, dtype)
+        try:
+            return self.keys_to_substs[key]
+        except KeyError:
+            pass
+
         self.registered_substitutions.append(rule)
+        self.names_to_substs[rule.name] = rule
+        if domain is not None:
+            self.domains.append(domain)
+        self.substs_to_shapes[rule.name] = tuple(shape)
+        self.substs_to_dtypes[rule.name] = dtype
+        self.keys_to_substs[key] = rule.name
 
+        return rule.name
+
+    @timed("register")
     def register_implicit_assignment(self, insn):
         """
         Registers an instruction ``insn`` at the top of the stack.
@@ -153,7 +402,11 @@ class Stack(Record):
         self.implicit_assignments[len(self.registered_substitutions)] = (
                 assignments_till_now)
 
-    @memoize_method
+        # the substitutions registered from now on might read the updated
+        # values of the arrays, and hence are not identical to the ones
+        # registered before
+        self.keys_to_substs.clear()
+
     def get_substitution(self, name):
         """
         Returns the substiution rule corresponding to the substitution
@@ -164,179 +417,502 @@ class Stack(Record):
         :return: An instance of :class:`loopy.SubstitutionRule` registered
             with the name ``name``.
         """
-        for rule in self.registered_substitutions:
-            if rule.name == name:
-                return rule
-
-        raise KeyError("Did not find the required substitution.")
+        try:
+            return self.names_to_substs[name]
+        except KeyError:
+            raise KeyError("Did not find the required substitution.")
 
     def zeros(self, shape, dtype=np.float64):
         """
         Registers a substitution rule on to the stack with an array whose values
         are filled with 0.
 
+        :arg dtype: The type of the array.
+
         :return: An instance of :class:`loopy.ArraySymbol`, corresponding to the
             substitution rule which was registered.
         """
-        if isinstance(shape, int):
-            shape = (shape, )
-        assert isinstance(shape, tuple)
-
-        for axis_length in shape:
-            # Note: I have not implemented anything here, but maybe in the
-            # future we would need to do something to let the stack know about
-            # the vairable
-            if isinstance(axis_length, Number):
-                pass
-            elif isinstance(axis_length, str):
-                pass
-            else:
-                raise TypeError("Shape can only be initialized by numbers or"
-                        " strings")
+        shape = normalize_shape(shape)
 
-        subst_name, rule, name_generator = fill_array(shape, value=0,
-                name_generator=self.name_generator)
-        arg = ArraySymbol(
+        dtype = normalize_dtype(dtype)
+        subst_name, rule, name_generator = fill_array(shape,
+                value=dtype.type(0), name_generator=self.name_generator)
+        subst_name = self.register_substitution(rule, shape, dtype=dtype)
+
+        return ArraySymbol(
                 stack=self,
                 name=subst_name,
                 shape=shape,
                 dtype=dtype)
 
-        self.register_substitution(rule)
-
-        return arg
-
     def ones(self, shape, dtype=np.float64):
         """
         Registers a substitution rule on to the stack with an array whose values
         are filled with 1.
 
+        :arg dtype: The type of the array.
+
         :return: An instance of :class:`loopy.ArraySymbol`, corresponding to the
             substitution rule which was registered.
         """
 
-        if isinstance(shape, int):
-            shape = (shape, )
-        assert isinstance(shape, tuple)
+        shape = normalize_shape(shape)
 
-        for axis_length in shape:
-            # Note: I have not implemented anything here, but maybe in the
-            # future we would need to do something to let the stack know about
-            # the vairable
-            if isinstance(axis_length, Number):
-                pass
-            elif isinstance(axis_length, str):
-                pass
-            else:
-                raise TypeError("Shape can only be initialized by numbers or"
-                        " strings")
+        dtype = normalize_dtype(dtype)
+        subst_name, rule, name_generator = fill_array(shape,
+                value=dtype.type(1), name_generator=self.name_generator)
+        subst_name = self.register_substitution(rule, shape, dtype=dtype)
 
-        subst_name, rule, name_generator = fill_array(shape, value=1,
-                name_generator=self.name_generator)
-        arg = ArraySymbol(
+        return ArraySymbol(
                 stack=self,
                 name=subst_name,
                 shape=shape,
                 dtype=dtype)
 
-        self.register_substitution(rule)
-
-        return arg
-
-    def arange(self, stop):
+    def arange(self, stop, dtype=np.int_):
         """
         Registers a substitution rule on to the stack with an array whose values
         are filled equivalent to ``numpy.arange``.
 
-        :arg stop: An instance of :class:`int` denoting the extent of the
-            array.
+        :arg stop: The extent of the array, either an instance of
+            :class:`int` or a symbolic axis length (see :meth:`argument`).
+        :arg dtype: The type of the array, the platform integer by default
+            as in :func:`numpy.arange`.
 
         :return: An instance of :class:`numloopy.ArraySymbol` of shape
             ``(stop,)``, corresponding to the substitution rule which was
             registered.
         """
-        assert isinstance(stop, int)
+        stop, = normalize_shape(stop)
         subst_name = self.name_generator(based_on="subst")
-        arg = ArraySymbol(
-                stack=self,
-                name=subst_name,
-                shape=(stop, ),
-                dtype=np.int)
         iname = self.name_generator(based_on="i")
+        dtype = normalize_dtype(dtype)
         rhs = Variable(iname)
         rule = lp.SubstitutionRule(subst_name, (iname, ), rhs)
 
-        self.register_substitution(rule)
+        subst_name = self.register_substitution(rule, (stop, ), dtype=dtype)
 
-        return arg
+        return ArraySymbol(
+                stack=self,
+                name=subst_name,
+                shape=(stop, ),
+                dtype=dtype)
 
-    def sum(self, arg, axis=None):
+    def _reduce(self, operation, arg, axis, keepdims, dtype,
+            get_expression=None):
+        """
+        Registers a substitution rule reducing the elements of the array
+        ``arg`` along ``axis`` with ``operation``, an instance of
+        :class:`loopy.library.reduction.ReductionOperation`.
+
+        :arg get_expression: A callable mapping the indices of an element of
+            ``arg`` to the expression to be reduced, or *None* for the
+            element itself.
+
+        :return: An instance of :class:`numloopy.ArraySymbol` of type
+            ``dtype``, which is registered as the reduction.
+        """
+        axis = _normalize_axis(axis, len(arg.shape))
+
+        inames = [self.name_generator(based_on="i") for _ in arg.shape]
+        domain = make_box_domain(inames, arg.shape)
+
+        reduction_inames = tuple(iname for i, iname in enumerate(inames) if i in
+                axis)
+        if keepdims:
+            # the reduced axes are indexed by arguments of extent 1
+            left_inames = tuple(self.name_generator(based_on="i") if i in axis
+                    else iname for i, iname in enumerate(inames))
+            shape = tuple(1 if i in axis else axis_len for i, axis_len in
+                enumerate(arg.shape))
+        else:
+            left_inames = tuple(iname for i, iname in enumerate(inames) if i
+                    not in axis)
+            shape = _one_if_empty(tuple(axis_len for i, axis_len in
+                enumerate(arg.shape) if i not in axis))
+
+        indices = tuple(Variable(iname) for iname in inames)
+        if get_expression is None:
+            expression = arg._call(indices)
+        else:
+            expression = get_expression(indices)
+
+        rule = lp.SubstitutionRule(
+                self.name_generator(based_on="subst"),
+                left_inames,
+                lp.Reduction(operation, reduction_inames, expression))
+        subst_name = self.register_substitution(rule, shape, domain,
+                dtype=dtype)
+
+        return ArraySymbol(
+                stack=self,
+                name=subst_name,
+                shape=shape,
+                dtype=dtype)
+
+    def sum(self, arg, axis=None, dtype=None, keepdims=False):
         """
         Registers  a substitution rule in order to sum the elements of array
         ``arg`` along ``axis``.
 
+        :arg axis: An instance of :class:`int` or a :class:`tuple` of them,
+            the axes along which the elements are summed, or *None* for all
+            the axes.
+        :arg dtype: The type in which the elements are summed. Defaults to
+            the type of ``arg``, except that narrow integers are summed as
+            platform integers, as in :func:`numpy.sum`.
+        :arg keepdims: If *True*, the summed axes are kept with length 1, so
+            that the result broadcasts against ``arg``.
+
         :return: An instance of :class:`numloopy.ArraySymbol` which is
             which is registered as the sum-substitution rule.
         """
-        if isinstance(axis, int):
-            axis = (axis, )
+        if dtype is None:
+            dtype = get_sum_dtype(arg.dtype.numpy_dtype)
+        dtype = normalize_dtype(dtype)
 
-        if not axis:
-            axis = tuple(range(len(arg.shape)))
+        from loopy.library.reduction import SumReductionOperation
+        return self._reduce(SumReductionOperation(forced_result_type=dtype),
+                arg, axis, keepdims, dtype)
 
-        inames = [self.name_generator(based_on="i") for _ in
-                arg.shape]
+    def prod(self, arg, axis=None, dtype=None, keepdims=False):
+        """
+        Registers a substitution rule for the product of the elements of the
+        array ``arg`` along ``axis``. The arguments are as in :meth:`sum`.
+        """
+        if dtype is None:
+            dtype = get_sum_dtype(arg.dtype.numpy_dtype)
+        dtype = normalize_dtype(dtype)
 
-        space = isl.Space.create_from_names(isl.DEFAULT_CONTEXT,
-                inames)
-        domain = isl.BasicSet.universe(space)
-        for axis_len, iname in zip(arg.shape, inames):
-            domain &= make_slab(space, iname, 0, axis_len)
+        from loopy.library.reduction import ProductReductionOperation
+        return self._reduce(ProductReductionOperation(
+            forced_result_type=dtype), arg, axis, keepdims, dtype)
 
-        self.domains.append(domain)
+    def max(self, arg, axis=None, keepdims=False):
+        """
+        Registers a substitution rule for the maximum of the elements of the
+        array ``arg`` along ``axis``. The arguments are as in :meth:`sum`.
+        """
+        from loopy.library.reduction import MaxReductionOperation
+        return self._reduce(MaxReductionOperation(forced_result_type=(
+            get_extremum_dtype(arg.dtype.numpy_dtype))), arg, axis, keepdims,
+            arg.dtype.numpy_dtype)
 
-        reduction_inames = tuple(iname for i, iname in enumerate(inames) if i in
-                axis)
-        left_inames = tuple(iname for i, iname in enumerate(inames) if i not in
-                axis)
+    def min(self, arg, axis=None, keepdims=False):
+        """
+        Registers a substitution rule for the minimum of the elements of the
+        array ``arg`` along ``axis``. The arguments are as in :meth:`sum`.
+        """
+        from loopy.library.reduction import MinReductionOperation
+        return self._reduce(MinReductionOperation(forced_result_type=(
+            get_extremum_dtype(arg.dtype.numpy_dtype))), arg, axis, keepdims,
+            arg.dtype.numpy_dtype)
 
-        def _one_if_empty(t):
-            if t:
-                return t
-            else:
-                return (1, )
+    def mean(self, arg, axis=None, dtype=None, keepdims=False):
+        """
+        Registers a substitution rule for the mean of the elements of the
+        array ``arg`` along ``axis``. The arguments are as in :meth:`sum`,
+        except that ``dtype`` defaults to :class:`numpy.float64` for arrays
+        of integers, as in :func:`numpy.mean`.
+        """
+        if dtype is None:
+            dtype = get_mean_dtype(arg.dtype.numpy_dtype)
+        dtype = normalize_dtype(dtype)
 
-        subst_name = self.name_generator(based_on="subst")
+        total = self.sum(arg, axis=axis, dtype=dtype, keepdims=keepdims)
+        count = product(arg.shape[i] for i in _normalize_axis(axis,
+            len(arg.shape)))
 
-        summed_arg = ArraySymbol(
+        inames = tuple(self.name_generator(based_on="i") for _ in total.shape)
+        rule = lp.SubstitutionRule(
+                self.name_generator(based_on="subst"),
+                inames,
+                total._call(tuple(Variable(iname) for iname in inames))
+                / (dtype.type(count) if isinstance(count, int) else count))
+        subst_name = self.register_substitution(rule, total.shape,
+                dtype=dtype)
+
+        return ArraySymbol(
                 stack=self,
                 name=subst_name,
-                shape=_one_if_empty(tuple(axis_len for i, axis_len in
-                    enumerate(arg.shape) if i not in axis)),
-                dtype=arg.dtype)
+                shape=total.shape,
+                dtype=dtype)
 
-        from loopy.library.reduction import SumReductionOperation
+    def _arg_extremum(self, find_extremum, arg, axis, keepdims):
+        """
+        Registers a substitution rule for the indices of the extrema found
+        by ``find_extremum`` (:meth:`max` or :meth:`min`) along ``axis``.
+        The index of an element is its position along ``axis``, or in the
+        flattened array if ``axis`` is *None*.
+
+        The index of the first element equal to the extremum is found by a
+        minimum reduction over the indices of the elements, so that the
+        extrema are found by a reduction separate from the one of the
+        indices.
+        """
+        if axis is not None and not isinstance(axis, Integral):
+            raise TypeError("axis must be an integer or None")
+        axis = _normalize_axis(axis, len(arg.shape))
+
+        extremum = find_extremum(arg, axis=axis, keepdims=True)
+
+        # row-major strides of the flattened reduced axes
+        strides = []
+        stride = 1
+        for i in axis[::-1]:
+            strides.insert(0, stride)
+            stride = stride * arg.shape[i]
+        n_indices = stride
+
+        def get_expression(indices):
+            index = sum((indices[i]*stride for i, stride in zip(axis,
+                strides)), 0)
+            return If(
+                    Comparison(
+                        arg._call(indices),
+                        "==",
+                        extremum._call(tuple(0 if i in axis else idx for i,
+                            idx in enumerate(indices)))),
+                    index,
+                    n_indices)
+
+        # the minimum is found among the 32-bit inames, as OpenCL has no
+        # minimum of integers of different types
+        from loopy.library.reduction import MinReductionOperation
+        return self._reduce(MinReductionOperation(forced_result_type=np.int32),
+                arg, axis, keepdims, np.int_, get_expression)
+
+    def argmax(self, arg, axis=None, keepdims=False):
+        """
+        Registers a substitution rule for the indices of the maxima of the
+        array ``arg`` along ``axis``. Mimics :func:`numpy.argmax`.
+
+        :arg axis: An instance of :class:`int`, or *None* for the indices in
+            the flattened array.
+        """
+        return self._arg_extremum(self.max, arg, axis, keepdims)
+
+    def argmin(self, arg, axis=None, keepdims=False):
+        """
+        Registers a substitution rule for the indices of the minima of the
+        array ``arg`` along ``axis``. Mimics :func:`numpy.argmin`.
+
+        :arg axis: An instance of :class:`int`, or *None* for the indices in
+            the flattened array.
+        """
+        return self._arg_extremum(self.min, arg, axis, keepdims)
+
+    def any(self, arg, axis=None, keepdims=False):
+        """
+        Registers a substitution rule testing whether any element of the
+        array ``arg`` along ``axis`` is non-zero. The arguments are as in
+        :meth:`sum`.
+
+        :return: An instance of :class:`numloopy.ArraySymbol` of type
+            :data:`numloopy.dtypes.BOOL_DTYPE`.
+        """
+        from loopy.library.reduction import MaxReductionOperation
+        return self._reduce(MaxReductionOperation(forced_result_type=np.int32),
+                arg, axis, keepdims, BOOL_DTYPE, lambda indices: Comparison(
+                    arg._call(indices), "!=", 0))
+
+    def all(self, arg, axis=None, keepdims=False):
+        """
+        Registers a substitution rule testing whether all the elements of the
+        array ``arg`` along ``axis`` are non-zero. The arguments are as in
+        :meth:`sum`.
+
+        :return: An instance of :class:`numloopy.ArraySymbol` of type
+            :data:`numloopy.dtypes.BOOL_DTYPE`.
+        """
+        from loopy.library.reduction import MinReductionOperation
+        return self._reduce(MinReductionOperation(forced_result_type=np.int32),
+                arg, axis, keepdims, BOOL_DTYPE, lambda indices: Comparison(
+                    arg._call(indices), "!=", 0))
+
+    def einsum(self, subscripts, *operands, **kwargs):
+        """
+        Registers a substitution rule for the Einstein summation of
+        ``operands`` described by ``subscripts``. Mimics :func:`numpy.einsum`,
+        except that ellipses are not supported.
+
+        The contracted indices are summed by a single :class:`loopy.Reduction`
+        over the product of the operands, so that the contraction can be
+        tiled by :func:`numloopy.tile_contractions`.
+
+        :arg subscripts: An instance of :class:`str`, for example
+            ``"ij,jk->ik"``. If the output subscript is omitted, the indices
+            appearing exactly once are the output indices in alphabetical
+            order.
+        :arg dtype: The type in which the contraction is computed. Defaults
+            to the type to which :mod:`numpy` promotes the operands.
+
+        :return: An instance of :class:`numloopy.ArraySymbol` which is
+            registered as the contraction.
+        """
+        dtype = kwargs.pop("dtype", None)
+        if kwargs:
+            raise TypeError("unexpected keyword arguments: {}".format(
+                ", ".join(kwargs)))
+        if dtype is None:
+            dtype = get_result_dtype(*operands)
+        dtype = normalize_dtype(dtype)
+
+        subscripts = subscripts.replace(" ", "")
+        if "." in subscripts:
+            raise NotImplementedError("ellipses in einsum")
+
+        if "->" in subscripts:
+            in_subscripts, out_subscript = subscripts.split("->")
+        else:
+            in_subscripts = subscripts
+            indices = in_subscripts.replace(",", "")
+            out_subscript = "".join(sorted(idx for idx in set(indices) if
+                indices.count(idx) == 1))
+        in_subscripts = in_subscripts.split(",")
+
+        if len(in_subscripts) != len(operands):
+            raise ValueError("einsum got {} subscripts for {} operands".format(
+                len(in_subscripts), len(operands)))
+
+        # extents of the indices, in the order of their appearance
+        extents = OrderedDict()
+        for subscript, operand in zip(in_subscripts, operands):
+            if len(subscript) != len(operand.shape):
+                raise ValueError("subscript '{}' does not match the shape {}"
+                        " of its operand".format(subscript, operand.shape))
+            for idx, axis_len in zip(subscript, operand.shape):
+                if extents.setdefault(idx, axis_len) != axis_len:
+                    raise ValueError("index '{}' has mismatching extents {} and"
+                            " {}".format(idx, extents[idx], axis_len))
+
+        for idx in out_subscript:
+            if idx not in extents or out_subscript.count(idx) > 1:
+                raise ValueError("invalid output subscript '{}'".format(
+                    out_subscript))
+
+        inames = dict((idx, self.name_generator(based_on="i")) for idx in
+                extents)
+
+        calls = tuple(Variable(operand.name)(*tuple(Variable(inames[idx]) for
+            idx in subscript)) for subscript, operand in zip(in_subscripts,
+                operands))
+        if len(calls) == 1:
+            rhs, = calls
+        else:
+            rhs = Product(calls)
+
+        reduction_inames = tuple(inames[idx] for idx in extents if idx not in
+                out_subscript)
+        if reduction_inames:
+            domain = make_box_domain(reduction_inames, tuple(extents[idx] for
+                idx in extents if idx not in out_subscript))
+
+            from loopy.library.reduction import SumReductionOperation
+            rhs = lp.Reduction(SumReductionOperation(forced_result_type=dtype),
+                    reduction_inames, rhs)
+        else:
+            domain = None
+
+        shape = tuple(extents[idx] for idx in out_subscript)
+        if not shape:
+            shape = (1, )
 
         rule = lp.SubstitutionRule(
-                subst_name,
-                left_inames,
-                lp.Reduction(
-                    SumReductionOperation(),
-                    reduction_inames,
-                    parse('{}({})'.format(arg.name,
-                        ', '.join(inames)))))
-        self.register_substitution(rule)
+                self.name_generator(based_on="subst"),
+                tuple(inames[idx] for idx in out_subscript),
+                rhs)
+        subst_name = self.register_substitution(rule, shape, domain,
+                dtype=dtype)
 
-        return summed_arg
+        return ArraySymbol(
+                stack=self,
+                name=subst_name,
+                shape=shape,
+                dtype=dtype)
+
+    def dot(self, a, b):
+        """
+        Registers a substitution rule for the dot product of the arrays ``a``
+        and ``b``. Mimics :func:`numpy.dot`, i.e. the last axis of ``a`` is
+        contracted with the second-to-last axis of ``b`` (or its only axis,
+        if ``b`` is one dimensional).
+
+        :return: An instance of :class:`numloopy.ArraySymbol` which is
+            registered as the contraction.
+        """
+        a_subscript = ascii_lowercase[:len(a.shape)]
+        contracted_idx = a_subscript[-1]
+        b_subscript = ascii_uppercase[:len(b.shape)]
+        if len(b.shape) == 1:
+            b_subscript = contracted_idx
+        else:
+            b_subscript = (b_subscript[:-2] + contracted_idx
+                    + b_subscript[-1])
+
+        return self.einsum("{},{}->{}".format(a_subscript, b_subscript,
+            a_subscript[:-1] + b_subscript.replace(contracted_idx, "")), a, b)
+
+    def matmul(self, a, b):
+        """
+        Registers a substitution rule for the matrix product of the arrays
+        ``a`` and ``b``. Mimics :func:`numpy.matmul`, except that the leading
+        batch axes of ``a`` and ``b`` are not broadcast, and hence must be
+        identical.
+
+        :return: An instance of :class:`numloopy.ArraySymbol` which is
+            registered as the contraction.
+        """
+        if (max(len(a.shape), len(b.shape)) <= 2
+                or min(len(a.shape), len(b.shape)) == 1):
+            # coincides with the dot product
+            return self.dot(a, b)
+
+        if a.shape[:-2] != b.shape[:-2]:
+            raise NotImplementedError("broadcasting the batch axes of matmul")
+
+        batch_subscript = ascii_uppercase[:len(a.shape)-2]
+
+        return self.einsum("{0}ij,{0}jk->{0}ik".format(batch_subscript), a, b)
+
+    def transpose(self, arg, axes=None):
+        """
+        Registers a substitution rule viewing ``arg`` with its axes
+        permuted. Mimics :func:`numpy.transpose`, see
+        :meth:`numloopy.ArraySymbol.transpose`.
+        """
+        if axes is None:
+            return arg.transpose()
+        return arg.transpose(tuple(axes))
+
+    def swapaxes(self, arg, axis1, axis2):
+        """
+        Mimics :func:`numpy.swapaxes`, see
+        :meth:`numloopy.ArraySymbol.swapaxes`.
+        """
+        return arg.swapaxes(axis1, axis2)
+
+    def moveaxis(self, arg, source, destination):
+        """
+        Mimics :func:`numpy.moveaxis`, see
+        :meth:`numloopy.ArraySymbol.moveaxis`.
+        """
+        return arg.moveaxis(source, destination)
 
     def argument(self, shape, dtype=np.float64):
         """
         Return an instance of :class:`numloopy.ArraySymbol` which the loop
         kernel expects as an input argument.
+
+        :arg shape: An instance of :class:`tuple` of the axis lengths. An axis
+            length is either an instance of :class:`int` or symbolic, i.e. a
+            :class:`str` (or :mod:`pymbolic` expression) affine in named
+            parameters, such as ``"n"`` or ``"2*n"``. The parameters become
+            integer arguments of the kernel, which loopy infers from the
+            shapes of the arrays passed, so that a kernel serves all the sizes.
         """
-        if isinstance(shape, int):
-            shape = (shape, )
-        assert isinstance(shape, tuple)
+        shape = normalize_shape(shape)
+        dtype = normalize_dtype(dtype)
 
         inames = tuple(
                self.name_generator(based_on='i') for _ in
@@ -346,163 +922,534 @@ class Stack(Record):
 
         rhs = Subscript(Variable(arg_name),
                 tuple(Variable(iname) for iname in inames))
-        subst_name = self.name_generator(based_on='subst')
-        self.register_substitution(lp.SubstitutionRule(subst_name,
-                inames, rhs))
+        subst_name = self.register_substitution(lp.SubstitutionRule(
+                self.name_generator(based_on='subst'), inames, rhs), shape,
+                dtype=dtype)
         self.substs_to_arrays[subst_name] = arg_name
+        self.arguments.append(arg_name)
 
         self.data.append(lp.GlobalArg(name=arg_name, shape=shape, dtype=dtype))
 
         return ArraySymbol(stack=self, name=subst_name, dtype=dtype,
                 shape=shape)
 
-    def cumsum(self, arg):
+    def cumsum(self, arg, axis=None, exclusive=False, dtype=None):
         """
         Registers  a substitution rule in order to cumulatively sum the
         elements of array ``arg`` along ``axis``. Mimics :func:`numpy.cumsum`.
 
+        The cumulative sum is computed by a scan, which is realized while
+        finalizing the stack (see :func:`numloopy.realize_scans`), so that the
+        work done is linear in the number of elements of ``arg``.
+
+        :arg axis: An instance of :class:`int` denoting the axis along which
+            the elements are summed. If *None*, the elements of the flattened
+            ``arg`` are summed.
+        :arg exclusive: If *True*, the element at index ``i`` along ``axis``
+            of ``arg`` is not included in the sum at index ``i``, i.e. the sum
+            at index ``0`` is 0.
+        :arg dtype: The type in which the elements are summed, see
+            :meth:`sum`.
+
         :return: An instance of :class:`numloopy.ArraySymbol` which is
             which is registered as the cumulative summed-substitution rule.
         """
+        if dtype is None:
+            dtype = get_sum_dtype(arg.dtype.numpy_dtype)
+        dtype = normalize_dtype(dtype)
+
+        if axis is None:
+            if len(arg.shape) != 1:
+                arg = arg.reshape((product(arg.shape), ))
+            axis = 0
+
+        if axis < 0:
+            axis += len(arg.shape)
+        if not 0 <= axis < len(arg.shape):
+            raise ValueError("axis {} is out of bounds for array of dimension"
+                    " {}".format(axis, len(arg.shape)))
+
         # Note: this can remain as a substitution but loopy does not have
         # support for translating inames for substitutions to the kernel
         # domains
-        assert len(arg.shape) == 1
-        i_iname = self.name_generator(based_on="i")
-        j_iname = self.name_generator(based_on="i")
-
-        space = isl.Space.create_from_names(isl.DEFAULT_CONTEXT, [i_iname,
-            j_iname])
-        domain = isl.BasicSet.universe(space)
-        arg_name = self.name_generator(based_on="arr")
-        subst_name = self.name_generator(based_on="subst")
-        domain = domain & make_slab(space, i_iname, 0, arg.shape[0])
+        inames = tuple(self.name_generator(based_on="i") for _ in arg.shape)
+        sweep_iname = inames[axis]
+        scan_iname = self.name_generator(based_on="i")
+
+        domain = make_box_domain(inames, arg.shape)
+        domain = domain.add_dims(isl.dim_type.set, 1).set_dim_name(
+                isl.dim_type.set, len(inames), scan_iname)
+        space = domain.get_space()
+        # 0 <= scan_iname <= sweep_iname, recognized as a scan by loopy
         domain = domain.add_constraint(
-                isl.Constraint.ineq_from_names(space, {j_iname: 1}))
+                isl.Constraint.ineq_from_names(space, {scan_iname: 1}))
         domain = domain.add_constraint(
                 isl.Constraint.ineq_from_names(space,
-                    {j_iname: -1, i_iname: 1, 1: -1}))
+                    {scan_iname: -1, sweep_iname: 1}))
+
+        arg_name = self.name_generator(based_on="arr")
+        subst_name = self.name_generator(based_on="subst")
         cumsummed_arg = ArraySymbol(
                 stack=self,
                 name=arg_name,
                 shape=arg.shape,
-                dtype=arg.dtype)
+                dtype=dtype)
         cumsummed_subst = ArraySymbol(
                 stack=self,
                 name=subst_name,
                 shape=arg.shape,
-                dtype=arg.dtype)
-        subst_iname = self.name_generator(based_on="i")
+                dtype=dtype)
+        subst_inames = tuple(self.name_generator(based_on="i") for _ in
+                arg.shape)
         rule = lp.SubstitutionRule(
-                subst_name, (subst_iname,), Subscript(Variable(arg_name),
-                    (Variable(subst_iname), )))
+                subst_name, subst_inames, Subscript(Variable(arg_name),
+                    tuple(Variable(iname) for iname in subst_inames)))
 
         from loopy.library.reduction import SumReductionOperation
 
         insn = lp.Assignment(
-                assignee=Subscript(Variable(arg_name), (Variable(i_iname), )),
+                assignee=Subscript(Variable(arg_name),
+                    tuple(Variable(iname) for iname in inames)),
                 expression=lp.Reduction(
-                    SumReductionOperation(),
-                    (j_iname, ),
-                    parse('{}({})'.format(arg.name,
-                        j_iname))))
+                    SumReductionOperation(forced_result_type=dtype),
+                    (scan_iname, ),
+                    Variable(arg.name)(*tuple(
+                        Variable(scan_iname if i == axis else iname) for i,
+                        iname in enumerate(inames)))),
+                tags=frozenset([SCAN_INSN_TAG]))
         self.data.append(cumsummed_arg)
         self.substs_to_arrays[subst_name] = arg_name
         self.register_implicit_assignment(insn)
         self.domains.append(domain)
 
-        self.register_substitution(rule)
-        return cumsummed_subst
+        subst_name = self.register_substitution(rule, arg.shape, dtype=dtype)
+        assert subst_name == cumsummed_subst.name
+
+        if not exclusive:
+            return cumsummed_subst
+
+        # the exclusive sum at index i is the inclusive sum at index i-1
+        inames = tuple(self.name_generator(based_on="i") for _ in arg.shape)
+        shifted_indices = tuple(Variable(iname) - 1 if i == axis else
+                Variable(iname) for i, iname in enumerate(inames))
+        rule = lp.SubstitutionRule(
+                self.name_generator(based_on="subst"), inames,
+                If(Comparison(Variable(inames[axis]), ">", 0),
+                    Variable(subst_name)(*shifted_indices), dtype.type(0)))
+        subst_name = self.register_substitution(rule, arg.shape, dtype=dtype)
 
-    def end_computation_stack(self, evaluate=(), transform=False):
+        return ArraySymbol(
+                stack=self,
+                name=subst_name,
+                shape=arg.shape,
+                dtype=dtype)
+
+    def end_computation_stack(self, evaluate=(), transform=False, cache=True,
+            scans="sequential", max_statements=None):
         """
         Returns an instance :class:`loopy.LoopKernel` corresponding to the
         computations pushed in the computation stack.
 
-        :arg variables_needed: An instance of :class:`tuple` of the variables
+        :arg evaluate: An instance of :class:`tuple` of the variables
             that must be computed
+        :arg transform: If *True*, the transformation data is also returned.
+            If ``"auto"``, the returned kernel is parallelized by
+            :func:`numloopy.autoparallelize`. If *False*, the transposes are
+            blocked by :func:`numloopy.tile_transposes`.
+        :arg cache: If *True*, the kernel is looked up in and stored to
+            :data:`numloopy.cache.DEFAULT_KERNEL_CACHE`. Can also be an
+            instance of :class:`numloopy.KernelCache` to be used instead, or
+            *False* to always generate the kernel.
+        :arg scans: How the scans of :meth:`cumsum` are realized. One of
+            ``"sequential"``, ``"parallel"`` (see
+            :func:`numloopy.realize_scans`) or *None* to leave them unrealized
+            in order to be transformed before calling
+            :func:`numloopy.realize_scans`. Parallel scans are best combined
+            with ``transform="auto"``, which computes each scan in a device
+            kernel of its own.
+        :arg max_statements: If not *None*, the computation is split into
+            kernels of about ``max_statements`` statements by
+            :func:`numloopy.split_kernel`, each of them transformed
+            separately, and an instance of :class:`list` of the kernels is
+            returned in place of the kernel.
 
         :return: An instance of :class:`loopy.LoopKerneel` for the computations
             registered on the stack. If ``transform=True`` the transformation
             data is also returned through the tuple ``knl, tf_data``. The
             transformation data ``tf_data`` is a mapping from names of the
             variables which are to be evaluated to the tuple of inames which
-            are involved in their respective assignments.
+            are involved in their respective assignments. The consecutive
+            assignments sharing a loop nest share their inames, see
+            :func:`numloopy.simplify.fuse_loop_nests`.
+        """
+        with timed("end_computation_stack"):
+            knl, tf_data, output_names = self._finalize(evaluate, cache)
+            if max_statements is None:
+                knl = self._transform(knl, tf_data, frozenset(self.arguments)
+                        | frozenset(output_names), transform, scans)
+            else:
+                knl = self._split(knl, tf_data, output_names, transform, scans,
+                        max_statements)
+
+        if transform == "auto":
+            return knl
+        elif transform:
+            return knl, tf_data
+        else:
+            return knl
+
+    def compile(self, inputs=None, outputs=(), transform=False, cache=True,
+            scans="sequential", allocator=None, max_statements=None):
+        """
+        Returns an instance of :class:`numloopy.CompiledKernel` computing
+        ``outputs``, which is called with the arrays of ``inputs`` as
+        positional arguments. If the computation is split into several
+        kernels (see ``max_statements``), an instance of
+        :class:`numloopy.CompiledProgram` running them one after the other is
+        returned instead.
+
+        :arg inputs: An instance of :class:`tuple` of the variables returned
+            by :meth:`argument`. Defaults to all of them, in the order of
+            their creation.
+        :arg outputs: An instance of :class:`tuple` of the variables that
+            must be computed and returned, in that order.
+        :arg allocator: See :attr:`numloopy.CompiledKernel.allocator`.
+
+        The other arguments are as in :meth:`end_computation_stack`, except
+        that ``transform`` is either *False* or ``"auto"``.
+        """
+        from numloopy.compiled import CompiledKernel, CompiledProgram
+
+        if inputs is None:
+            input_names = tuple(self.arguments)
+        else:
+            input_names = []
+            for arg in inputs:
+                try:
+                    input_names.append(self.substs_to_arrays[arg.name])
+                except KeyError:
+                    raise ValueError("'{}' was not created by Stack.argument"
+                            .format(arg.name))
+                if input_names[-1] not in self.arguments:
+                    raise ValueError("'{}' was not created by Stack.argument"
+                            .format(arg.name))
+            input_names = tuple(input_names)
+
+        with timed("end_computation_stack"):
+            knl, tf_data, output_names = self._finalize(outputs, cache)
+            if max_statements is None:
+                knl = self._transform(knl, tf_data, frozenset(self.arguments)
+                        | frozenset(output_names), transform, scans)
+            else:
+                kernels = self._split(knl, tf_data, output_names, transform,
+                        scans, max_statements)
+                if len(kernels) > 1:
+                    return CompiledProgram(kernels, input_names, output_names,
+                            allocator=allocator)
+                knl, = kernels
+
+        return CompiledKernel(knl, input_names, output_names,
+                allocator=allocator)
+
+    def _split(self, knl, tf_data, output_names, transform, scans,
+            max_statements):
+        """
+        Returns an instance of :class:`list` of the kernels computing ``knl``
+        as split by :func:`numloopy.split_kernel`, with the transformations
+        requested from :meth:`end_computation_stack` applied to each of them.
+        The arrays used by several kernels are left as arguments.
+        """
+        kernels = split_kernel(knl, max_statements)
+        if len(kernels) > 1:
+            # the types are inferred before splitting, as a kernel might only
+            # read the arrays computed by the others
+            kernels = split_kernel(lp.infer_unknown_types(knl), max_statements)
+        count("kernels", len(kernels))
+
+        shared_names = set()
+        used_names = set()
+        for kernel in kernels:
+            arg_names = frozenset(arg.name for arg in kernel.args)
+            shared_names.update(used_names & arg_names)
+            used_names.update(arg_names)
+
+        escaping_names = (frozenset(self.arguments) | frozenset(output_names)
+                | shared_names)
+
+        return [self._transform(kernel, tf_data, escaping_names, transform,
+            scans) for kernel in kernels]
+
+    @timed("transform")
+    def _transform(self, knl, tf_data, escaping_names, transform, scans):
+        """
+        Applies the transformations requested from
+        :meth:`end_computation_stack` to ``knl``.
+
+        :arg escaping_names: See :func:`numloopy.demote_internal_arrays`.
+        """
+        if scans not in ("sequential", "parallel", None):
+            raise ValueError("unknown scan realization '{}'".format(scans))
+
+        knl = fuse_reductions(knl)
+
+        if transform == "auto":
+            # parallelized before realizing the scans, so that each scan is
+            # realized in the device kernel of its instruction
+            knl = autoparallelize(knl, tf_data)
+        elif not transform:
+            # blocked, so that the reads and the writes stay in cache
+            knl = tile_transposes(knl, parallel=False)
+
+        # the arrays created by the stack which are not evaluated are not
+        # visible to the caller. Unless the caller transforms the kernel,
+        # small ones can be private.
+        knl = demote_internal_arrays(knl, escaping_names,
+                allow_private=not transform)
+
+        if scans is not None:
+            knl = realize_scans(knl, parallel=(scans == "parallel"))
+
+        return knl
+
+    def _finalize(self, evaluate, cache):
+        """
+        Returns the kernel for the computations registered on the stack,
+        looked up in ``cache`` if possible.
+
+        :return: A tuple ``knl, tf_data, output_names``, see
+            :meth:`_build_kernel`.
+        """
+        if cache is False:
+            return self._build_kernel(evaluate)
+
+        from numloopy.cache import get_structural_key, KernelCacheEntry
+        if cache is True:
+            from numloopy.cache import DEFAULT_KERNEL_CACHE
+            cache = DEFAULT_KERNEL_CACHE
+
+        try:
+            with timed("cache_lookup"):
+                key, canonical_names = get_structural_key(self, evaluate)
+                entry = cache[key]
+        except KeyError:
+            names_before = set(self.name_generator.existing_names)
+            knl, tf_data, output_names = self._build_kernel(evaluate)
+            # the reused steps generated their names in earlier
+            # finalizations
+            finalization_names = frozenset(
+                    self.name_generator.existing_names - names_before).union(
+                            *(step.generated_names for step in
+                                self.finalization_steps))
+            cache[key] = KernelCacheEntry(
+                    kernel=knl,
+                    tf_data=tf_data,
+                    output_names=output_names,
+                    names=dict((canonical_name, name) for name,
+                        canonical_name in canonical_names.items()),
+                    finalization_names=finalization_names)
+            return knl, tf_data, output_names
+        else:
+            return entry.instantiate(canonical_names, self.name_generator)
+
+    @timed("convert")
+    def _convert_substitution(self, i, rule, materialized_args,
+            substs_to_arg_mapper):
+        """
+        Returns a :class:`numloopy.stack.FinalizationStep` converting the
+        substitution ``rule``, registered at the position ``i`` of the stack,
+        along with the implicit assignments registered before it. The substitution is
+        computed into a new array for every entry of ``materialized_args``.
+
+        :arg substs_to_arg_mapper: An instance of
+            :class:`SubstToArrayExapander` for the arrays materialized by the
+            previous steps.
+        """
+        generated_names = []
+
+        def generate_name(based_on):
+            name = self.name_generator(based_on=based_on)
+            generated_names.append(name)
+            return name
+
+        step = FinalizationStep(
+                statements=[insn.with_transformed_expressions(
+                    substs_to_arg_mapper) for insn in
+                    self.implicit_assignments.get(i, [])],
+                domains=[], data=[], tf_data={}, array_names=[])
+
+        for arg in materialized_args:
+            arg_name = generate_name("arr")
+            step.data.append(arg.copy(name=arg_name))
+            step.array_names.append(arg_name)
+
+            # the statement invokes the substitution, which is left
+            # unexpanded
+            if rule.arguments:
+                inames = tuple(generate_name("i") for _ in arg.shape)
+                stmnt = lp.Assignment(
+                        assignee=parse('{}[{}]'.format(arg_name,
+                            ', '.join(inames))),
+                        expression=parse('{}({})'.format(rule.name,
+                            ', '.join(inames))))
+                step.domains.append(make_box_domain(inames, arg.shape))
+                step.tf_data[rule.name] = inames
+                if _is_contraction(rule):
+                    stmnt = stmnt.copy(tags=frozenset([
+                        CONTRACTION_INSN_TAG]))
+                elif _is_transpose(rule):
+                    stmnt = stmnt.copy(tags=frozenset([
+                        TRANSPOSE_INSN_TAG]))
+            else:
+                stmnt = lp.Assignment(
+                        assignee=parse('{}[0]'.format(arg_name)),
+                        expression=parse('{}()'.format(rule.name)))
+                step.tf_data[rule.name] = ()
+            step.statements.append(stmnt)
+
+        step.substitution = rule.copy(
+                expression=substs_to_arg_mapper(rule.expression))
+        step.generated_names = frozenset(generated_names)
+
+        return step
+
+    def _build_kernel(self, evaluate):
+        """
+        Generates the kernel for :meth:`end_computation_stack`, leaving the
+        stack unchanged except for :attr:`finalization_steps`.
+
+        The substitutions are converted one by one into
+        :class:`numloopy.stack.FinalizationStep`. The steps of the previous
+        finalization are reused as long as the substitutions they convert are
+        materialized alike, so that a stack extended by a few operations only
+        converts the new ones.
+
+        :return: A tuple ``knl, tf_data, output_names``, where
+            ``output_names`` is a :class:`tuple` of the names of the arrays
+            holding the variables of ``evaluate``.
         """
         statements = []
         tf_data = {}
         domains = self.domains[:]
         data = self.data[:]
         substitutions = {}
-        substitutions_needed = [array_sym.name for array_sym in
-                evaluate if array_sym.name not in self.substs_to_arrays]
+        output_names = [self.substs_to_arrays.get(array_sym.name) for
+                array_sym in evaluate]
+        planned_names = plan_materialization(self, evaluate)
 
+        # the mapper shares substs_to_arrays, so that the substitutions
+        # materialized so far are expanded to their arrays without rebuilding
+        # the mapper for every substitution
         substs_to_arrays = self.substs_to_arrays.copy()
+        substs_to_arg_mapper = SubstToArrayExapander(substs_to_arrays)
+
+        steps = []
+        n_reused = 0
 
         for i, rule in enumerate(self.registered_substitutions):
-            substs_to_arg_mapper = SubstToArrayExapander(
-                    substs_to_arrays.copy())
+            # the same substitution might be evaluated more than once, as
+            # identical expressions are hash-consed into one substitution
+            evaluated = [i_output for i_output, arg in enumerate(evaluate) if
+                    arg.name == rule.name and output_names[i_output] is None]
+            materialized_args = [evaluate[i_output] for i_output in evaluated]
+            if rule.name in planned_names:
+                dtype = self.substs_to_dtypes.get(rule.name)
+                materialized_args.append(lp.GlobalArg(rule.name,
+                    dtype=lp.auto if dtype is None else dtype,
+                    shape=self.substs_to_shapes[rule.name]))
+            key = tuple((arg.shape, arg.dtype) for arg in materialized_args)
+
+            if (n_reused == i and i < len(self.finalization_steps)
+                    and self.finalization_steps[i].key == key):
+                step = self.finalization_steps[i]
+                n_reused += 1
+            else:
+                step = self._convert_substitution(i, rule, materialized_args,
+                        substs_to_arg_mapper)
+                step.key = key
+
+            statements.extend(step.statements)
+            domains.extend(step.domains)
+            data.extend(step.data)
+            tf_data.update(step.tf_data)
+            substitutions[rule.name] = step.substitution
+            for i_output, arg_name in zip(evaluated, step.array_names):
+                output_names[i_output] = arg_name
+            if step.array_names:
+                substs_to_arrays[rule.name] = step.array_names[-1]
+            steps.append(step)
+
+        count("reused_substitutions", n_reused)
+        count("converted_substitutions", len(steps) - n_reused)
+        self.finalization_steps[:] = steps
+
+        with timed("convert"):
             statements.extend([insn.with_transformed_expressions(
                 substs_to_arg_mapper) for insn in
-                self.implicit_assignments.pop(i, [])])
-            if rule.name in substitutions_needed:
-                rule = rule.copy(
-                        expression=substs_to_arg_mapper(rule.expression))
-                arg_name = self.name_generator(based_on="arr")
-                arg = evaluate[
-                        substitutions_needed.index(rule.name)]
-                data.append(arg.copy(name=arg_name))
-                substs_to_arrays[arg.name] = arg_name
-
-                if arg.shape != (1, ) and arg.shape != (1):
-                    inames = tuple(self.name_generator(based_on='i') for _ in
-                            arg.shape)
-                    space = isl.Space.create_from_names(isl.DEFAULT_CONTEXT, inames)
-                    domain = isl.BasicSet.universe(space)
-
-                    for iname_name, axis_length in zip(inames, arg.shape):
-                        domain &= make_slab(space, iname_name, 0, axis_length)
-
-                    assignee = substs_to_arg_mapper(parse('{}[{}]'.format(arg_name,
-                        ', '.join(inames))))
-                    stmnt = lp.Assignment(assignee=assignee,
-                            expression=parse('{}({})'.format(arg.name,
-                                ', '.join(inames))))
-                    domains.append(domain)
-                    tf_data[arg.name] = inames
-                else:
-                    assignee = parse('{}[0]'.format(arg_name))
-                    stmnt = lp.Assignment(assignee=assignee,
-                            expression=parse('{}()'.format(arg.name)))
-                    tf_data[arg.name] = ()
-                statements.append(stmnt.with_transformed_expressions(
-                    substs_to_arg_mapper))
-
-            substitutions[rule.name] = rule.copy(
-                    expression=substs_to_arg_mapper(rule.expression))
-
-        substs_to_arg_mapper = SubstToArrayExapander(
-                substs_to_arrays.copy())
-
-        statements.extend([insn.with_transformed_expressions(
-            substs_to_arg_mapper) for insn in
-            self.implicit_assignments.pop(i+1, [])])
-
-        knl = lp.make_kernel(
-                domains=domains,
-                instructions=statements,
-                kernel_data=data,
-                seq_dependencies=True,
-                lang_version=(2018, 2))
-        knl = knl.copy(substitutions=substitutions)
-        if transform:
-            return knl, tf_data
-        else:
-            return knl
+                self.implicit_assignments.get(
+                    len(self.registered_substitutions), [])])
+
+        dtypes = dict(self.substs_to_dtypes)
+        dtypes.update((arg.name, to_loopy_type(arg.dtype).numpy_dtype) for arg
+                in data if arg.dtype not in (None, lp.auto))
+        substitutions = simplify_substitutions(substitutions, dtypes)
+        # the arguments are kept, as the caller passes them anyway
+        statements, domains, data, substitutions = eliminate_dead_code(
+                statements, domains, data, substitutions,
+                frozenset(self.arguments) | frozenset(output_names))
+        inames = frozenset().union(*(domain.get_var_names(isl.dim_type.set)
+            for domain in domains))
+        tf_data = dict((name, tf_inames) for name, tf_inames in tf_data.items()
+                if name in substitutions and inames.issuperset(tf_inames))
+        statements, domains, renames = fuse_loop_nests(statements, domains,
+                substitutions, tf_data)
+        tf_data = dict((name, tuple(renames.get(iname, iname) for iname in
+            tf_inames)) for name, tf_inames in tf_data.items())
+        statements = add_dependencies(statements, substitutions)
+
+        if not domains:
+            # the statements assigning scalars are outside of any loop
+            domains = [isl.BasicSet.universe(isl.Space.create_from_names(
+                isl.DEFAULT_CONTEXT, set=[]))]
+
+        # the parameters of the symbolic axis lengths
+        parameters = set()
+        for domain in domains:
+            parameters.update(domain.get_var_names(isl.dim_type.param))
+        for arg in data:
+            parameters.update(get_shape_parameters(arg.shape))
+        # the assumptions on the parameters which are not arguments of the
+        # kernel are left out
+        assumptions = isl.BasicSet("[{}] -> {{ : {} }}".format(
+            ", ".join(sorted(parameters)), " and ".join(sorted(
+                "{} >= 0".format(expr) for expr in self.assumptions if
+                get_dependencies(expr) <= parameters)) or "true"))
+
+        count("rules", len(self.registered_substitutions))
+        count("domains", len(domains))
+        count("inames", sum(domain.dim(isl.dim_type.set) for domain in
+            domains))
+        count("statements", len(statements))
+
+        with timed("make_kernel"):
+            knl = lp.make_kernel(
+                    domains=domains,
+                    instructions=statements,
+                    kernel_data=[_as_kernel_argument(arg) for arg in data] + [
+                        lp.ValueArg(name, dtype=np.int32) for name in
+                        sorted(parameters)],
+                    assumptions=assumptions,
+                    lang_version=(2018, 2))
+            knl = knl.copy(substitutions=substitutions)
+
+        return knl, tf_data, tuple(output_names)
 
 
 def begin_computation_stack():
     """
     Must be called to initialize a computational stack.
+
+    The returned stack is independent of the other stacks, and hence
+    different stacks may be built from different threads. A single stack
+    must not be modified from several threads at once.
     """
     return Stack()
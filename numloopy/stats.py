@@ -0,0 +1,181 @@
+import json
+import threading
+from time import perf_counter
+from contextlib import contextmanager
+
+
+__doc__ = """
+.. currentmodule:: numloopy
+
+.. autoclass:: BuildStats
+.. autofunction:: collect_stats
+
+.. data:: numloopy.stats.PHASES
+
+    The names of the phases recorded in :class:`BuildStats`, in the order in
+    which a stack goes through them.
+"""
+
+
+PHASES = (
+        "register",
+        "domains",
+        "cache_lookup",
+        "plan",
+        "convert",
+        "simplify",
+        "make_kernel",
+        "transform",
+        "end_computation_stack",
+        "codegen",
+        )
+
+
+class BuildStats(object):
+    """
+    The wall times and counts recorded while turning stacks into kernels,
+    see :func:`collect_stats`.
+
+    The phases are the ones of :data:`numloopy.stats.PHASES`:
+
+    * ``"register"``: registering the substitutions and implicit assignments
+      of the operations on the stack.
+    * ``"domains"``: constructing the :mod:`islpy` domains of the inames.
+    * ``"cache_lookup"``: computing the structural key of the stack and
+      looking it up in the kernel cache.
+    * ``"plan"``: planning the substitutions to be materialized.
+    * ``"convert"``: converting the substitutions and assignments of the
+      stack to the statements of the kernel.
+    * ``"simplify"``: simplifying the substitutions of the kernel,
+      eliminating the parts not contributing to the outputs, merging the
+      loop nests and computing the dependencies of the statements, see
+      :mod:`numloopy.simplify`.
+    * ``"make_kernel"``: :func:`loopy.make_kernel`.
+    * ``"transform"``: the transformations applied to the generated kernel.
+    * ``"end_computation_stack"``: the whole finalization of a stack,
+      including the phases above but ``"register"``.
+    * ``"codegen"``: generating the code and building the program of a
+      :class:`numloopy.CompiledKernel`.
+
+    The counts are summed over the finalizations, and are ``"rules"``,
+    ``"domains"``, ``"inames"`` and ``"statements"`` of the generated
+    kernels, ``"converted_substitutions"`` and ``"reused_substitutions"``
+    of incremental finalizations, and ``"kernels"`` of the computations split
+    by :func:`numloopy.split_kernel`.
+
+    .. attribute:: wall_times
+
+        A mapping from the names of the phases to the total wall time spent
+        in them, in seconds.
+
+    .. attribute:: calls
+
+        A mapping from the names of the phases to the number of times they
+        were entered.
+
+    .. attribute:: counts
+
+        A mapping from the names of the counts to their values.
+
+    .. automethod:: as_dict
+    .. automethod:: to_json
+    """
+    def __init__(self):
+        self.wall_times = {}
+        self.calls = {}
+        self.counts = {}
+
+    def record(self, phase, wall_time):
+        self.wall_times[phase] = self.wall_times.get(phase, 0) + wall_time
+        self.calls[phase] = self.calls.get(phase, 0) + 1
+
+    def count(self, name, value):
+        self.counts[name] = self.counts.get(name, 0) + value
+
+    def as_dict(self):
+        """
+        Returns the statistics as a :class:`dict` of the form ``{"phases":
+        {phase: {"wall_time": ..., "calls": ...}}, "counts": {name: ...}}``.
+        """
+        return {
+                "phases": dict(
+                    (phase, {"wall_time": self.wall_times[phase],
+                        "calls": self.calls[phase]})
+                    for phase in self.wall_times),
+                "counts": dict(self.counts)}
+
+    def to_json(self, **kwargs):
+        """
+        Returns :meth:`as_dict` serialized by :func:`json.dumps`, which is
+        passed ``kwargs``.
+        """
+        return json.dumps(self.as_dict(), **kwargs)
+
+
+_collectors = threading.local()
+
+
+def _get_active_stats():
+    return getattr(_collectors, "stack", None)
+
+
+@contextmanager
+def collect_stats(stats=None):
+    """
+    Returns a context manager recording the phases of the stacks built and
+    finalized by the current thread within the context into ``stats``. The
+    recording is opt-in, as the phases are not timed outside of the context.
+    Nested contexts record into all the enclosing statistics.
+
+    :arg stats: An instance of :class:`BuildStats` to be added to, or *None*
+        for a new one.
+
+    :return: The instance of :class:`BuildStats`, bound by the ``with``
+        statement::
+
+            with numloopy.collect_stats() as stats:
+                np = numloopy.begin_computation_stack()
+                ...
+                knl = np.end_computation_stack([y])
+
+            print(stats.to_json())
+    """
+    if stats is None:
+        stats = BuildStats()
+
+    if _get_active_stats() is None:
+        _collectors.stack = []
+
+    _collectors.stack.append(stats)
+    try:
+        yield stats
+    finally:
+        _collectors.stack.pop()
+
+
+@contextmanager
+def timed(phase):
+    """
+    Returns a context manager recording the wall time of its body as
+    ``phase`` into the active :class:`BuildStats`, if any.
+    """
+    if not _get_active_stats():
+        yield
+        return
+
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        wall_time = perf_counter() - start
+        for stats in _get_active_stats():
+            stats.record(phase, wall_time)
+
+
+def count(name, value):
+    """
+    Adds ``value`` to the count ``name`` of the active :class:`BuildStats`,
+    if any.
+    """
+    for stats in _get_active_stats() or ():
+        stats.count(name, value)
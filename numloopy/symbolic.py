@@ -0,0 +1,261 @@
+import islpy as isl
+from numbers import Integral
+from loopy.isl_helpers import make_slab
+from loopy.symbolic import (IdentityMapper, CombineMapper, WalkMapper,
+        get_dependencies)
+from pymbolic import parse
+from pymbolic.primitives import Variable, Expression
+from numloopy.stats import timed
+
+
+__doc__ = """
+.. autoclass:: VariableRenamer
+.. autofunction:: rename_domain
+.. autofunction:: get_substitution_key
+.. autofunction:: normalize_shape
+.. autofunction:: get_shape_parameters
+.. autofunction:: make_box_domain
+.. autoclass:: SubstitutionCallCounter
+.. autoclass:: NameCollector
+.. autoclass:: UsedNameGetter
+"""
+
+
+class VariableRenamer(IdentityMapper):
+    """
+    Mapper to rename the variables of an expression. As calls to substitution
+    rules and the inames of reductions are variables too, they are also
+    renamed.
+
+    .. attribute:: renames
+
+        A callable mapping the old name of the variable, an instance of
+        :class:`str`, to its new name.
+    """
+    def __init__(self, renames):
+        self.renames = renames
+
+    def map_variable(self, expr):
+        return Variable(self.renames(expr.name))
+
+
+def rename_domain(domain, renames):
+    """
+    Returns a copy of ``domain`` with its set dimensions renamed.
+
+    :arg domain: An instance of :class:`islpy.BasicSet`.
+    :arg renames: A callable mapping the old name of the dimension to its new
+        name.
+    """
+    for i, iname in enumerate(domain.get_var_names(isl.dim_type.set)):
+        domain = domain.set_dim_name(isl.dim_type.set, i, renames(iname))
+
+    return domain
+
+
+def get_substitution_key(rule, shape, domain=None, dtype=None):
+    """
+    Returns a hashable key of the substitution rule ``rule`` such that two
+    structurally identical substitution rules have the same key. The
+    arguments of ``rule`` and the dimensions of ``domain`` are replaced by
+    positional names.
+
+    :arg rule: An instance of :class:`loopy.SubstitutionRule`.
+    :arg shape: The shape of the array represented by ``rule``. Part of the
+        key, as a substitution might be evaluated to an array of this shape.
+    :arg domain: An instance of :class:`islpy.BasicSet` of the inames local to
+        ``rule`` (e.g. its reduction inames), or *None*.
+    :arg dtype: The type of the array represented by ``rule``. Part of the
+        key, as the constants of ``rule`` print alike for all types.
+    """
+    local_names = {}
+    for i, arg in enumerate(rule.arguments):
+        local_names[arg] = "_arg_%d" % i
+
+    if domain is not None:
+        for i, iname in enumerate(domain.get_var_names(isl.dim_type.set)):
+            local_names.setdefault(iname, "_dim_%d" % i)
+
+    def rename(name):
+        return local_names.get(name, name)
+
+    if domain is not None:
+        domain = str(rename_domain(domain, rename))
+
+    return (tuple(shape), str(VariableRenamer(rename)(rule.expression)),
+            domain, dtype)
+
+
+def normalize_shape(shape):
+    """
+    Returns ``shape`` as a :class:`tuple` whose axis lengths are either
+    instances of :class:`int` or, for the symbolic axis lengths, of
+    :class:`pymbolic.primitives.Expression` affine in the parameters of the
+    kernel.
+
+    :arg shape: An axis length or a :class:`tuple` of axis lengths, each an
+        integer, a :class:`str` such as ``"n"`` or ``"2*n"``, or a
+        :mod:`pymbolic` expression.
+    """
+    if not isinstance(shape, tuple):
+        shape = (shape, )
+
+    def normalize(axis_len):
+        if isinstance(axis_len, str):
+            axis_len = parse(axis_len)
+        if isinstance(axis_len, Integral):
+            return int(axis_len)
+        if isinstance(axis_len, Expression):
+            return axis_len
+        raise TypeError("Shape can only be initialized by numbers or"
+                " strings")
+
+    return tuple(normalize(axis_len) for axis_len in shape)
+
+
+def get_shape_parameters(shape):
+    """
+    Returns a :class:`frozenset` of the names of the parameters on which the
+    axis lengths of ``shape``, as returned by :func:`normalize_shape`,
+    depend.
+    """
+    return frozenset().union(*(get_dependencies(axis_len) for axis_len in
+        shape if not isinstance(axis_len, int)))
+
+
+@timed("domains")
+def make_box_domain(inames, shape):
+    """
+    Returns an instance of :class:`islpy.BasicSet` in which every iname of
+    ``inames`` ranges over the corresponding axis of ``shape``. The
+    parameters of the symbolic axis lengths are parameters of the domain.
+    """
+    space = isl.Space.create_from_names(isl.DEFAULT_CONTEXT, set=inames,
+            params=sorted(get_shape_parameters(shape)))
+    domain = isl.BasicSet.universe(space)
+
+    for iname, axis_len in zip(inames, shape):
+        domain &= make_slab(space, iname, 0, axis_len)
+
+    return domain
+
+
+class SubstitutionCallCounter(CombineMapper):
+    """
+    Mapper returning the number of times each substitution is invoked while
+    evaluating an expression once, as a mapping from the names of the
+    substitutions to the counts. The invocations inside a reduction are
+    counted once per iteration of the reduction.
+
+    .. attribute:: subst_names
+
+        The names of the substitutions to be counted.
+
+    .. attribute:: iname_extents
+
+        A mapping from the inames to their extents. Inames without an extent
+        are assumed to have a single iteration, so that an empty mapping
+        counts the call sites of the substitutions.
+    """
+    def __init__(self, subst_names, iname_extents):
+        self.subst_names = subst_names
+        self.iname_extents = iname_extents
+
+    def combine(self, values):
+        result = {}
+        for value in values:
+            for name, count in value.items():
+                result[name] = result.get(name, 0) + count
+        return result
+
+    def map_constant(self, expr, *args):
+        return {}
+
+    map_variable = map_constant
+
+    def map_call(self, expr, *args):
+        result = self.combine(self.rec(par) for par in expr.parameters)
+        if expr.function.name in self.subst_names:
+            result[expr.function.name] = result.get(expr.function.name, 0) + 1
+        return result
+
+    def map_reduction(self, expr, *args):
+        iterations = 1
+        for iname in expr.inames:
+            iterations *= self.iname_extents.get(iname, 1)
+
+        return dict((name, iterations*count) for name, count in
+                self.rec(expr.expr).items())
+
+
+class NameCollector(WalkMapper):
+    """
+    Mapper collecting the names of the variables of an expression into
+    :attr:`names`, including the arrays, the called substitutions and the
+    inames of the reductions.
+    """
+    def __init__(self):
+        self.names = set()
+
+    def map_variable(self, expr):
+        self.names.add(expr.name)
+
+    def map_reduction(self, expr):
+        self.names.update(expr.inames)
+        self.rec(expr.expr)
+
+
+class UsedNameGetter(object):
+    """
+    Returns the names used by an expression, as collected by
+    :class:`NameCollector`, including the ones used by the substitutions it
+    invokes, directly or not.
+
+    .. attribute:: substitutions
+
+        A mapping from the names of the rules to the instances of
+        :class:`loopy.SubstitutionRule`.
+    """
+    def __init__(self, substitutions):
+        self.substitutions = substitutions
+        self.rule_names = {}
+
+    def get_names(self, expr):
+        collector = NameCollector()
+        collector(expr)
+        return collector.names
+
+    def get_rule_names(self, name):
+        """
+        Returns the names used directly by the substitution ``name``.
+        """
+        if name not in self.rule_names:
+            self.rule_names[name] = frozenset(self.get_names(
+                self.substitutions[name].expression))
+        return self.rule_names[name]
+
+    def __call__(self, expr, expanded_rules=None):
+        """
+        :arg expanded_rules: If not *None*, a :class:`set` of the names of
+            the substitutions whose names are not collected again, e.g. as
+            they were collected by an earlier call. The substitutions
+            visited are added to it, so that a shared set collects the names
+            of every substitution once.
+        """
+        if expanded_rules is None:
+            expanded_rules = set()
+
+        names = self.get_names(expr)
+        # a worklist rather than a recursion, as the chains of substitutions
+        # of long computations are deeper than the recursion limit
+        worklist = [name for name in names if name in self.substitutions]
+        while worklist:
+            name = worklist.pop()
+            if name in expanded_rules:
+                continue
+            expanded_rules.add(name)
+            rule_names = self.get_rule_names(name)
+            names.update(rule_names)
+            worklist.extend(callee for callee in rule_names if callee in
+                    self.substitutions and callee not in expanded_rules)
+        return names
@@ -0,0 +1,702 @@
+import numpy as np
+import islpy as isl
+import loopy as lp
+from pymbolic.primitives import Variable, Subscript
+from loopy.symbolic import (SubstitutionRuleExpander, WalkMapper,
+        pw_aff_to_expr)
+from numloopy.symbolic import (VariableRenamer, UsedNameGetter, rename_domain,
+        get_shape_parameters)
+
+
+__doc__ = """
+.. currentmodule:: numloopy
+
+.. autofunction:: fuse_reductions
+.. autofunction:: realize_scans
+.. autofunction:: tile_contractions
+.. autofunction:: tile_transposes
+.. autofunction:: autoparallelize
+.. autofunction:: demote_internal_arrays
+.. autofunction:: split_kernel
+
+.. data:: SCAN_INSN_TAG
+
+    The tag of the instructions computing the scans of :meth:`Stack.cumsum`.
+
+.. data:: CONTRACTION_INSN_TAG
+
+    The tag of the instructions evaluating the contractions of
+    :meth:`Stack.einsum`.
+
+.. data:: TRANSPOSE_INSN_TAG
+
+    The tag of the instructions materializing the views of
+    :meth:`ArraySymbol.transpose` (and hence of :attr:`ArraySymbol.T`,
+    :meth:`ArraySymbol.swapaxes` and :meth:`ArraySymbol.moveaxis`).
+
+.. data:: FUSED_REDUCTION_TAG
+
+    The tag of the instructions whose reductions were fused by
+    :func:`fuse_reductions`.
+"""
+
+
+SCAN_INSN_TAG = "numloopy_scan"
+CONTRACTION_INSN_TAG = "numloopy_contraction"
+FUSED_REDUCTION_TAG = "numloopy_fused_reduction"
+TRANSPOSE_INSN_TAG = "numloopy_transpose"
+
+
+def _get_full_reduction(knl, insn):
+    """
+    Returns the :class:`loopy.Reduction` evaluated by ``insn`` if it assigns
+    a substitution without arguments reducing along all of its inames (e.g.
+    ``np.sum(x)``) outside of any loop, otherwise *None*.
+    """
+    if not isinstance(insn, lp.Assignment) or insn.within_inames:
+        return None
+
+    from pymbolic.primitives import Call
+    if not isinstance(insn.expression, Call):
+        return None
+
+    rule = knl.substitutions.get(insn.expression.function.name)
+    if (rule is None or rule.arguments
+            or not isinstance(rule.expression, lp.Reduction)):
+        return None
+
+    return rule.expression
+
+
+def _get_reduction_domain_key(knl, reduction):
+    """
+    Returns a key of the iteration space of ``reduction``, equal for the
+    reductions over the same domain up to the names of their inames.
+    """
+    inames = reduction.inames
+    domain = knl.get_inames_domain(frozenset(inames)).project_out_except(
+            inames, [isl.dim_type.set])
+    canonical_names = dict((iname, "_nlp_red_%d" % i) for i, iname in
+            enumerate(inames))
+
+    return str(rename_domain(domain, canonical_names.get))
+
+
+def _get_reduction_inames(expr):
+    """
+    Returns a :class:`set` of the inames of the reductions in ``expr``.
+    """
+    from loopy.symbolic import ReductionCallbackMapper
+    inames = set()
+
+    def add_inames(reduction, rec):
+        inames.update(reduction.inames)
+
+    ReductionCallbackMapper(add_inames)(expr)
+    return inames
+
+
+def fuse_reductions(knl):
+    """
+    Returns a copy of ``knl`` in which the full reductions (such as the ones
+    of ``np.sum(x)``) over the same iteration space are computed in a single
+    loop nest, with an accumulator per reduction.
+
+    Walking the instructions in order, a reduction joins the group of an
+    earlier reduction over the same domain if it does not read any array
+    written since the first reduction of the group. The reductions of a
+    group are then made to share the inames of the first one, as a
+    simultaneous reduction (see :class:`loopy.Reduction`), and also depend
+    on the instructions the first one depends on, so that loopy schedules
+    them into the same loops. The instructions of the fused reductions are tagged
+    as :data:`FUSED_REDUCTION_TAG`.
+
+    :arg knl: An instance of :class:`loopy.LoopKernel`, as returned by
+        :meth:`Stack.end_computation_stack`.
+    """
+    get_used_names = UsedNameGetter(knl.substitutions)
+
+    groups = []
+    # the groups that reductions may join, by domain key, along with the
+    # names of the arrays written since their first reduction
+    open_groups = {}
+
+    for insn in knl.instructions:
+        reduction = _get_full_reduction(knl, insn)
+        if reduction is not None:
+            key = _get_reduction_domain_key(knl, reduction)
+            read_names = get_used_names(insn.expression)
+            group, written_names = open_groups.get(key, (None, None))
+
+            if group is not None and not (read_names & written_names):
+                group.append(insn)
+            else:
+                group = [insn]
+                groups.append(group)
+                open_groups[key] = (group, set())
+
+        for group, written_names in open_groups.values():
+            written_names.update(insn.assignee_var_names())
+
+    groups = [group for group in groups if len(group) > 1]
+    if not groups:
+        return knl
+
+    substitutions = knl.substitutions.copy()
+    domains = list(knl.domains)
+    depends_on = dict((insn.id, set(insn.depends_on)) for insn in
+            knl.instructions)
+    fused_ids = set()
+    replaced_inames = set()
+
+    for group in groups:
+        leader = group[0]
+        inames = _get_full_reduction(knl, leader).inames
+
+        for insn in group:
+            rule = substitutions[insn.expression.function.name]
+            renames = dict(zip(rule.expression.inames, inames))
+            reduction = VariableRenamer(lambda name: renames.get(name,
+                name))(rule.expression)
+            substitutions[rule.name] = rule.copy(expression=lp.Reduction(
+                reduction.operation, reduction.inames, reduction.expr,
+                allow_simultaneous=True))
+
+            if insn is leader:
+                continue
+
+            # the instruction might share the substitution of the leader (as
+            # identical reductions are hash-consed), whose inames are kept
+            replaced_inames.update(iname for iname, new_iname in
+                    renames.items() if iname != new_iname)
+
+            # hoisted next to the leader: the dependents of the instruction
+            # inherit its dependencies
+            for insn_id, insn_depends_on in depends_on.items():
+                if insn.id in insn_depends_on:
+                    insn_depends_on.update(depends_on[insn.id])
+            # the instruction keeps its own dependencies, e.g. on the writers
+            # of the arrays it reads
+            depends_on[insn.id] |= depends_on[leader.id]
+
+        fused_ids.update(insn.id for insn in group)
+
+    # the domains of the replaced inames are dropped, unless a reduction still
+    # uses them
+    used_inames = set()
+    for rule in substitutions.values():
+        used_inames.update(_get_reduction_inames(rule.expression))
+    for insn in knl.instructions:
+        used_inames.update(insn.within_inames | insn.reduction_inames())
+
+    def is_replaced(domain):
+        domain_inames = frozenset(domain.get_var_names(isl.dim_type.set))
+        return (domain_inames and domain_inames <= replaced_inames
+                and used_inames.isdisjoint(domain_inames))
+
+    domains = [domain for domain in domains if not is_replaced(domain)]
+
+    # the instructions of a group are placed next to each other
+    group_of = dict((insn.id, group) for group in groups for insn in group)
+    instructions = []
+    for insn in knl.instructions:
+        if insn.id in group_of:
+            group = group_of[insn.id]
+            if insn is not group[0]:
+                continue
+            members = group
+        else:
+            members = [insn]
+
+        for member in members:
+            tags = member.tags
+            if member.id in fused_ids:
+                tags = tags | frozenset([FUSED_REDUCTION_TAG])
+            instructions.append(member.copy(
+                depends_on=frozenset(depends_on[member.id] - set([member.id])),
+                tags=tags))
+
+    return knl.copy(instructions=instructions, substitutions=substitutions,
+            domains=domains)
+
+
+def _get_sweep_iname(knl, insn):
+    """
+    Returns the iname of the axis along which the scan instruction ``insn``
+    sweeps, i.e. the iname bounding the scan iname of its reduction.
+    """
+    scan_iname, = insn.expression.inames
+    domain = knl.get_inames_domain(frozenset([scan_iname]))
+
+    for constraint in domain.get_constraints():
+        coeffs = constraint.get_coefficients_by_name()
+        if scan_iname in coeffs:
+            candidates = set(coeffs) & insn.within_inames
+            if candidates:
+                sweep_iname, = candidates
+                return sweep_iname
+
+    raise ValueError("could not find the sweep iname of '{}'".format(insn.id))
+
+
+def realize_scans(knl, parallel=False):
+    """
+    Returns a copy of ``knl`` with the scans of :meth:`Stack.cumsum` realized
+    via :func:`loopy.realize_reduction`. A scan whose sweep iname is tagged
+    as ``l.*`` is realized as a parallel scan in local memory, otherwise as a
+    sequential scan performing a single pass over the scanned axis.
+
+    :arg knl: An instance of :class:`loopy.LoopKernel`, as returned by
+        :meth:`Stack.end_computation_stack` with ``scans=None``.
+    :arg parallel: If *True*, the untagged sweep inames are tagged as
+        ``l.0``, so that the scans are realized in parallel. The scanned axes
+        then need to fit into a single work group, and as loopy cannot
+        synchronize between work groups, the instructions consuming the scans
+        have to be executed in the same work group.
+    """
+    scan_insn_ids = [insn.id for insn in knl.instructions if SCAN_INSN_TAG in
+            insn.tags]
+
+    if not scan_insn_ids:
+        return knl
+
+    if parallel:
+        # the accumulators of the parallel scans are temporaries, whose types
+        # are taken from the instructions
+        knl = lp.infer_unknown_types(knl)
+
+        for insn_id in scan_insn_ids:
+            sweep_iname = _get_sweep_iname(knl, knl.id_to_insn[insn_id])
+            if not knl.iname_to_tags.get(sweep_iname):
+                knl = lp.tag_inames(knl, {sweep_iname: "l.0"})
+
+    # loopy realizes the reductions of the instructions, hence the
+    # substitutions invoked by the scans must be expanded first
+    knl = lp.expand_subst(knl, within="tag:" + SCAN_INSN_TAG)
+
+    for insn_id in scan_insn_ids:
+        knl = lp.realize_reduction(knl, insn_id_filter=insn_id,
+                force_scan=True, force_outer_iname_for_scan=_get_sweep_iname(
+                    knl, knl.id_to_insn[insn_id]))
+
+    return knl
+
+
+def tile_contractions(knl, tile_size=16, parallel=True):
+    """
+    Returns a copy of ``knl`` with the evaluated contractions of
+    :meth:`Stack.einsum` (and hence :meth:`Stack.dot` and
+    :meth:`Stack.matmul`) blocked into tiles of ``tile_size``. The last two
+    output inames and the contracted inames of every contraction are split
+    by ``tile_size``, so that the contraction proceeds tile by tile.
+
+    :arg parallel: If *True*, the tiles of the output are mapped to work
+        groups and the elements of a tile to the work items of a work group,
+        the last output axis being the fastest varying one. As loopy expects
+        every instruction of a kernel to use all of its hardware axes, this
+        suits kernels evaluating only contractions.
+    """
+    contraction_insns = [insn for insn in knl.instructions if
+            CONTRACTION_INSN_TAG in insn.tags]
+    tiled_inames = set()
+
+    for insn in contraction_insns:
+        out_inames = tuple(idx.name for idx in insn.assignee.index_tuple)
+        rule = knl.substitutions[insn.expression.function.name]
+
+        for axis, iname in enumerate(out_inames[::-1][:2]):
+            if parallel:
+                outer_tag, inner_tag = "g.%d" % axis, "l.%d" % axis
+            else:
+                outer_tag, inner_tag = None, None
+            knl = lp.split_iname(knl, iname, tile_size, outer_tag=outer_tag,
+                    inner_tag=inner_tag)
+
+        for iname in rule.expression.inames:
+            if iname not in tiled_inames:
+                knl = lp.split_iname(knl, iname, tile_size)
+                tiled_inames.add(iname)
+
+    return knl
+
+
+def _get_transposed_inames(knl, insn, tile_size):
+    """
+    Returns a tuple ``read_iname, write_iname`` of the inames of the
+    transpose materialized by ``insn`` along which the reads and the writes
+    are contiguous, or *None* if they coincide, i.e. if the view does not
+    permute the last axis, if either is known to be shorter than
+    ``tile_size``, or if the inames were already transformed.
+    """
+    if TRANSPOSE_INSN_TAG not in insn.tags or not all(isinstance(idx,
+            Variable) for idx in insn.assignee.index_tuple):
+        return None
+
+    out_inames = tuple(idx.name for idx in insn.assignee.index_tuple)
+    rule = knl.substitutions[insn.expression.function.name]
+    if isinstance(rule.expression, Subscript):
+        indices = rule.expression.index_tuple
+    else:
+        indices = rule.expression.parameters
+
+    # the simplified views might index the arrays by affine expressions
+    if not (isinstance(indices[-1], Variable)
+            and indices[-1].name in rule.arguments):
+        return None
+
+    read_iname = out_inames[rule.arguments.index(indices[-1].name)]
+    write_iname = out_inames[-1]
+    if read_iname == write_iname:
+        return None
+
+    for iname in (read_iname, write_iname):
+        length = pw_aff_to_expr(knl.get_iname_bounds(iname).size)
+        if isinstance(length, int) and length < tile_size:
+            return None
+
+    return read_iname, write_iname
+
+
+def tile_transposes(knl, tile_size=16, parallel=True):
+    """
+    Returns a copy of ``knl`` with the materialized transposes (see
+    :data:`TRANSPOSE_INSN_TAG`) blocked into square tiles of ``tile_size``
+    along the axes of the contiguous reads and of the contiguous writes, so
+    that both the reads and the writes of a tile are contiguous. The
+    transposes with either axis shorter than a tile are left as they are.
+
+    :arg parallel: If *True*, a tile is transposed by a work group through
+        local memory: the tile is read into local memory with the work items
+        along the contiguous axis of the transposed array, and written with
+        the work items along the contiguous axis of the output. The tiles
+        are mapped to the work group axes ``g.0`` and ``g.1``, and another
+        axis of the output, if any, to ``g.2``. Otherwise the tiles are only
+        traversed one after the other, so that they stay in cache.
+    """
+    for insn in list(knl.instructions):
+        transposed_inames = _get_transposed_inames(knl, insn, tile_size)
+        if transposed_inames is None:
+            continue
+        read_iname, write_iname = transposed_inames
+        out_inames = tuple(idx.name for idx in insn.assignee.index_tuple)
+
+        if not parallel:
+            knl = lp.split_iname(knl, read_iname, tile_size)
+            knl = lp.split_iname(knl, write_iname, tile_size)
+            knl = lp.prioritize_loops(knl, [read_iname + "_outer",
+                write_iname + "_outer", read_iname + "_inner",
+                write_iname + "_inner"])
+            continue
+
+        knl = lp.split_iname(knl, write_iname, tile_size, outer_tag="g.0",
+                inner_tag="l.0")
+        knl = lp.split_iname(knl, read_iname, tile_size, outer_tag="g.1",
+                inner_tag="l.1")
+        other_inames = [iname for iname in out_inames if iname not in
+                transposed_inames]
+        if other_inames:
+            knl = lp.tag_inames(knl, {other_inames[-1]: "g.2"})
+
+        # lp.precompute misplaces the tiles of the rules invoking other rules
+        rule = knl.substitutions[insn.expression.function.name]
+        substitutions = knl.substitutions.copy()
+        substitutions[rule.name] = rule.copy(expression=SubstitutionRuleExpander(
+            knl.substitutions)(rule.expression))
+        knl = knl.copy(substitutions=substitutions)
+
+        insn_ids = frozenset(knl.id_to_insn)
+        knl = lp.precompute(knl, rule.name,
+                sweep_inames=[read_iname + "_inner", write_iname + "_inner"],
+                temporary_address_space=lp.AddressSpace.LOCAL,
+                default_tag="l.auto", within="id:" + insn.id)
+
+        # the instructions reading the tile are ordered as the transpose
+        insn = knl.id_to_insn[insn.id]
+        knl = knl.copy(instructions=[
+            other_insn.copy(depends_on=other_insn.depends_on
+                | (insn.depends_on - frozenset([other_insn.id])))
+            if other_insn.id not in insn_ids else other_insn
+            for other_insn in knl.instructions])
+
+    return knl
+
+
+def autoparallelize(knl, tf_data, local_size=32, tile_size=16):
+    """
+    Returns a copy of ``knl`` with the assignments of the evaluated variables
+    parallelized. The innermost iname of every assignment in ``tf_data`` is
+    split by ``local_size`` and tagged as ``g.0`` and ``l.0``, and the next two
+    outer inames are tagged as ``g.1`` and ``g.2``.
+
+    The inames of the reductions and of the implicit assignments (such as the
+    scatters of :meth:`ArraySymbol.__setitem__`) are left sequential, as their
+    iterations might depend on each other. Global barriers are inserted
+    between the instructions, so that each instruction is executed by a
+    separate device kernel with its own grid, and the arrays written by an
+    instruction are visible to all the work items executing the next one.
+    The assignments sharing a loop nest are executed by the same device
+    kernel.
+    The transposes are tiled through local memory by :func:`tile_transposes`.
+
+    :arg knl: An instance of :class:`loopy.LoopKernel`, as returned by
+        :meth:`Stack.end_computation_stack`.
+    :arg tf_data: The transformation data of ``knl``.
+    :arg local_size: The number of work items in a work group.
+    :arg tile_size: The length of the tiles of the transposes.
+    """
+    # the reductions fused by fuse_reductions share their loops
+    fused_inames = dict((insn.id, _get_full_reduction(knl, insn).inames) for
+            insn in knl.instructions if FUSED_REDUCTION_TAG in insn.tags)
+    # the transposes are tiled by tile_transposes
+    transposed_names = frozenset(insn.expression.function.name for insn in
+            knl.instructions if _get_transposed_inames(knl, insn, tile_size)
+            is not None)
+
+    for name, inames in sorted(tf_data.items()):
+        if not inames or name in transposed_names:
+            continue
+        if inames[-1] not in knl.all_inames():
+            # the loop nest is shared with an assignment parallelized earlier
+            continue
+
+        knl = lp.split_iname(knl, inames[-1], local_size, outer_tag="g.0",
+                inner_tag="l.0")
+        for axis, iname in enumerate(inames[-2::-1][:2]):
+            knl = lp.tag_inames(knl, {iname: "g.%d" % (axis+1)})
+
+    # the stages between the barriers are the single instructions, the
+    # instructions of the reductions fused together, or the assignments
+    # sharing a loop nest (see numloopy.simplify.fuse_loop_nests)
+    stages = []
+    for insn in knl.instructions:
+        if (stages and insn.id in fused_inames
+                and fused_inames.get(stages[-1][-1]) == fused_inames[insn.id]):
+            stages[-1].append(insn.id)
+        elif (stages and insn.within_inames and insn.within_inames
+                == knl.id_to_insn[stages[-1][-1]].within_inames):
+            stages[-1].append(insn.id)
+        else:
+            stages.append([insn.id])
+
+    def _match(stage):
+        return " or ".join("id:" + insn_id for insn_id in stage)
+
+    for stage_before, stage_after in zip(stages, stages[1:]):
+        knl = lp.add_barrier(knl, _match(stage_before), _match(stage_after),
+                synchronization_kind="global")
+
+    # the assignments sharing a loop nest read the arrays written in the
+    # stage only at the elements computed by the same work item
+    for stage in stages:
+        if len(stage) > 1:
+            knl = lp.add_nosync(knl, "global", _match(stage), _match(stage),
+                    empty_ok=True)
+
+    # after the barriers, so that the reads of the tiles follow the barriers
+    # preceding the transposes
+    knl = tile_transposes(knl, tile_size)
+
+    return knl
+
+
+def demote_internal_arrays(knl, escaping_names, max_private_size=64,
+        allow_private=True):
+    """
+    Returns a copy of ``knl`` with the array arguments which do not escape
+    the kernel turned into instances of :class:`loopy.TemporaryVariable`, so
+    that they are neither passed by nor returned to the caller.
+
+    An array with at most ``max_private_size`` elements is left to loopy to
+    be placed in private or local memory, unless ``allow_private`` is
+    *False* or the kernel has global barriers (see :func:`autoparallelize`),
+    across which only global memory is retained. Other arrays are placed in
+    global memory.
+
+    :arg escaping_names: A set of the names of the arrays that are read or
+        written by the caller, i.e. the arguments and the evaluated
+        variables of the stack.
+    """
+    has_global_barriers = any(isinstance(insn, lp.BarrierInstruction)
+            and insn.synchronization_kind == "global" for insn in
+            knl.instructions)
+
+    args = []
+    temporary_variables = knl.temporary_variables.copy()
+
+    for arg in knl.args:
+        if arg.name in escaping_names or not isinstance(arg, lp.ArrayArg):
+            args.append(arg)
+            continue
+
+        # arrays with symbolic axis lengths are not bounded in size
+        if (allow_private and not has_global_barriers
+                and all(isinstance(axis_len, int) for axis_len in arg.shape)
+                and np.prod(arg.shape) <= max_private_size):
+            address_space = lp.auto
+        else:
+            address_space = lp.AddressSpace.GLOBAL
+
+        temporary_variables[arg.name] = lp.TemporaryVariable(arg.name,
+                dtype=arg.dtype, shape=arg.shape, dim_tags=arg.dim_tags,
+                address_space=address_space)
+
+    if len(args) == len(knl.args):
+        return knl
+
+    return knl.copy(args=args, temporary_variables=temporary_variables)
+
+
+class _ReductionDetector(WalkMapper):
+    """
+    Mapper setting :attr:`has_reduction` if an expression evaluates a
+    reduction, not looking into the substitutions it invokes.
+    """
+    def __init__(self):
+        self.has_reduction = False
+
+    def map_reduction(self, expr):
+        self.has_reduction = True
+
+
+class _ReductionFinder(object):
+    """
+    Returns *True* if an expression evaluates a reduction, including in the
+    substitutions it invokes, directly or not.
+    """
+    def __init__(self, substitutions):
+        self.substitutions = substitutions
+        self.get_used_names = UsedNameGetter(substitutions)
+        self.rule_has_reduction = {}
+        # the substitutions invoking no reduction, directly or not
+        self.reduction_free_rules = set()
+
+    def has_reduction(self, expr):
+        detector = _ReductionDetector()
+        detector(expr)
+        return detector.has_reduction
+
+    def __call__(self, expr):
+        if self.has_reduction(expr):
+            return True
+
+        # a worklist rather than a recursion, as the chains of substitutions
+        # of long computations are deeper than the recursion limit
+        visited = set()
+        worklist = [name for name in self.get_used_names.get_names(expr) if
+                name in self.substitutions]
+        while worklist:
+            name = worklist.pop()
+            if name in visited or name in self.reduction_free_rules:
+                continue
+            visited.add(name)
+            if name not in self.rule_has_reduction:
+                self.rule_has_reduction[name] = self.has_reduction(
+                        self.substitutions[name].expression)
+            if self.rule_has_reduction[name]:
+                return True
+            worklist.extend(callee for callee in
+                    self.get_used_names.get_rule_names(name) if callee in
+                    self.substitutions)
+
+        self.reduction_free_rules.update(visited)
+        return False
+
+
+def _is_phase_boundary(insn, find_reduction):
+    """
+    Returns *True* if ``insn`` evaluates a reduction (or a scan), or assigns
+    a part of an array, as the scatters of :meth:`ArraySymbol.__setitem__`.
+    """
+    if not (isinstance(insn, lp.Assignment)
+            and isinstance(insn.assignee, Subscript)):
+        return True
+
+    indices = insn.assignee.index_tuple
+    if not (all(isinstance(idx, Variable) for idx in indices)
+            and len(set(indices)) == len(indices)):
+        return True
+
+    return find_reduction(insn.expression)
+
+
+def _get_sub_kernel(knl, instructions, name):
+    """
+    Returns a copy of ``knl`` computing only ``instructions``, with the
+    domains, the arguments and the substitutions they use.
+    """
+    get_used_names = UsedNameGetter(knl.substitutions)
+    names = set()
+    expanded_rules = set()
+    for insn in instructions:
+        names |= (insn.within_inames
+                | get_used_names(insn.expression, expanded_rules)
+                | get_used_names(insn.assignee, expanded_rules))
+
+    domains = [domain for domain in knl.domains if not
+            names.isdisjoint(domain.get_var_names(isl.dim_type.set))]
+    if not domains:
+        # the instructions assigning scalars are outside of any loop
+        domains = [isl.BasicSet.universe(isl.Space.create_from_names(
+            knl.isl_context, set=[]))]
+    args = [arg for arg in knl.args if arg.name in names and not
+            isinstance(arg, lp.ValueArg)]
+
+    # the parameters of the domains and of the shapes of the arrays
+    parameters = set()
+    for domain in domains:
+        parameters.update(domain.get_var_names(isl.dim_type.param))
+    for arg in args:
+        parameters.update(get_shape_parameters(arg.shape))
+    args.extend(arg for arg in knl.args if isinstance(arg, lp.ValueArg)
+            and arg.name in parameters)
+
+    insn_ids = frozenset(insn.id for insn in instructions)
+
+    return knl.copy(
+            name=name,
+            instructions=[insn.copy(depends_on=insn.depends_on & insn_ids) for
+                insn in instructions],
+            domains=domains,
+            args=args,
+            temporary_variables=dict((tv_name, tv) for tv_name, tv in
+                knl.temporary_variables.items() if tv_name in names),
+            substitutions=dict((rule_name, rule) for rule_name, rule in
+                knl.substitutions.items() if rule_name in names))
+
+
+def split_kernel(knl, max_statements):
+    """
+    Returns an instance of :class:`list` of kernels computing the
+    instructions of ``knl`` one after the other, so that loopy schedules the
+    kernels separately and each kernel can be transformed with its own
+    launch configuration.
+
+    The kernel is cut only before and after the instructions evaluating a
+    reduction (or a scan) or assigning a part of an array (as the scatters
+    of :meth:`ArraySymbol.__setitem__`), once the current kernel has at
+    least ``max_statements`` instructions, so that the element-wise
+    assignments between them stay in a single kernel.
+
+    The arrays used by several kernels are arguments of each of them, and
+    the dependencies across the kernels are dropped, as the kernels are to be
+    executed in order (see :class:`CompiledProgram`).
+
+    :arg knl: An instance of :class:`loopy.LoopKernel`, as returned by
+        :meth:`Stack.end_computation_stack` before its transformations.
+    """
+    find_reduction = _ReductionFinder(knl.substitutions)
+
+    parts = [[]]
+    after_boundary = False
+    for insn in knl.instructions:
+        boundary = _is_phase_boundary(insn, find_reduction)
+        if len(parts[-1]) >= max_statements and (boundary or after_boundary):
+            parts.append([])
+        parts[-1].append(insn)
+        after_boundary = boundary
+
+    if len(parts) == 1:
+        return [knl]
+
+    return [_get_sub_kernel(knl, instructions, "{}_{}".format(knl.name, i))
+            for i, instructions in enumerate(parts)]
@@ -1,6 +1,5 @@
 import sys
 import numpy
-import loopy as lp
 import pyopencl as cl
 import numloopy as nplp
 from loopy.version import LOOPY_USE_LANGUAGE_VERSION_2018_2  # noqa: F401
@@ -122,13 +121,10 @@ def test_qudrant_splitting(ctx_factory):
         indices = idx_ll + idx_ul + idx_lr + idx_ur - 1
         x_new[indices, :] = x
 
-        knl = np.end_computation_stack([midpoint, is_lower, is_left,
-            num_ll, num_ul, num_lr, indices, x_new])
-        knl = lp.set_options(knl, return_dict=True)
+        knl = np.compile(inputs=(x, ), outputs=(x_new, ))
+        evt, (out_x_new, ) = knl(queue, x_in)
 
-        knl, out_dict = knl(queue, **{x.name: x_in})
-
-        return out_dict[x_new.name].get()
+        return out_x_new
 
     def func_np(x_in):
         import numpy as np
@@ -161,7 +157,7 @@ def test_qudrant_splitting(ctx_factory):
         return x_new
 
     x = numpy.random.randn(1000, 2)
-    nplp_xnew = func_np(x)
+    nplp_xnew = func_nplp(x)
     np_xnew = func_np(x)
 
     assert numpy.allclose(np_xnew, nplp_xnew)
@@ -1,6 +1,8 @@
 import sys
 import numpy
+import pytest
 import pyopencl as cl
+import pyopencl.array  # noqa: F401
 import numloopy as nplp
 from loopy.version import LOOPY_USE_LANGUAGE_VERSION_2018_2  # noqa: F401
 
@@ -83,6 +85,733 @@ def test_broadcast(ctx_factory):
     assert numpy.allclose(np_y, nplp_y)
 
 
+def test_hash_consing(ctx_factory):
+    ctx = ctx_factory()
+    queue = cl.CommandQueue(ctx)
+
+    np = nplp.begin_computation_stack()
+
+    a = np.arange(10)
+    b = (1 - (a < 5))*a
+    num_substs = len(np.registered_substitutions)
+    c = (1 - (a < 5))*a
+
+    assert c.name == b.name
+    assert len(np.registered_substitutions) == num_substs
+
+    knl = np.end_computation_stack([b, c])
+    evt, (out_b, out_c) = knl(queue)
+
+    a_np = numpy.arange(10)
+    assert numpy.allclose(out_b.get(), (1 - (a_np < 5))*a_np)
+    assert numpy.allclose(out_c.get(), (1 - (a_np < 5))*a_np)
+
+
+def test_long_chain(ctx_factory):
+    ctx = ctx_factory()
+    queue = cl.CommandQueue(ctx)
+
+    np = nplp.begin_computation_stack()
+
+    x = np.argument(16)
+    y = x
+    for i in range(50):
+        y = y + i
+
+    assert np.get_substitution(y.name).name == y.name
+
+    knl = np.compile(outputs=(y, ))
+    x_in = numpy.random.rand(16)
+    evt, (out_y, ) = knl(queue, x_in)
+
+    assert numpy.allclose(out_y, x_in + sum(range(50)))
+
+
+def test_finalize_deep_chain():
+    # thousands of chained substitutions, deeper than the recursion limit
+    np = nplp.begin_computation_stack()
+    x = np.argument(10)
+    y = x
+    for _ in range(2000):
+        y = y*1.0001 + 1
+
+    knl = np.end_computation_stack([y], cache=False)
+    assert y.name in knl.substitutions
+
+
+def test_kernel_cache(ctx_factory, tmpdir):
+    ctx = ctx_factory()
+    queue = cl.CommandQueue(ctx)
+
+    np = nplp.begin_computation_stack()
+
+    A = np.arange(9).reshape((3, 3))  # noqa: N806
+    x = np.arange(3)
+    y = np.sum(A * x, axis=1)
+
+    cache = nplp.KernelCache(persistent=True, container_dir=str(tmpdir))
+    knl = np.end_computation_stack([y], cache=cache)
+
+    assert np.end_computation_stack([y], cache=cache) is knl
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    # a new cache must be served by the on-disk tier
+    cache = nplp.KernelCache(persistent=True, container_dir=str(tmpdir))
+    knl = np.end_computation_stack([y], cache=cache)
+
+    assert (cache.hits, cache.misses) == (1, 0)
+
+    evt, (out_y, ) = knl(queue)
+
+    assert numpy.allclose(out_y.get(),
+            numpy.arange(9).reshape((3, 3)) @ numpy.arange(3))
+
+
+def test_einsum(ctx_factory):
+    ctx = ctx_factory()
+    queue = cl.CommandQueue(ctx)
+
+    np = nplp.begin_computation_stack()
+
+    A = np.arange(35*20).reshape((35, 20))  # noqa: N806
+    B = np.arange(20*17).reshape((20, 17))  # noqa: N806
+    x = np.arange(20)
+
+    y = np.dot(A, x)
+    z = np.einsum("i,i", x, x)
+    C = A @ B  # noqa: N806
+
+    knl = np.end_computation_stack([y, z, C])
+    evt, (out_y, out_z, out_C) = knl(queue)  # noqa: N806
+
+    A_np = numpy.arange(35*20).reshape((35, 20))  # noqa: N806
+    B_np = numpy.arange(20*17).reshape((20, 17))  # noqa: N806
+    x_np = numpy.arange(20)
+
+    assert numpy.array_equal(out_y.get(), A_np @ x_np)
+    assert numpy.array_equal(out_z.get(), [x_np @ x_np])
+    assert numpy.array_equal(out_C.get(), A_np @ B_np)
+
+    knl = nplp.tile_contractions(np.end_computation_stack([C]), tile_size=8)
+    evt, (out_C, ) = knl(queue)  # noqa: N806
+
+    assert numpy.array_equal(out_C.get(), A_np @ B_np)
+
+
+def test_autoparallelize(ctx_factory):
+    ctx = ctx_factory()
+    queue = cl.CommandQueue(ctx)
+
+    np = nplp.begin_computation_stack()
+
+    a = np.arange(1000).reshape((250, 4))
+    b = 2*a + 1
+    c = np.sum(b, axis=1)
+    d = np.cumsum(c)
+    E = a.reshape((40, 25)) @ a.reshape((25, 40))  # noqa: N806
+
+    knl = np.end_computation_stack([b, c, d, E], transform="auto",
+            scans="parallel")
+    # d is computed by the scan, and hence written to its array first
+    evt, (out_d, out_b, out_c, out_E) = knl(queue)  # noqa: N806
+
+    a_np = numpy.arange(1000).reshape((250, 4))
+
+    assert numpy.array_equal(out_b.get(), 2*a_np + 1)
+    assert numpy.array_equal(out_c.get(), (2*a_np + 1).sum(axis=1))
+    assert numpy.array_equal(out_d.get(),
+            numpy.cumsum((2*a_np + 1).sum(axis=1)))
+    assert numpy.array_equal(out_E.get(),
+            a_np.reshape((40, 25)) @ a_np.reshape((25, 40)))
+
+
+def test_compile(ctx_factory):
+    ctx = ctx_factory()
+    queue = cl.CommandQueue(ctx)
+
+    np = nplp.begin_computation_stack()
+
+    x = np.argument(100)
+    y = np.argument(100)
+    z = 2*x + y
+    s = np.sum(z)
+
+    knl = np.compile(outputs=(z, s))
+
+    x_np = numpy.random.randn(100)
+    y_np = numpy.random.randn(100)
+
+    for i in range(2):
+        evt, (out_z, out_s) = knl(queue, x_np, y_np)
+
+        assert numpy.allclose(out_z, 2*x_np + y_np)
+        assert numpy.allclose(out_s, (2*x_np + y_np).sum())
+
+    knl = np.compile(inputs=(y, x), outputs=(z, ))
+    evt, (out_z, ) = knl(queue, cl.array.to_device(queue, y_np),
+            cl.array.to_device(queue, x_np))
+
+    assert numpy.allclose(out_z.get(), 2*x_np + y_np)
+
+    z_buf = cl.array.empty(queue, 100, numpy.float64)
+    evt, (out_z, ) = knl(queue, cl.array.to_device(queue, y_np),
+            cl.array.to_device(queue, x_np), out=(z_buf, ))
+
+    assert out_z is z_buf
+    assert numpy.allclose(z_buf.get(), 2*x_np + y_np)
+
+
+def test_materialization_planner(ctx_factory):
+    ctx = ctx_factory()
+    queue = cl.CommandQueue(ctx)
+
+    np = nplp.begin_computation_stack()
+
+    x = np.arange(1000)
+    total = np.sum(x)
+    y = x - total
+    z = x*total
+
+    # the sum would otherwise be reduced for every element of y and z
+    from numloopy.planner import plan_materialization
+    assert total.name in plan_materialization(np, (y, z))
+
+    knl = np.end_computation_stack([y, z])
+    evt, (out_y, out_z) = knl(queue)
+
+    assert numpy.allclose(out_y.get(), numpy.arange(1000) - 499500)
+    assert numpy.allclose(out_z.get(), numpy.arange(1000)*499500)
+
+
+def test_symbolic_shapes(ctx_factory):
+    ctx = ctx_factory()
+    queue = cl.CommandQueue(ctx)
+
+    np = nplp.begin_computation_stack()
+
+    x = np.argument(("n", 3))
+    y = np.sum(x, axis=1)
+    z = x.reshape(("3*n", )) + np.ones("3*n")
+
+    knl = np.compile(outputs=(y, z))
+
+    # a single kernel serves all the sizes, n being inferred from x
+    for n in [5, 17]:
+        x_in = numpy.random.rand(n, 3)
+        evt, (out_y, out_z) = knl(queue, x_in)
+
+        assert numpy.allclose(out_y, x_in.sum(axis=1))
+        assert numpy.allclose(out_z, x_in.ravel() + 1)
+
+    np = nplp.begin_computation_stack()
+    a = np.arange("m")
+
+    knl = np.compile(outputs=(a, ))
+    evt, (out_a, ) = knl(queue, m=7, out_host=True)
+
+    assert numpy.allclose(out_a, numpy.arange(7))
+
+
+def test_incremental_finalization(ctx_factory):
+    ctx = ctx_factory()
+    queue = cl.CommandQueue(ctx)
+
+    np = nplp.begin_computation_stack()
+
+    a = np.arange(10)
+    a[3] = 42
+    b = 2*a
+
+    knl = np.end_computation_stack([b], cache=False)
+    steps = np.finalization_steps[:]
+
+    # finalizing leaves the stack unchanged
+    knl_again = np.end_computation_stack([b], cache=False)
+    assert knl_again.instructions == knl.instructions
+
+    c = b + 1
+    knl = np.end_computation_stack([b, c], cache=False)
+    evt, (out_b, out_c) = knl(queue)
+
+    # only the substitutions added since are converted
+    assert all(step is new_step for step, new_step in zip(steps,
+        np.finalization_steps))
+
+    a_np = numpy.arange(10)
+    a_np[3] = 42
+    assert numpy.array_equal(out_b.get(), 2*a_np)
+    assert numpy.array_equal(out_c.get(), 2*a_np + 1)
+
+    # the steps following a converted one are converted too, as they might
+    # read the arrays of the earlier steps
+    np = nplp.begin_computation_stack()
+    x = np.argument(10)
+    a = 2*x
+    c = a + 1
+    np.end_computation_stack([a, c], cache=False)
+    knl = np.end_computation_stack([c], cache=False)
+    x_in = numpy.random.rand(10)
+    evt, (out_c, ) = knl(queue, **{np.substs_to_arrays[x.name]: x_in})
+    assert numpy.allclose(out_c, 2*x_in + 1)
+
+
+def test_concurrent_stacks(ctx_factory):
+    ctx = ctx_factory()
+    queue = cl.CommandQueue(ctx)
+
+    def build(n):
+        np = nplp.begin_computation_stack()
+        x = np.arange(n)
+        y = np.sum(x*x)
+        return np, np.end_computation_stack([y])
+
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(4) as pool:
+        results = list(pool.map(build, range(10, 30)))
+
+    for n, (np, knl) in zip(range(10, 30), results):
+        # the stacks share no state
+        assert len(np.registered_substitutions) == 3
+        evt, (out, ) = knl(queue)
+        assert out.get()[0] == sum(i*i for i in range(n))
+
+
+def test_collect_stats(ctx_factory):
+    ctx = ctx_factory()
+    queue = cl.CommandQueue(ctx)
+
+    with nplp.collect_stats() as stats:
+        np = nplp.begin_computation_stack()
+        x = np.argument(10)
+        y = np.sum(x*x)
+        knl = np.compile(outputs=(y, ), cache=False)
+        evt, (out_y, ) = knl(queue, numpy.arange(10.))
+
+    assert out_y[0] == 285
+
+    import json
+    stats_dict = json.loads(stats.to_json())
+    for phase in ["register", "domains", "plan", "convert", "simplify",
+            "make_kernel", "transform", "end_computation_stack", "codegen"]:
+        assert stats_dict["phases"][phase]["calls"] > 0
+    assert stats_dict["counts"]["rules"] == len(np.registered_substitutions)
+
+    # nothing is recorded outside the context
+    np.end_computation_stack([y], cache=False)
+    assert stats.calls["end_computation_stack"] == 1
+
+
+def test_dtype_promotion(ctx_factory):
+    ctx = ctx_factory()
+    queue = cl.CommandQueue(ctx)
+
+    np = nplp.begin_computation_stack()
+    x = np.argument(300, dtype=numpy.float32)
+    n = np.argument(300, dtype=numpy.int32)
+
+    y = 2.0*x
+    z = n*x
+    is_small = n < 50
+    total = np.sum(is_small)
+
+    assert y.dtype.numpy_dtype == numpy.float32
+    assert z.dtype.numpy_dtype == numpy.float64
+    assert is_small.dtype.numpy_dtype == numpy.int8
+    assert total.dtype.numpy_dtype == numpy.int_
+
+    knl = np.compile(inputs=(x, n), outputs=(y, z, is_small, total))
+    x_in = numpy.random.rand(300).astype(numpy.float32)
+    n_in = numpy.random.randint(-100, 100, 300).astype(numpy.int32)
+    evt, (out_y, out_z, out_is_small, out_total) = knl(queue, x_in, n_in)
+
+    assert out_y.dtype == numpy.float32
+    assert numpy.allclose(out_y, 2*x_in)
+    assert numpy.allclose(out_z, n_in*x_in)
+    assert numpy.array_equal(out_is_small, n_in < 50)
+    # would overflow if accumulated in the type of the operand
+    assert out_total[0] == numpy.sum(n_in < 50)
+
+    # the operands are computed in the type of the result: 16777217 has no
+    # exact float32 representation
+    np = nplp.begin_computation_stack()
+    m = np.argument(1, dtype=numpy.int32)
+    w = np.argument(1, dtype=numpy.float32)
+    knl = np.compile(inputs=(m, w), outputs=(m*w, ))
+    evt, (out, ) = knl(queue, numpy.array([16777217], dtype=numpy.int32),
+            numpy.array([1.0], dtype=numpy.float32))
+    assert out.dtype == numpy.float64
+    assert out[0] == 16777217.0
+
+
+def test_reductions(ctx_factory):
+    ctx = ctx_factory()
+    queue = cl.CommandQueue(ctx)
+
+    np = nplp.begin_computation_stack()
+    x = np.argument((4, 6))
+    n = np.argument((4, 6), dtype=numpy.int32)
+
+    results = (
+            np.max(x, axis=1),
+            np.min(x, axis=0, keepdims=True),
+            np.prod(n, axis=-1),
+            np.mean(x),
+            np.mean(n, axis=0),
+            np.argmax(x),
+            np.argmin(x, axis=1),
+            np.any(n > 3, axis=0),
+            np.all(n > -3),
+            # normalization in the same kernel
+            x - np.mean(x, axis=1, keepdims=True))
+
+    knl = np.compile(inputs=(x, n), outputs=results)
+    x_in = numpy.random.rand(4, 6)
+    n_in = numpy.random.randint(-3, 5, (4, 6)).astype(numpy.int32)
+    evt, outs = knl(queue, x_in, n_in)
+
+    expected = (
+            x_in.max(axis=1),
+            x_in.min(axis=0, keepdims=True),
+            n_in.prod(axis=-1),
+            x_in.mean(),
+            n_in.mean(axis=0),
+            x_in.argmax(),
+            x_in.argmin(axis=1),
+            (n_in > 3).any(axis=0),
+            (n_in > -3).all(),
+            x_in - x_in.mean(axis=1, keepdims=True))
+
+    for out, result in zip(outs, expected):
+        assert out.size == numpy.size(result)
+        assert numpy.allclose(out.ravel(), numpy.ravel(result))
+
+
+def test_fused_reductions(ctx_factory):
+    ctx = ctx_factory()
+    queue = cl.CommandQueue(ctx)
+
+    np = nplp.begin_computation_stack()
+    x = np.argument(100)
+    total = np.sum(x)
+    results = (total, np.sum(x*x), np.max(x),
+            # reads the sum, hence cannot share its loop
+            np.sum(x - total))
+
+    knl = np.end_computation_stack(results)
+    from numloopy.transform import FUSED_REDUCTION_TAG
+    fused = [insn for insn in knl.instructions if FUSED_REDUCTION_TAG in
+            insn.tags]
+    assert len(fused) == 3
+
+    x_in = numpy.random.rand(100)
+    evt, outs = knl(queue, arr=x_in)
+    expected = (x_in.sum(), (x_in*x_in).sum(), x_in.max(),
+            (x_in - x_in.sum()).sum())
+    for out, result in zip(outs, expected):
+        assert numpy.allclose(out, result)
+
+    # identical reductions share their substitution, and hence their inames
+    np = nplp.begin_computation_stack()
+    x = np.argument(10)
+    a = np.sum(x)
+    b = np.sum(x)
+    assert a.name == b.name
+
+    knl = np.compile(inputs=(x, ), outputs=(a, b))
+    x_in = numpy.random.rand(10)
+    evt, (out_a, out_b) = knl(queue, x_in)
+    assert numpy.allclose(out_a, x_in.sum())
+    assert numpy.allclose(out_b, x_in.sum())
+
+    # a fused reduction keeps its dependencies on the arrays it reads
+    np = nplp.begin_computation_stack()
+    x = np.argument(10)
+    y = 2*x
+
+    knl = np.end_computation_stack([y, np.sum(x), np.sum(y)], cache=False)
+    writer, = [insn for insn in knl.instructions if FUSED_REDUCTION_TAG not
+            in insn.tags]
+    fused = [insn for insn in knl.instructions if FUSED_REDUCTION_TAG in
+            insn.tags]
+    assert len(fused) == 2
+    # the sum of y reads the array written by ``writer``
+    assert any(writer.id in insn.depends_on for insn in fused)
+
+    # the reductions of thousands of chained substitutions, deeper than the
+    # recursion limit
+    np = nplp.begin_computation_stack()
+    x = np.argument(10)
+    y = x
+    for _ in range(2000):
+        y = y*1.0001 + 1
+
+    knl = np.end_computation_stack([np.sum(y), np.sum(x)], cache=False)
+    assert len([insn for insn in knl.instructions if FUSED_REDUCTION_TAG in
+            insn.tags]) == 2
+
+
+def test_slicing(ctx_factory):
+    ctx = ctx_factory()
+    queue = cl.CommandQueue(ctx)
+
+    np = nplp.begin_computation_stack()
+    x = np.argument((6, 8))
+    v = np.argument("n")
+
+    results = (x[1:-1], x[::2, ::-3], x[..., 2], x[None, -1, 1:5:2],
+            x[-2], v[::-1],
+            # a stencil over an axis of symbolic length
+            v[2:] - 2*v[1:-1] + v[:-2])
+
+    knl = np.compile(inputs=(x, v), outputs=results)
+    x_in = numpy.random.rand(6, 8)
+    v_in = numpy.random.rand(11)
+    evt, outs = knl(queue, x_in, v_in)
+
+    expected = (x_in[1:-1], x_in[::2, ::-3], x_in[..., 2],
+            x_in[None, -1, 1:5:2], x_in[-2], v_in[::-1],
+            v_in[2:] - 2*v_in[1:-1] + v_in[:-2])
+    for out, result in zip(outs, expected):
+        assert out.shape == result.shape
+        assert numpy.allclose(out, result)
+
+    with pytest.raises(IndexError):
+        x[6]
+
+    # negative indices into axes of symbolic lengths, which are assumed to
+    # be within the axes
+    import islpy as isl
+    np = nplp.begin_computation_stack()
+    v = np.argument("n")
+    x = np.argument(("n", 4))
+
+    knl = np.end_computation_stack([v[-1], x[-2:, ::2]], cache=False)
+    assert knl.assumptions.is_equal(isl.BasicSet("[n] -> { : n >= 2 }"))
+
+    knl = np.compile(inputs=(v, x), outputs=(v[-1], x[-2:, ::2]))
+    v_in = numpy.random.rand(5)
+    x_in = numpy.random.rand(5, 4)
+    evt, (out_v, out_x) = knl(queue, v_in, x_in)
+    assert numpy.allclose(out_v, v_in[-1])
+    assert numpy.allclose(out_x, x_in[-2:, ::2])
+
+
+@pytest.mark.parametrize("transform", [False, "auto"])
+def test_transpose(ctx_factory, transform):
+    from numloopy.transform import TRANSPOSE_INSN_TAG
+    ctx = ctx_factory()
+    queue = cl.CommandQueue(ctx)
+
+    np = nplp.begin_computation_stack()
+    x = np.argument((50, 70))
+    z = np.argument((3, 40, 20))
+
+    results = (x.T, 2*x.T + 1, np.transpose(z, (2, 0, 1)),
+            z.swapaxes(0, 1), np.moveaxis(z, 0, -1), (z*2).T)
+
+    knl = np.compile(inputs=(x, z), outputs=results, transform=transform)
+    x_in = numpy.random.rand(50, 70)
+    z_in = numpy.random.rand(3, 40, 20)
+    evt, outs = knl(queue, x_in, z_in)
+
+    expected = (x_in.T, 2*x_in.T + 1, numpy.transpose(z_in, (2, 0, 1)),
+            z_in.swapaxes(0, 1), numpy.moveaxis(z_in, 0, -1), (z_in*2).T)
+    for out, result in zip(outs, expected):
+        assert out.shape == result.shape
+        assert numpy.allclose(out, result)
+
+    knl = np.end_computation_stack([x.T], cache=False)
+    assert TRANSPOSE_INSN_TAG in knl.instructions[0].tags
+    assert x.transpose(0, 1) is x
+
+
+def test_simplification(ctx_factory):
+    from pymbolic.primitives import Subscript
+    ctx = ctx_factory()
+    queue = cl.CommandQueue(ctx)
+
+    np = nplp.begin_computation_stack()
+    x = np.argument((4, 6))
+    v = np.argument(10, dtype=numpy.int32)
+
+    results = (2*np.ones(10) + 3*np.arange(10),
+            x.reshape((24, )).reshape((6, 4)).T + np.zeros((4, 6)),
+            v*np.ones(10))
+
+    knl = np.compile(inputs=(x, v), outputs=results)
+    x_in = numpy.random.rand(4, 6)
+    v_in = numpy.arange(10, dtype=numpy.int32)
+    evt, outs = knl(queue, x_in, v_in)
+
+    expected = (2 + 3*numpy.arange(10), x_in.reshape((6, 4)).T,
+            v_in*numpy.ones(10))
+    for out, result in zip(outs, expected):
+        assert out.shape == result.shape
+        assert numpy.allclose(out, result)
+
+    knl = np.end_computation_stack(results, cache=False)
+    fill, view, widened = [knl.substitutions[insn.expression.function.name]
+            for insn in knl.instructions]
+    # the constants are folded
+    assert 2.0 in fill.expression.children
+    # the views collapse into a single index map, without adding zeros
+    assert isinstance(view.expression, Subscript)
+    # multiplying by 1.0 casts the integers
+    assert len(widened.expression.children) == 2
+
+
+def test_dead_code_elimination(ctx_factory):
+    ctx = ctx_factory()
+    queue = cl.CommandQueue(ctx)
+
+    np = nplp.begin_computation_stack()
+    x = np.argument((4, 6))
+    unused = np.argument(3)
+
+    # none of these reach the output
+    np.cumsum(x, axis=0)
+    a = np.zeros(5)
+    a[1] = 3
+    np.sum(x*a[0])
+
+    y = np.sum(x, axis=1)
+
+    knl = np.end_computation_stack([y], cache=False)
+    assert len(knl.instructions) == 1
+    assert len(knl.domains) == 2
+    # the arguments are kept
+    assert set(knl.arg_dict) == {np.substs_to_arrays[x.name],
+            np.substs_to_arrays[unused.name],
+            knl.instructions[0].assignee.aggregate.name}
+
+    x_in = numpy.random.rand(4, 6)
+    evt, (out, ) = knl(queue, **{np.substs_to_arrays[x.name]: x_in,
+        np.substs_to_arrays[unused.name]: numpy.zeros(3)})
+    assert numpy.allclose(out, x_in.sum(axis=1))
+
+
+@pytest.mark.parametrize("transform", [False, "auto"])
+def test_loop_nest_fusion(ctx_factory, transform):
+    ctx = ctx_factory()
+    queue = cl.CommandQueue(ctx)
+
+    np = nplp.begin_computation_stack()
+    x = np.argument((40, 70))
+    y = 2*x + 1
+    z = y*y + x
+
+    knl = np.end_computation_stack([y, z], cache=False)
+    # both assignments are computed in a single loop nest
+    assert len(knl.domains) == 1
+    assert len(set(insn.within_inames for insn in knl.instructions)) == 1
+
+    knl = np.compile(inputs=(x, ), outputs=(y, z), transform=transform)
+    x_in = numpy.random.rand(40, 70)
+    evt, outs = knl(queue, x_in)
+    for out, result in zip(outs, (2*x_in + 1, (2*x_in + 1)**2 + x_in)):
+        assert numpy.allclose(out, result)
+
+
+def test_dependencies(ctx_factory):
+    from pymbolic.primitives import Call
+    ctx = ctx_factory()
+    queue = cl.CommandQueue(ctx)
+
+    np = nplp.begin_computation_stack()
+    x = np.argument((4, 6))
+    a = np.zeros(6)
+    a[1] = 3
+    b = a + 1
+    y = np.sum(x, axis=0)
+    z = 2*x
+
+    knl = np.end_computation_stack([b, y, z], cache=False)
+    # the statements materializing the outputs, by the names of the outputs
+    statements = dict((insn.expression.function.name, insn) for insn in
+            knl.instructions if isinstance(insn.expression, Call))
+    # the outputs are independent of each other
+    assert not statements[y.name].depends_on
+    assert not statements[z.name].depends_on
+    # the element of a is assigned before it is read
+    scatter, = [insn for insn in knl.instructions if insn.assignee.index == (1, )]
+    assert scatter.id in statements[b.name].depends_on
+
+    knl = np.compile(inputs=(x, ), outputs=(b, y, z))
+    x_in = numpy.random.rand(4, 6)
+    a_np = numpy.zeros(6)
+    a_np[1] = 3
+    evt, outs = knl(queue, x_in)
+    for out, result in zip(outs, (a_np + 1, x_in.sum(axis=0), 2*x_in)):
+        assert numpy.allclose(out, result)
+
+
+@pytest.mark.parametrize("transform", [False, "auto"])
+def test_split_kernel(ctx_factory, transform):
+    ctx = ctx_factory()
+    queue = cl.CommandQueue(ctx)
+
+    np = nplp.begin_computation_stack()
+    x = np.argument((100, 30))
+    y = 2*(x - np.sum(x, axis=0)/100) + 1
+    w = np.zeros(100)
+    w[3] = 7
+    r = w*np.sum(y*y) + np.cumsum(y[:, 0])
+
+    knl = np.end_computation_stack([y, r], scans=None, cache=False)
+    knls = np.end_computation_stack([y, r], scans=None, cache=False,
+            max_statements=1)
+    assert len(knls) > 1
+    assert (sum(len(part.instructions) for part in knls)
+            == len(knl.instructions))
+
+    prog = np.compile(inputs=(x, ), outputs=(y, r), transform=transform,
+            max_statements=1)
+    assert isinstance(prog, nplp.CompiledProgram)
+    x_in = numpy.random.rand(100, 30)
+    y_np = 2*(x_in - x_in.sum(axis=0)/100) + 1
+    w_np = numpy.zeros(100)
+    w_np[3] = 7
+    evt, (y_out, r_out) = prog(queue, x_in)
+    assert numpy.allclose(y_out, y_np)
+    assert numpy.allclose(r_out, w_np*(y_np*y_np).sum()
+            + numpy.cumsum(y_np[:, 0]))
+
+    # the intermediates stay on the device
+    evt, (y_out, r_out) = prog(queue, cl.array.to_device(queue, x_in))
+    assert numpy.allclose(r_out.get(), w_np*(y_np*y_np).sum()
+            + numpy.cumsum(y_np[:, 0]))
+
+    # thousands of chained substitutions, deeper than the recursion limit
+    np = nplp.begin_computation_stack()
+    x = np.argument(10)
+    y = x
+    for _ in range(2000):
+        y = y*1.0001 + 1
+
+    knls = np.end_computation_stack([y], cache=False, max_statements=1)
+    assert len(knls) == 1
+
+
+def test_cumsum(ctx_factory):
+    ctx = ctx_factory()
+    queue = cl.CommandQueue(ctx)
+
+    np = nplp.begin_computation_stack()
+
+    a = np.arange(24).reshape((4, 6))
+    b = np.cumsum(a, axis=1) + 100*np.cumsum(a, axis=0, exclusive=True)
+    c = np.cumsum(a) + 0
+
+    knl = np.end_computation_stack([b, c])
+    # the arrays of the scans are internal to the kernel
+    evt, (out_b, out_c) = knl(queue)
+
+    a_np = numpy.arange(24).reshape((4, 6))
+    assert numpy.array_equal(out_b.get(), numpy.cumsum(a_np, axis=1)
+            + 100*(numpy.cumsum(a_np, axis=0) - a_np))
+    assert numpy.array_equal(out_c.get(), numpy.cumsum(a_np))
+
+
 if __name__ == "__main__":
     if len(sys.argv) > 1:
         exec(sys.argv[1])